@@ -3,11 +3,12 @@
 # It includes features for motor control, camera streaming, and QR code detection.
 
 
-from flask import Flask, request, jsonify, render_template, Response , send_from_directory
+from flask import Flask, request, jsonify, render_template, Response , send_from_directory, g
 import cv2
 import time
 
 import threading
+import queue
 import json
 import math
 
@@ -17,18 +18,51 @@ import os # Ensure os is imported at the top of app.py if not already
 latest_camera_frame = None
 camera_frame_lock = threading.Lock() #
 
-from hardware import forward, backward, turn_left, turn_right, stop
-from qr import * # <--- REQUIRED: For QR code detection and camera streaming
-import serial # <--- REQUIRED: For serial communication used by ArduinoSerialComm
+from hardware import forward, backward, turn_left, turn_right, stop, init_motors, motors_active
+from sim_hardware import sim_enabled
+from replay import Replay
+replay = Replay.from_env() # NEW: ROVER_REPLAY=data/flight feeds serial, camera and clock from a recorded mission (replay.py)
+SIM_MODE = sim_enabled() or replay is not None # NEW: ROVER_SIM=1 runs on simulated motors, serial, camera and servo
+if SIM_MODE:
+    from sim_hardware import sim_motors, SimSerial, SimCamera, SimServo, SimImu
+    forward, backward, turn_left, turn_right, stop = (sim_motors.forward, sim_motors.backward, sim_motors.turn_left,
+                                                      sim_motors.turn_right, sim_motors.stop)
+    init_motors = sim_motors.init
+    motors_active = sim_motors.motors_active
+from qr import qr, DATA_FOLDER, detect_qr, record_detection, draw_qr_overlay # <--- REQUIRED: For QR code detection and camera streaming
+import qr as qr_module
+from qr_gate import QrGate
+from fresh_capture import FreshestFrameCapture, fresh_capture_enabled
 from serial_comm import ArduinoSerialComm   # <--- REQUIRED: For Arduino serial communication
 import logging # <--- REQUIRED: For logging configuration
-import board # <--- REQUIRED: For board pin definitions
-import adafruit_pca9685 # <--- REQUIRED: For PCA9685 servo control
-import busio # <--- REQUIRED: For I2C communication used by PCA9685
 from servo_cam import CameraServoController # <--- REQUIRED: For camera servo control
 from kinematics import SkidSteerOdometry, track_width_m # <--- REQUIRED: For odometry calculations
 from automation_controller import AutomationController
 from camera_scan_controller import CameraScanController
+from panorama_builder import PanoramaBuilder
+from subsystems import SubsystemRegistry
+from stream_buffers import FrameBuffer, TelemetryBuffer
+from mjpeg_streaming import MjpegClient, mjpeg_frames, parse_stream_options
+from rover_logging import get_logger, setup_logging, shutdown_logging
+import metrics
+from profiler import profiler, PROFILER_ENV
+from camera_feed import CameraSocketServer, CAMERA_SOCKET_ENV
+from frame_bus import FrameBus, FRAME_BUS_ENV
+from vision_worker import VisionWorkers, VISION_WORKERS_ENV
+from flight_recorder import FlightRecorder, FLIGHT_RECORDER_ENV
+from image_store import ImageStore
+from frame_history import FrameHistory
+from imu import ImuReader, imu_enabled
+from coverage_map import CoverageMap
+from spatial_index import QrSpatialIndex
+from telemetry_history import TelemetryHistory
+from telemetry_pipeline import TelemetryPipeline
+import realtime
+from teleop import TeleopChannel
+try:
+    from flask_sock import Sock # Optional: WebSocket teleop on the Flask server (pip install flask-sock)
+except ImportError:
+    Sock = None
 app = Flask(__name__)   
 
 # --- NEW: Code to suppress specific log messages ---
@@ -42,11 +76,33 @@ class NoEncoderGetFilter(logging.Filter):
 log.addFilter(NoEncoderGetFilter()) # Apply the filter to the logger
 # --- END NEW Code ---
 
+# --- NEW: Per-subsystem loggers (queued, so the hot loops never block on stdout) ---
+encoder_log = get_logger('encoder')
+odometry_log = get_logger('odometry')
+command_log = get_logger('command')
+
+# --- NEW: Hot-path metrics (served on /metrics) ---
+CAMERA_FRAMES = metrics.counter('rover_camera_frames_total', 'Frames read from the camera')
+CAMERA_READ_FAILURES = metrics.counter('rover_camera_read_failures_total', 'Failed cam.read() calls')
+CAMERA_READ_SECONDS = metrics.histogram('rover_camera_read_seconds', 'Latency of cam.read() in gather_img')
+CAMERA_FPS = metrics.gauge('rover_camera_fps', 'Capture frame rate (smoothed)')
+JPEG_ENCODE_SECONDS = metrics.histogram('rover_jpeg_encode_seconds', 'Time spent in cv2.imencode per streamed frame')
+JPEG_BYTES = metrics.histogram('rover_jpeg_bytes', 'Size of encoded MJPEG frames', buckets=metrics.SIZE_BUCKETS)
+PHOTO_FRAME_AGE = metrics.histogram('rover_photo_frame_age_seconds', 'Click time minus capture time of the frame picked for a photo')
+PHOTO_WRITE_SECONDS = metrics.histogram('rover_photo_write_seconds', 'Encode + store time per photo on the photo-writer thread')
+SERIAL_LINES_PARSED = metrics.counter('rover_serial_lines_parsed_total', 'Encoder lines parsed successfully')
+SERIAL_LINES_REJECTED = metrics.counter('rover_serial_lines_rejected_total', 'Encoder lines rejected (bad format or values)')
+COMMAND_TO_MOTOR_SECONDS = metrics.histogram('rover_command_to_motor_seconds', 'From /send_command request start to the motor call returning',
+                                             buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
 SERIAL_PORT_MEGA = "/dev/ttyACM0"  # Adjust to your Arduino's serial device
 BAUD_RATE_MEGA = 115200           # Adjust to match your Arduino's Serial.begin() baud rate
 
 # --- REQUIRED: Instantiate the ArduinoSerialComm for encoder data ---
-arduino_comm = ArduinoSerialComm(SERIAL_PORT_MEGA, BAUD_RATE_MEGA)
+# CHANGED: The port is opened by the 'serial' subsystem at startup (the Arduino reset takes ~2 s)
+arduino_comm = ArduinoSerialComm(SERIAL_PORT_MEGA, BAUD_RATE_MEGA, auto_connect=False) if not SIM_MODE else SimSerial(sim_motors)
+if replay:
+    arduino_comm = replay.serial # Recorded telemetry instead of the simulated wheels
 
 # --- REQUIRED: Global variables for encoder data and thread safety ---
 latest_encoder_data = {
@@ -55,9 +111,48 @@ latest_encoder_data = {
     'yaw': 0.0 # Added yaw for odometry calculations
     
 }
-encoder_data_lock = threading.Lock() # Protects access to latest_encoder_data
+encoder_data_lock = threading.Lock() # Protects access to latest_encoder_data and the odometry updates (in flight log order)
+
+clock = replay.clock if replay else time # NEW: Recorded time during a replay
+odometry = SkidSteerOdometry(track_width_m, clock=clock) # Uses track_width_m
+
+# --- NEW: Shared buffers between the producers (capture / encoder threads) and the streaming clients ---
+frame_buffer = FrameBuffer()
+telemetry_buffer = TelemetryBuffer()
+
+# --- NEW: Flight recorder (data/flight/*.rfr). On by default on the rover, opt-in (ROVER_FLIGHT_RECORDER=1) in sim;
+# record_*() calls are no-ops until start_services() starts it ---
+flight_recorder = FlightRecorder()
+
+# --- NEW: Photos and QR detection images (data/images), opened by start_services() ---
+image_store = ImageStore()
+
+# --- NEW: The last second of raw camera frames, so /take_photo answers at once with an already-captured frame ---
+frame_history = FrameHistory(capacity=30)
+
+# --- NEW: Where the rover has driven and where it saw QR codes, served as PNG tiles on /map ---
+coverage_map = CoverageMap()
+
+# --- NEW: Every place a QR code was seen (spatial_index.py), for /qr/near, /qr/nearest and the automation ---
+qr_index = QrSpatialIndex()
+
+# --- NEW: Min/max/mean pyramids of every telemetry sample (telemetry_history.py), for /telemetry/history charts ---
+telemetry_history = TelemetryHistory()
+
+def on_qr_seen(data):
+    """Marks a decoded QR code on the coverage map and in the spatial index at the rover's current position."""
+    x, y, _ = odometry.get_pose()
+    coverage_map.add_marker(data, x, y)
+    qr_index.add(data, x, y, clock.time())
+
+# --- NEW: Panorama builder fed by the camera scan sweeps (45°-135°) ---
+panorama_builder = PanoramaBuilder(min_angle=45, max_angle=135)
 
-odometry = SkidSteerOdometry(track_width_m) # Uses track_width_m
+def get_scan_frame():
+    """The first raw camera frame (no QR overlay) captured after the call, or None; used by the scan controller
+       for the panorama once the servo has settled."""
+    picked = frame_history.first_after(clock.time())
+    return picked.image() if picked is not None else None
 
 
 
@@ -71,91 +166,190 @@ odometry = SkidSteerOdometry(track_width_m) # Uses track_width_m
 
 
 
-# --- REQUIRED: Thread function to continuously read encoder data from Arduino ---
-def read_encoder_data_thread(ser_comm_obj):
-    global latest_encoder_data # Declare intent to modify global variable
-    print("[Encoder Thread] Starting to read encoder data...")
-
-    from __main__ import app # Import 'app' from the global scope of app.py
-
-    while True:
-        with app.app_context():
-            try:
-                line = ser_comm_obj.read_data() # Use the read_data method from ArduinoSerialComm
-                if line:
-                    parts = line.split(",")
-                    if len(parts) == 7:
-                        try:
-                            print(f"[Encoder Thread] Raw Line: {line}")
-                            # Parse float values 
-                            # Assuming the format is: "imu_yaw_deg,rpm1,speed1,rpm2,speed2"
-                            # Example: "45.0,100,50,120,60"
-                            imu_yaw_deg  = float(parts[0]) 
-                            imu_pitch_deg = float(parts[1]) # NEW: Parse IMU Pitch
-                            imu_roll_deg  = float(parts[2]) # NEW: Parse IMU Roll   
-                            rpm1 = float(parts[3])  
-                            speed1 = float(parts[4]) 
-                            rpm2 = float(parts[5]) 
-                            speed2 = float(parts[6]) 
-                            
-                            # Update the latest encoder data
-                            # Use a lock to ensure thread safety when updating shared data
-                            with encoder_data_lock: # Acquire lock before modifying shared data
-                                latest_encoder_data = {
-                                    'rpm1': rpm1, 'speed1': speed1, 
-                                    'rpm2': rpm2, 'speed2': speed2, 
-                                    'yaw': imu_yaw_deg,   # NEW: Store Yaw
-                                    'pitch': imu_pitch_deg, # NEW: Store Pitch
-                                    'roll': imu_roll_deg  # NEW: Store Roll
-                                }
-                            print(f"[Encoder Thread] Updated Data: {latest_encoder_data}") 
-
-                            # --- NEW: Update Odometry ---
-                            # Assuming rpm1 is left wheel RPM, rpm2 is right wheel RPM
-                            odometry.update(rpm1, rpm2, imu_yaw_deg )
-                            x, y, theta_deg = odometry.get_pose()
-                            
-    #                         return jsonify({
-    #                             'x': x, 'y': y, 'theta': theta_deg,
-    #                             'distance': absolute_distance # This value is sent to the frontend
-    # })
-                            print(f"[Odometry] X: {x:.3f} m, Y: {y:.3f} m, Theta: {theta_deg:.1f}°") # Debug print for odometry
-                        except ValueError:
-                            print(f"[Encoder Thread] Parse error for encoder data: {line}")
-                    else:
-                        print(f"[Encoder Thread] Invalid line format: {line} - expected 7 parts, got {len(parts)}")
-                else:
-                    # No data to read or serial connection might be down
-                    if not ser_comm_obj.ser or not ser_comm_obj.ser.is_open:
-                        print("[Encoder Thread] Serial not open, pausing read attempts.")
-                        time.sleep(5) # Pause longer if serial is completely disconnected
-                    else:
-                        time.sleep(0.05) # Small delay to prevent busy-looping if no data available yet
-            except Exception as e:
-                print(f"[Encoder Thread] Unexpected error processing encoder data: {e}")
-                time.sleep(1) # Sleep on error to prevent rapid crashes
+# --- CHANGED: The encoder data is processed by a staged pipeline (telemetry_pipeline.py) instead of one loop that parsed,
+# locked, integrated odometry and fed every consumer on the serial reader thread:
+#   serial line -> parse -> validate -> fuse (IMU + odometry) -> publish (latest_encoder_data, telemetry_buffer)
+#   -> subscribers on their own threads: history, flight recorder, coverage map
+ENCODER_FIELDS = ('yaw', 'pitch', 'roll', 'rpm1', 'speed1', 'rpm2', 'speed2') # Arduino line: "yaw,pitch,roll,rpm1,speed1,rpm2,speed2"
+MAX_VALID_RPM = 1000.0 # Larger readings are line noise, not wheel speed
+telemetry_pipeline = None # Built by on_serial_ready()
+
+def encoder_line_source(ser_comm_obj):
+    """The pipeline's source: the next line from the Arduino, or None."""
+    jitter = realtime.monitor('encoder') # Period between lines read (the Arduino sends them at 100 Hz)
+
+    def read_line():
+        line = ser_comm_obj.read_data()
+        if line:
+            jitter.tick(time.perf_counter())
+            encoder_log.debug("Raw Line: %s", line)
+            return line
+        if not ser_comm_obj.ser or not ser_comm_obj.ser.is_open:
+            encoder_log.warning("Serial not open, pausing read attempts.")
+            time.sleep(5) # Pause longer if serial is completely disconnected
+        return None
+    return read_line
+
+def parse_encoder_line(line, timestamp):
+    parts = line.split(",")
+    if len(parts) != len(ENCODER_FIELDS):
+        SERIAL_LINES_REJECTED.inc()
+        encoder_log.warning("Invalid line format: %s - expected %d parts, got %d", line, len(ENCODER_FIELDS), len(parts))
+        return None
+    try:
+        reading = dict(zip(ENCODER_FIELDS, map(float, parts)))
+    except ValueError:
+        SERIAL_LINES_REJECTED.inc()
+        encoder_log.warning("Parse error for encoder data: %s", line)
+        return None
+    return reading
+
+def validate_encoder_reading(reading, timestamp):
+    """Drops readings with NaN/inf or impossible wheel speeds before they reach odometry."""
+    if not all(math.isfinite(value) for value in reading.values()) or \
+            abs(reading['rpm1']) > MAX_VALID_RPM or abs(reading['rpm2']) > MAX_VALID_RPM:
+        SERIAL_LINES_REJECTED.inc()
+        encoder_log.warning("Implausible encoder reading dropped: %s", reading)
+        return None
+    SERIAL_LINES_PARSED.inc()
+    return reading
+
+def fuse_pose(reading, timestamp):
+    """Heading from the BNO08x when it is fresh, then odometry. Returns the full telemetry sample."""
+    imu_sample = imu_reader.latest() if imu_reader else None
+    if imu_sample: # The BNO08x read directly (imu.py) is fresher than the Arduino's copy
+        reading.update(yaw=imu_sample.yaw, pitch=imu_sample.pitch, roll=imu_sample.roll)
+    # Assuming rpm1 is left wheel RPM, rpm2 is right wheel RPM
+    with encoder_data_lock: # Recorded as applied, so the flight log has the pose updates (and IMU samples) in order
+        odometry.update(reading['rpm1'], reading['rpm2'], reading['yaw'], timestamp) # dt from read times, not stage run times
+        x, y, theta_deg = odometry.get_pose()
+        sample = dict(reading, x=x, y=y, theta=theta_deg)
+        flight_recorder.record_telemetry(sample, timestamp)
+    odometry_log.debug("X: %.3f m, Y: %.3f m, Theta: %.1f°", x, y, theta_deg)
+    return sample
+
+def publish_telemetry(sample, timestamp):
+    """Latest values for the polling API, then the SSE / teleop buffer."""
+    global latest_encoder_data
+    with encoder_data_lock:
+        latest_encoder_data = {field: sample[field] for field in ENCODER_FIELDS}
+    telemetry_buffer.publish(sample)
+    return sample
+
+def build_telemetry_pipeline(ser_comm_obj):
+    pipeline = TelemetryPipeline(encoder_line_source(ser_comm_obj), [
+        ('parse', parse_encoder_line),
+        ('validate', validate_encoder_reading),
+        ('fuse', fuse_pose),
+        ('publish', publish_telemetry),
+    ], clock=clock, threaded=replay is None) # A replay checks each line's pose before reading the next one
+    pipeline.subscribe('history', telemetry_history.add)
+    pipeline.subscribe('map', lambda sample, timestamp: coverage_map.update(sample['x'], sample['y']))
+    return pipeline
 
 # --- Global variable for current motor speed, initialized to a default value ---
 # This will be used to control the speed of the motors from the web interface
 current_global_motor_speed = 50
 
+# --- NEW: HTTP handler latency per endpoint ---
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        metrics.histogram('rover_http_request_seconds', 'Flask handler latency',
+                          {'endpoint': request.endpoint or 'unknown'}).observe_since(start)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- NEW: Opt-in sampling profiler (admin endpoints) ---
+@app.route('/admin/profiler')
+def profiler_status():
+    return jsonify(profiler.status())
+
+@app.route('/admin/profiler/start', methods=['POST'])
+def profiler_start():
+    started = profiler.start()
+    return jsonify({'status': 'success' if started else 'ignored', 'running': profiler.is_running()})
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+def profiler_stop():
+    stopped = profiler.stop()
+    return jsonify({'status': 'success' if stopped else 'ignored', 'running': profiler.is_running()})
+
+@app.route('/admin/profiler/reset', methods=['POST'])
+def profiler_reset():
+    profiler.reset()
+    return jsonify({'status': 'success'})
+
+@app.route('/admin/profiler/collapsed')
+def profiler_collapsed():
+    # Usable with flamegraph.pl or dropped into speedscope.app; ?thread=encoder-reader filters one thread
+    return Response(profiler.collapsed(request.args.get('thread')), mimetype='text/plain')
+
+@app.route('/admin/profiler/speedscope')
+def profiler_speedscope():
+    return jsonify(profiler.speedscope())
+
+# --- NEW: Control loop jitter and real-time mode (realtime.py) ---
+jitter_before = None # Loop reports from before the last /admin/realtime switch
+
+@app.route('/admin/jitter')
+def jitter_status():
+    return jsonify({'realtime': realtime.status(), 'loops': realtime.jitter_report(), 'before': jitter_before})
+
+@app.route('/admin/jitter/reset', methods=['POST'])
+def jitter_reset():
+    realtime.reset_jitter()
+    return jsonify({'status': 'success'})
+
+@app.route('/admin/realtime', methods=['POST'])
+def realtime_switch():
+    """{"enabled": true|false}: pins / unpins the threads now; the periods so far become the "before" report."""
+    global jitter_before
+    enabled = bool((request.get_json(silent=True) or {}).get('enabled', True))
+    jitter_before = dict(realtime=realtime.status(), loops=realtime.jitter_report())
+    realtime.reset_jitter()
+    vision_pids = [process.pid for process in vision_workers.processes] if vision_workers else []
+    return jsonify({'status': 'success', 'realtime': realtime.apply(enabled, vision_pids)})
+
+@app.route('/health')
+def health():
+    return jsonify(subsystems.status())
+
 @app.route('/')
 def index():
     return render_template('index_g.html')
 
 @app.route('/send_command', methods=['POST'])
 def send_command():
-    # global automation_active, automation_state
-
     data = request.get_json()
     command = data.get('command')
-    print(f"Received command: {command}", flush=True)
+    command_log.info("Received command: %s", command)
+    flight_recorder.record_command(command, current_global_motor_speed, source='api')
+    if not execute_command(command, current_global_motor_speed):
+        return jsonify({'status': 'ignored', 'message': 'Automation active'})
+    if command in ('forward', 'backward', 'left', 'right', 'stop') and not automation_controller.is_active():
+        COMMAND_TO_MOTOR_SECONDS.observe_since(g.request_start)
+    return jsonify({'status': 'success', 'command': command})
+
+# CHANGED: Split out of send_command() so replay.py can re-issue recorded dashboard commands
+def execute_command(command, speed):
+    """Runs a dashboard command. Returns False if it was ignored because automation is active."""
+    # global automation_active, automation_state
+
     # --- NEW: Check if automation is active ---
     if automation_controller.is_active():
 
         if command not in ['stop', 'start_automation', 'stop_automation']: # Allow stop or toggle
-            print(f"[App] Ignoring manual command '{command}' while automation is active.")
-            return jsonify({'status': 'ignored', 'message': 'Automation active'})
+            command_log.info("Ignoring manual command '%s' while automation is active.", command)
+            return False
 
     if command == 'start_automation': # <--- This handles the start command
         # automation_active.set() 
@@ -173,19 +367,53 @@ def send_command():
     else: 
         if not automation_controller.is_active():  # Only process manual commands if automation is not active
             if command == 'forward':
-                forward(current_global_motor_speed) # <--- The global speed is passed here!
+                forward(speed) # <--- The global speed is passed here!
             elif command == 'backward':
-                backward(current_global_motor_speed) # <--- The global speed is passed here!
+                backward(speed) # <--- The global speed is passed here!
             elif command == 'left':
-                turn_left(current_global_motor_speed) # <--- The global speed is passed here!
+                turn_left(speed) # <--- The global speed is passed here!
             elif command == 'right':
-                turn_right(current_global_motor_speed) # <--- The global speed is passed here!
+                turn_right(speed) # <--- The global speed is passed here!
             elif command == 'stop':
                 stop() # Stop doesn't need a speed, as it sets PWM to 0
             else:
-                print(f"Unknown command received: {command}")
-        
-    return jsonify({'status': 'success', 'command': command})
+                command_log.warning("Unknown command received: %s", command)
+    return True
+
+# --- NEW: WebSocket teleop (teleop.py): sequenced drive / speed / servo commands, newest applied, acked with latency ---
+def teleop_command(message):
+    command = message.get('command')
+    flight_recorder.record_command(command, current_global_motor_speed, source='ws')
+    return execute_command(command, current_global_motor_speed)
+
+def teleop_speed(message):
+    global current_global_motor_speed
+    speed = message.get('speed')
+    if not isinstance(speed, int) or not 0 <= speed <= 100:
+        raise ValueError("speed must be an integer from 0 to 100")
+    current_global_motor_speed = speed
+
+def teleop_servo(message):
+    camera_servo_controller = subsystems.get('servo')
+    if camera_servo_controller is None:
+        raise RuntimeError("Camera servo not ready")
+    camera_servo_controller.set_angle(message.get('angle'))
+
+teleop = TeleopChannel({'command': teleop_command, 'speed': teleop_speed, 'servo': teleop_servo}, telemetry_buffer)
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/ws/teleop')
+    def teleop_ws(ws):
+        session = teleop.open_session(lambda message: ws.send(json.dumps(message)))
+        try:
+            while not session.closed:
+                teleop.receive(session, ws.receive())
+        except Exception: # ConnectionClosed
+            pass
+        finally:
+            teleop.close_session(session)
 
 # ######################## Added for getting speed from html
 @app.route('/set_global_speed', methods=['POST'])
@@ -208,47 +436,68 @@ def get_encoder_data():
     return jsonify(data)   
 
 
+# --- CHANGED: /take_photo no longer reads the camera (which stole a frame from the stream and caught the moment
+# *after* the click) or writes to disk. It picks from frame_history and hands the pixels to the photo-writer thread. ---
+PHOTO_WINDOW_SECONDS = 0.3 # The sharpest frame of this much video before the click becomes the photo
+MAX_BURST = 15 # Half the frame history: the frames after the click must still be there when the burst is taken
+photo_jobs = queue.Queue()
+
+def photo_writer_thread():
+    """Encodes and stores photos queued by /take_photo. A job is (frames, image_ids, label), or
+       (click_time, count, image_ids, label) for a burst, whose frames after the click are waited for here."""
+    print("[Photo Writer] Started.")
+    while True:
+        job = photo_jobs.get()
+        if job is None:
+            break
+        if len(job) == 4:
+            clicked, count, image_ids, label = job
+            frames = frame_history.around(clicked, count)
+        else:
+            frames, image_ids, label = job
+        for n, (picked, image_id) in enumerate(zip(frames, image_ids)):
+            write_start = time.perf_counter()
+            try:
+                jpeg_bytes = picked.jpeg if picked.jpeg is not None else cv2.imencode('.jpg', picked.frame)[1].tobytes()
+                image_store.add(jpeg_bytes, kind='photo', label=label if len(image_ids) == 1 else f"{label}_{n + 1}",
+                                timestamp=picked.timestamp, image_id=image_id)
+            except Exception as e:
+                print(f"ERROR: Failed to save photo {image_id}: {e}")
+            PHOTO_WRITE_SECONDS.observe_since(write_start)
+        if len(frames) < len(image_ids):
+            print(f"[Photo Writer] Burst got {len(frames)} of {len(image_ids)} frames.")
+        print(f"Photo stored as image(s) {', '.join(str(i) for i in image_ids[:len(frames)])}")
+
+photo_writer = threading.Thread(target=photo_writer_thread, name="photo-writer", daemon=True) # Started by start_services()
+
 @app.route('/take_photo', methods=['POST'])
 def take_photo():
-
+    """Body (optional): {"mode": "sharpest" | "burst", "window": seconds, "count": burst frames}."""
+    clicked = clock.time()
     print("Received request to take photo.")
+    options = request.get_json(silent=True) or {}
 
-    with camera_frame_lock:
-        frame_to_save = latest_camera_frame # Get the most recent frame
-
-    if frame_to_save is None:
+    if frame_history.latest_time() is None:
         print("ERROR: No frame available to take photo. Camera might not be streaming yet.")
         return jsonify({'status': 'error', 'message': 'No frame available'}), 500
-    
-    
-    if not cam or not cam.isOpened():
-        print("ERROR: Camera not open for taking photo.")
-        return jsonify({'status': 'error', 'message': 'Camera not available'}), 500
-    
 
+    label = time.strftime("photo_%Y%m%d_%H%M%S")
+    if options.get('mode') == 'burst':
+        count = max(1, min(int(options.get('count', 5)), MAX_BURST))
+        image_ids = [image_store.reserve_id() for _ in range(count)]
+        photo_jobs.put((clicked, count, image_ids, label))
+        return jsonify({'status': 'success', 'ids': image_ids, 'paths': [f'/images/{i}' for i in image_ids]})
 
-    ret, frame = cam.read() 
-    if not ret:
-        print("ERROR: Failed to grab frame for photo.")
-        return jsonify({'status': 'error', 'message': 'Failed to capture frame'}), 500
-    
-    # Define a folder to save captured photos
-    # --- CHANGED: Now saves to the 'data/photos' subfolder ---
-    PHOTO_SAVE_FOLDER = os.path.join(os.path.dirname(__file__), 'data', 'photos')
-    os.makedirs(PHOTO_SAVE_FOLDER, exist_ok=True) 
-    
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    filename = f"photo_{timestamp}.jpg"
-    filepath = os.path.join(PHOTO_SAVE_FOLDER, filename)
-    
-    try:
-        cv2.imwrite(filepath, frame)
-        print(f"Photo saved to: {filepath}")
-        # --- CHANGED: Return path that uses the new /data_files route ---
-        return jsonify({'status': 'success', 'filename': filename, 'path': f'/data_files/photos/{filename}'})
-    except Exception as e:
-        print(f"ERROR: Failed to save photo: {e}")
-        return jsonify({'status': 'error', 'message': f'Failed to save photo: {e}'}), 500
+    window = min(float(options.get('window', PHOTO_WINDOW_SECONDS)), 1.0)
+    picked = frame_history.sharpest(clicked - window, clicked)
+    if picked is None:
+        return jsonify({'status': 'error', 'message': 'No frame available'}), 500
+    PHOTO_FRAME_AGE.observe(max(0.0, clicked - picked.timestamp))
+    image_id = image_store.reserve_id()
+    photo_jobs.put(([picked], [image_id], label))
+    # The image appears under /images/<id> a few ms later, once the photo writer has stored it
+    return jsonify({'status': 'success', 'id': image_id, 'path': f'/images/{image_id}',
+                    'sharpness': round(picked.sharpness, 1), 'age': round(clicked - picked.timestamp, 3)})
 
     
 
@@ -259,11 +508,115 @@ def data_files(filename):
     
     return send_from_directory(DATA_FOLDER, filename)
 
-
-
+# --- NEW: Image store routes. A stored image never changes, so browsers may cache a versioned URL
+# (/images/<id>?v=<store token>-<segment>-<offset>, as listed by /images) for good. Ids restart when
+# data/images is wiped, so a bare /images/<id> is only revalidated against the same ETag ---
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def image_response(jpeg_bytes, etag, cache_control=IMAGE_CACHE_CONTROL):
+    """JPEG response with ETag revalidation (304) and single byte-range requests (206)."""
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control, 'Accept-Ranges': 'bytes'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    byte_range = request.range
+    if byte_range is not None:
+        span = byte_range.range_for_length(len(jpeg_bytes)) if byte_range.units == 'bytes' else None
+        if span is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{len(jpeg_bytes)}'})
+        start, stop = span
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(jpeg_bytes)}'
+        return Response(jpeg_bytes[start:stop], status=206, mimetype='image/jpeg', headers=headers)
+    return Response(jpeg_bytes, mimetype='image/jpeg', headers=headers)
+
+@app.route('/images')
+def images_list():
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify({'images': image_store.list_images(request.args.get('kind'), before, limit), 'store': image_store.stats()})
+
+def stored_image_response(image_id, thumbnail=False):
+    jpeg_bytes, version = image_store.read_versioned(image_id, thumbnail)
+    if jpeg_bytes is None:
+        return jsonify({'status': 'error', 'message': 'No such image'}), 404
+    if request.args.get('v') != version: # Unversioned or outdated URL (or a thumbnail not made yet): have the browser ask again
+        return image_response(jpeg_bytes, version, cache_control='no-cache')
+    return image_response(jpeg_bytes, version)
+
+@app.route('/images/<int:image_id>')
+def image_full(image_id):
+    return stored_image_response(image_id)
+
+@app.route('/images/<int:image_id>/thumb')
+def image_thumb(image_id):
+    return stored_image_response(image_id, thumbnail=True)
+
+@app.route('/gallery')
+def gallery():
+    kind = request.args.get('kind')
+    images = image_store.list_images(kind, request.args.get('before', type=int), limit=200)
+    next_before = images[-1]['id'] if len(images) == 200 else None
+    return render_template('gallery.html', images=images, kind=kind, next_before=next_before, stats=image_store.stats())
+
+# --- NEW: Coverage map (coverage_map.py). Tile URLs carry the chunk version, so unchanged tiles stay in the browser cache ---
+@app.route('/map')
+def map_page():
+    return render_template('map.html')
+
+@app.route('/map/state')
+def map_state():
+    state = coverage_map.to_dict()
+    x, y, theta_deg = odometry.get_pose()
+    state['pose'] = {'x': x, 'y': y, 'theta': theta_deg}
+    return jsonify(state)
+
+@app.route('/map/tiles/<int(signed=True):cx>/<int(signed=True):cy>.png')
+def map_tile(cx, cy):
+    tile = coverage_map.tile(cx, cy)
+    if tile is None:
+        return jsonify({'status': 'error', 'message': 'No such tile'}), 404
+    png, version = tile
+    etag = f"{cx}_{cy}_{version}"
+    # Versioned URL (?v=) of the current version: cache for good; anything else: revalidate
+    cache_control = IMAGE_CACHE_CONTROL if request.args.get('v') == str(version) else 'no-cache'
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+    return Response(png, mimetype='image/png', headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+
+@app.route('/map/clear', methods=['POST'])
+def map_clear():
+    coverage_map.clear()
+    return jsonify({'status': 'success'})
+
+# --- NEW: QR sightings by position (spatial_index.py) ---
+def query_point():
+    """(x, y) from the query string, defaulting to the rover's current position."""
+    x, y, _ = odometry.get_pose()
+    return request.args.get('x', x, type=float), request.args.get('y', y, type=float)
+
+@app.route('/qr/near')
+def qr_near():
+    """QR sightings within ?radius= (default 2) meters of ?x=&y= (default: the rover), nearest first (?limit=, default 100)."""
+    x, y = query_point()
+    radius = request.args.get('radius', 2.0, type=float)
+    codes = qr_index.within(x, y, radius, request.args.get('data'), limit=request.args.get('limit', 100, type=int))
+    return jsonify({'x': x, 'y': y, 'radius': radius, 'codes': codes})
+
+@app.route('/qr/nearest')
+def qr_nearest():
+    """The ?k= (default 1) nearest distinct codes to ?x=&y= (default: the rover)."""
+    x, y = query_point()
+    k = max(1, min(request.args.get('k', 1, type=int), 100))
+    return jsonify({'x': x, 'y': y, 'codes': qr_index.nearest(x, y, k, request.args.get('max_radius', type=float),
+                                                              request.args.getlist('exclude'))})
+
+
+
+
+# CHANGED: Per-client frame rate, size and quality, e.g. /mjpeg?fps=10&width=320&quality=60 (see mjpeg_streaming.py)
 @app.route("/mjpeg")
 def mjpeg():
-    return Response(gather_img(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    client = MjpegClient(**parse_stream_options(request.args), sock=request.environ.get('werkzeug.socket'))
+    return Response(gather_img(client), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 # --- to get Odometry Pose ---
 @app.route('/get_pose')
@@ -298,59 +651,292 @@ def stop_camera_scan():
     print("[App] Camera scan stopped.")
     return jsonify({'status': 'success', 'message': 'Camera scan stopped'})
 
+# --- NEW: Panorama mosaics built from the camera scan sweeps ---
+@app.route('/panorama')
+@app.route('/panorama/<int:index>')
+def panorama(index=-1):
+    jpeg_bytes = panorama_builder.get_mosaic_jpeg(index)
+    if jpeg_bytes is None:
+        return jsonify({'status': 'error', 'message': 'No panorama available'}), 404
+    return Response(jpeg_bytes, mimetype='image/jpeg')
+
+@app.route('/panorama/sweeps')
+def panorama_sweeps():
+    return jsonify(panorama_builder.list_sweeps())
+
 # ---  DELAY FOR CAMERA ---
 # print("Delaying for camera warm-up...")
 # time.sleep(5) # Wait 5 seconds to ensure camera is fully initialized
 
-cam = cv2.VideoCapture(0)
-cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+# --- NEW: JPEG passthrough (ROVER_JPEG_PASSTHROUGH=1) ---
+# The USB camera can encode MJPEG itself. In passthrough mode we ask V4L2 for the raw JPEG bytes
+# (CAP_PROP_CONVERT_RGB=0) and stream them as-is, instead of decoding to BGR and re-encoding every
+# frame. BGR is decoded only when something needs pixels: the QR worker, the panorama, resized
+# /mjpeg clients, and the QR overlay while a code is in view.
+JPEG_PASSTHROUGH_ENV = "ROVER_JPEG_PASSTHROUGH"
+JPEG_PASSTHROUGH = os.environ.get(JPEG_PASSTHROUGH_ENV) == '1'
+QR_OVERLAY_HOLD_SECONDS = 0.5 # Keep drawing the last QR box this long after the worker saw it
+camera_passthrough = False # Set by open_camera() once the camera actually delivers JPEG
+qr_overlay = ('', None, 0.0) # (data, bbox, time) from the QR worker, drawn by the passthrough capture thread
+
+# --- NEW: QR change gate (qr_gate.py): detection skips frames that look like the last detected one ---
+SERVO_SETTLE_SECONDS = 0.5 # The view keeps changing this long after a servo command (move + camera latency)
+
+def camera_view_moving():
+    """Hint for the QR gate: the motors or the camera servo are moving, so the view is changing."""
+    if motors_active():
+        return True
+    if camera_scan_controller is not None and camera_scan_controller.is_scanning():
+        return True
+    servo = subsystems.get('servo')
+    return servo is not None and time.monotonic() - servo.last_move_time < SERVO_SETTLE_SECONDS
+
+qr_gate = QrGate.from_env(activity=camera_view_moving)
+
+def hold_qr_overlay(since):
+    """The gate skipped a frame: if the overlay came from the frame detected at `since` (or later), it still applies."""
+    global qr_overlay
+    data, bbox, seen_at = qr_overlay
+    if data and seen_at >= since:
+        qr_overlay = (data, bbox, time.time())
+
+def enable_jpeg_passthrough(cam):
+    """Switches the capture to MJPG without conversion. Returns True if read() now gives JPEG bytes."""
+    cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640) # Some UVC drivers reset the size when the format changes
+    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    cam.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    ret, buf = cam.read()
+    if ret and buf is not None and buf.ndim == 2 and buf.shape[0] == 1 and buf[0, :2].tobytes() == b'\xff\xd8':
+        print("[Camera] JPEG passthrough enabled: streaming the camera's own MJPEG frames.")
+        return True
+    cam.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+    print("[Camera] Camera did not return raw JPEG frames; using decode + re-encode instead.")
+    return False
+
+# CHANGED: The camera is no longer opened at import time; the 'camera' subsystem opens it in the background
+def open_camera():
+    global camera_passthrough
+    if replay:
+        cam = replay.open_camera() # Recorded frames
+    elif SIM_MODE:
+        cam = SimCamera()
+    else:
+        cam = cv2.VideoCapture(0, cv2.CAP_V4L2) if JPEG_PASSTHROUGH else cv2.VideoCapture(0) # CONVERT_RGB needs V4L2
+        cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        if not cam.isOpened():
+            cam.release()
+            raise RuntimeError("cv2.VideoCapture(0) could not be opened")
+    if JPEG_PASSTHROUGH:
+        camera_passthrough = enable_jpeg_passthrough(cam)
+    if fresh_capture_enabled() and not replay: # A replay must hand out every recorded frame
+        cam = FreshestFrameCapture(cam) # NEW: Newest frame only, read on its own thread (fresh_capture.py)
+        print("[Camera] Freshest-frame capture enabled.")
+    return cam
 
 # qr_detector = cv2.QRCodeDetector()
 # detected_qr_data = set()
 
-def gather_img():
+DISPLAY_CV2_WINDOW = False # Set to False if you DO NOT want the local window
+
+# --- CHANGED: One capture thread reads the camera, runs QR detection and encodes each frame once.
+# Every /mjpeg client (Flask or ASGI) then just sends the shared JPEG from frame_buffer.
+def camera_capture_thread(cam):
     # NEW: Global variable for the latest camera frame and a lock for thread safety ---
     global latest_camera_frame # Must be declared global if written to
+    print("[Capture Thread] Camera capture started.")
 
-    if not cam or not cam.isOpened():
-        print("Error: Camera not open in gather_img. Cannot stream.")
-        return 
-
-    DISPLAY_CV2_WINDOW = False # Set to False if you DO NOT want the local window
     if DISPLAY_CV2_WINDOW:
         cv2.namedWindow("Local Camera Feed (via Flask)", cv2.WINDOW_AUTOSIZE)
         print("Local camera feed window opened.")
 
-    while True:
+    last_frame_time = None
+    last_bus_write = 0.0
+    while cam.isOpened():
+        read_start = time.perf_counter()
         ret, frame = cam.read() 
+        now = CAMERA_READ_SECONDS.observe_since(read_start)
         if not ret:
+            CAMERA_READ_FAILURES.inc()
             print("Failed to grab frame. End of stream or camera error. Retrying frame...")
             time.sleep(0.5) 
             continue 
+        CAMERA_FRAMES.inc()
+        if last_frame_time is not None and now > last_frame_time:
+            CAMERA_FPS.set(0.9 * CAMERA_FPS.value + 0.1 / (now - last_frame_time)) # Smoothed frame rate
+        last_frame_time = now
+
+        if flight_recorder.frame_due(): # NEW: One raw frame per second, before the QR overlay, so replay.py can re-run detection
+            flight_recorder.record_frame(cv2.imencode('.jpg', frame)[1].tobytes())
+        frame_history.push(frame, timestamp=clock.time()) # NEW: Raw frame for /take_photo (copied into a preallocated slot)
         
-        processed_frame = qr(frame) 
+        if frame_bus is not None and frame.shape == frame_bus.shape:
+            # NEW: Vision runs in other processes; hand them the frame through shared memory, draw their last result
+            if qr_gate.check(frame): # Unchanged frames aren't sent: the workers wait instead of re-detecting
+                frame_bus.write(frame)
+                last_bus_write = time.time()
+            else:
+                hold_qr_overlay(last_bus_write)
+            processed_frame = draw_fresh_qr_overlay(frame) # Safe in place: the bus holds its own copy
+        else:
+            # Simulated frames are the repo's own captures; don't re-save them
+            processed_frame = qr(frame, record=not SIM_MODE, gate=qr_gate)
+            if qr_module.last_detection_fresh and qr_module.last_detection[0]: # Not for frames the gate skipped
+                on_qr_seen(qr_module.last_detection[0])
         if processed_frame is None:
             processed_frame = frame
 
         # --- Store the latest frame securely ---
         with camera_frame_lock:
-            latest_camera_frame = processed_frame.copy() # Store a copy of the latest frame
+            latest_camera_frame = processed_frame # cam.read() returns a new array each time, so no copy is needed
 
         if DISPLAY_CV2_WINDOW:
             cv2.imshow("Local Camera Feed (via Flask)", processed_frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                print(" 'q' pressed in local window. Stopping local display for this request.")
-                break 
+            cv2.waitKey(1)
 
+        encode_start = time.perf_counter()
         _, buffer = cv2.imencode('.jpg', processed_frame) 
         frame_encoded_bytes = buffer.tobytes()
+        JPEG_ENCODE_SECONDS.observe_since(encode_start)
+        JPEG_BYTES.observe(len(frame_encoded_bytes))
 
-        yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_encoded_bytes + b'\r\r\n')
+        frame_buffer.publish(processed_frame, frame_encoded_bytes)
 
     if DISPLAY_CV2_WINDOW:
         cv2.destroyAllWindows()
         print("Local camera feed window closed.")
+    print("[Capture Thread] Camera closed, capture stopped.")
+
+# --- NEW: Passthrough capture: publishes the camera's JPEG bytes without touching the pixels ---
+def camera_passthrough_thread(cam):
+    print("[Capture Thread] Camera capture started (JPEG passthrough).")
+    last_frame_time = None
+    last_bus_write = 0.0
+    while cam.isOpened():
+        read_start = time.perf_counter()
+        ret, buf = cam.read()
+        now = CAMERA_READ_SECONDS.observe_since(read_start)
+        if not ret:
+            CAMERA_READ_FAILURES.inc()
+            print("Failed to grab frame. End of stream or camera error. Retrying frame...")
+            time.sleep(0.5)
+            continue
+        CAMERA_FRAMES.inc()
+        if last_frame_time is not None and now > last_frame_time:
+            CAMERA_FPS.set(0.9 * CAMERA_FPS.value + 0.1 / (now - last_frame_time))
+        last_frame_time = now
+
+        jpeg_bytes = buf.tobytes()
+        flight_recorder.record_frame(jpeg_bytes) # Decimated to one frame per second
+        frame_history.push(jpeg=jpeg_bytes, timestamp=clock.time())
+        if frame_bus is not None:
+            if qr_gate.check(jpeg=jpeg_bytes): # A 1/8-size decode; much cheaper than the workers' full decode + detect
+                frame_bus.write(jpeg=jpeg_bytes) # The vision processes decode it themselves, off this process's GIL
+                last_bus_write = time.time()
+            else:
+                hold_qr_overlay(last_bus_write)
+        data, bbox, seen_at = qr_overlay
+        if data and time.time() - seen_at < QR_OVERLAY_HOLD_SECONDS:
+            # A code is in view: this frame needs the overlay, so decode, draw and re-encode it
+            frame = cv2.imdecode(buf.reshape(-1), cv2.IMREAD_COLOR)
+            draw_qr_overlay(frame, data, bbox)
+            encode_start = time.perf_counter()
+            _, buffer = cv2.imencode('.jpg', frame)
+            jpeg_bytes = buffer.tobytes()
+            JPEG_ENCODE_SECONDS.observe_since(encode_start)
+            frame_buffer.publish(frame, jpeg_bytes)
+        else:
+            frame_buffer.publish(None, jpeg_bytes)
+        JPEG_BYTES.observe(len(jpeg_bytes))
+    print("[Capture Thread] Camera closed, capture stopped.")
+
+def draw_fresh_qr_overlay(frame):
+    """Draws the latest QR result from the worker thread/processes if it is recent enough."""
+    data, bbox, seen_at = qr_overlay
+    if data and time.time() - seen_at < QR_OVERLAY_HOLD_SECONDS:
+        draw_qr_overlay(frame, data, bbox)
+    return frame
+
+def qr_worker_thread():
+    """QR detection off the capture path (passthrough mode): decodes the newest frame whenever it's free,
+       so a slow detect never lowers the stream frame rate."""
+    global qr_overlay
+    print("[QR Worker] Started.")
+    last_seq = 0
+    last_run = 0.0
+    while True:
+        seq = frame_buffer.wait_for_new(last_seq, timeout=2.0)
+        if seq == last_seq:
+            continue
+        last_seq, frame = frame_buffer.get_frame()
+        if frame is None:
+            continue
+        if not qr_gate.check(frame):
+            hold_qr_overlay(last_run)
+            continue
+        last_run = time.time()
+        data, bbox = detect_qr(frame)
+        if data:
+            qr_overlay = (data, bbox, time.time())
+            on_qr_seen(data)
+            if not SIM_MODE: # Simulated frames are the repo's own captures; don't re-save them
+                record_detection(frame, data)
+
+def gather_img(client):
+    # Name the request thread so the profiler labels MJPEG streaming clearly
+    threading.current_thread().name = f"mjpeg-{threading.get_ident()}"
+
+    if subsystems.wait('camera', timeout=10) is None: # Waits for the camera on the first request after startup
+        print("Error: Camera not open in gather_img. Cannot stream.")
+        return 
+
+    yield from mjpeg_frames(frame_buffer, client) # Newest frame only, paced and sized for this client
+
+def telemetry_events():
+    """Server-sent events with every new telemetry sample (encoder data + pose)."""
+    last_seq = 0
+    while True:
+        seq = telemetry_buffer.wait_for_new(last_seq, timeout=15.0)
+        if seq == last_seq:
+            yield ": keep-alive\n\n"
+            continue
+        last_seq, sample, _ = telemetry_buffer.get()
+        yield f"data: {json.dumps(sample)}\n\n"
+
+@app.route('/frame_bus')
+def frame_bus_status():
+    if frame_bus is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'write_seq': frame_bus.write_seq, 'slots': frame_bus.slots,
+                    'readers': frame_bus.reader_status(), 'workers_alive': vision_workers.alive() if vision_workers else 0})
+
+@app.route('/replay')
+def replay_status():
+    if replay is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(replay.status(), enabled=True))
+
+@app.route('/telemetry_stream')
+def telemetry_stream():
+    return Response(telemetry_events(), mimetype='text/event-stream')
+
+@app.route('/telemetry/pipeline')
+def telemetry_pipeline_status():
+    """Per-stage and per-subscriber counts, queue depths and call time quantiles."""
+    if telemetry_pipeline is None:
+        return jsonify({'running': False})
+    return jsonify(dict(telemetry_pipeline.stats(), running=True))
+
+@app.route('/telemetry/history')
+def telemetry_history_query():
+    """Chart data: ?span= seconds (default 600) up to ?end= (default now), ?width= points (default 500),
+       ?fields=rpm1,rpm2,yaw (default all). Each point is the min, max and mean of its slice of time."""
+    end = request.args.get('end', clock.time(), type=float)
+    start = request.args.get('start', end - request.args.get('span', 600.0, type=float), type=float)
+    width = max(1, min(request.args.get('width', 500, type=int), 5000))
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+    return jsonify(telemetry_history.query(start, end, width, fields))
 
 
 @app.route('/send_angle', methods=['POST'])
@@ -359,6 +945,9 @@ def send_angle():
     angle = data.get('angle')
     print(f"Received angle: {angle}", flush=True)
     # change_angle()
+    camera_servo_controller = subsystems.get('servo')
+    if camera_servo_controller is None:
+        return jsonify({'status': 'error', 'message': 'Camera servo not ready'}), 503
     # --- NEW: Call set_camera_tilt_angle from CameraServoController object ---
     camera_servo_controller.set_angle(angle) 
     return jsonify({'status': 'success', 'angle': angle})
@@ -370,6 +959,7 @@ def send_distance():
     data = request.get_json()
     distance = float(data.get('distance')) # Ensure it's a float
     automation_controller.set_mission_targets(distance, automation_controller.automation_target_direction)
+    flight_recorder.record_targets(distance, automation_controller.automation_target_direction)
     print(f"Received automation target distance: {automation_controller.automation_target_distance}m")
 
     return jsonify({'status': 'success', 'distance': automation_controller.automation_target_distance})
@@ -380,6 +970,7 @@ def send_direction():
     data = request.get_json()
     direction = float(data.get('direction')) # Ensure it's a float
     automation_controller.set_mission_targets(automation_controller.automation_target_distance, direction)
+    flight_recorder.record_targets(automation_controller.automation_target_distance, direction)
     print(f"Received automation target direction: {automation_controller.automation_target_direction}°")
 
     return jsonify({'status': 'success', 'direction': automation_controller.automation_target_direction})
@@ -388,70 +979,220 @@ def send_direction():
 
     
 
-if __name__ == '__main__':
-    print("Starting Flask application...")
-
-    # --- Initial Camera Check ---
-    print("Initializing camera...")
-    if not cam or not cam.isOpened():
-        print("Flask app will start, but camera is not available.")
-    else:
-        print("Camera opened successfully.")
+# --- NEW: Slow hardware init, run in parallel background threads at startup ---
+SERVO_CAM_PCA_ADDRESS = 0x40 # Example: Address for the PCA9685 controlling the camera servo
+CAMERA_TILT_SERVO_CHANNEL = 3 
 
-    # --- REQUIRED: RPi.GPIO init and Encoder Thread Start (moved before app.run) ---
-    print("RPi.GPIO motor control ready via hardware.py.")
-    
-    # NEW: Initialize I2C bus here for all PCA9685 communication
+def open_camera_servo():
+    if SIM_MODE:
+        return SimServo()
+    import board # Imported here: opening the I2C bus is part of the slow startup
+    import busio
     i2c_bus = busio.I2C(board.SCL, board.SDA) 
-    SERVO_CAM_PCA_ADDRESS = 0x40 # Example: Address for the PCA9685 controlling the camera servo
-    CAMERA_TILT_SERVO_CHANNEL = 3 
     # Initialize the Camera Servo Controller pca_address, servo_channel
     camera_servo_controller = CameraServoController(i2c_bus, SERVO_CAM_PCA_ADDRESS, CAMERA_TILT_SERVO_CHANNEL)
     if camera_servo_controller.pca is None:
-        print("CRITICAL ERROR: Camera Servo PCA9685 not initialized. Camera tilt control unavailable.")
+        raise RuntimeError("Camera Servo PCA9685 not initialized. Camera tilt control unavailable.")
+    return camera_servo_controller
+
+def open_serial():
+    if not arduino_comm.connect():
+        raise RuntimeError(f"Arduino serial communication not established on {SERIAL_PORT_MEGA}")
+    return arduino_comm
+
+def on_serial_ready(ser_comm_obj):
+    # Start the telemetry pipeline ONLY if serial is connected
+    global telemetry_pipeline
+    telemetry_pipeline = build_telemetry_pipeline(ser_comm_obj)
+    telemetry_pipeline.start(source_name="encoder-reader")
+    for thread in telemetry_pipeline.control_threads(): # The serial-to-odometry path; subscribers are not control work
+        realtime.register_control_thread(thread)
+
+# --- NEW: Direct BNO08x reader (ROVER_IMU=1): heading at the IMU's rate between the Arduino's encoder lines ---
+imu_reader = None
+
+def open_imu():
+    sensor = SimImu(sim_motors) if SIM_MODE else None # None: ImuReader opens the BNO08x on /dev/serial0
+    return ImuReader.from_env(sensor, on_sample=on_imu_sample, clock=clock)
+
+def on_imu_ready(reader):
+    global imu_reader
+    imu_reader = reader
+    reader.start()
+    realtime.register_control_thread(reader.thread)
+
+def on_imu_sample(sample):
+    with encoder_data_lock: # Recorded in the order applied, between fuse_pose()'s encoder lines (replay.py re-applies both)
+        odometry.update_heading(sample.yaw, sample.timestamp) # Same clock as the encoder lines' read times
+        flight_recorder.record_imu(sample)
+
+# --- NEW: Shared-memory frame bus + QR worker processes (ROVER_FRAME_BUS=1, ROVER_VISION_WORKERS=N) ---
+frame_bus = None
+vision_workers = None
+VISION_DETECTIONS = metrics.counter('rover_vision_detections_total', 'QR detections reported by the vision worker processes')
+
+def on_vision_detection(data, bbox, seq, timestamp, seconds):
+    global qr_overlay
+    VISION_DETECTIONS.inc()
+    qr_overlay = (data, bbox, time.time())
+    on_qr_seen(data)
+
+def start_frame_bus(cam):
+    """Creates the bus at the camera's actual frame size and starts the vision processes on it."""
+    global frame_bus, vision_workers
+    height = int(cam.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 480
+    width = int(cam.get(cv2.CAP_PROP_FRAME_WIDTH)) or 640
+    frame_bus = FrameBus.create(shape=(height, width, 3))
+    vision_workers = VisionWorkers(on_vision_detection, workers=int(os.environ.get(VISION_WORKERS_ENV, '1')),
+                                   record=not SIM_MODE)
+    vision_workers.start()
+
+capture_thread = None # Joined by stop_services()
+
+def on_camera_ready(cam):
+    global capture_thread
+    if os.environ.get(FRAME_BUS_ENV) == '1' or realtime.realtime_enabled(): # Real-time mode: detection off this process
+        start_frame_bus(cam)
+    if camera_passthrough:
+        capture_thread = threading.Thread(target=camera_passthrough_thread, args=(cam,), name="camera-capture", daemon=True)
+        if frame_bus is None:
+            threading.Thread(target=qr_worker_thread, name="qr-worker", daemon=True).start()
     else:
-        print("Camera Servo PCA9685 initialized.")
+        capture_thread = threading.Thread(target=camera_capture_thread, args=(cam,), name="camera-capture", daemon=True)
+    capture_thread.start()
+
+def on_servo_ready(camera_servo_controller):
+    camera_scan_controller.camera_servo_controller = camera_servo_controller
+
+# --- NEW: Readiness of each hardware subsystem (camera, serial, motors, servo) ---
+subsystems = SubsystemRegistry()
+subsystems.register('camera', open_camera, on_ready=on_camera_ready)
+subsystems.register('serial', open_serial, on_ready=on_serial_ready)
+subsystems.register('motors', init_motors)
+subsystems.register('servo', open_camera_servo, on_ready=on_servo_ready)
+if imu_enabled() and replay is None: # A replay applies the recorded IMU samples instead
+    subsystems.register('imu', open_imu, on_ready=on_imu_ready)
+
+
+# --- Controllers created by start_services() ---
+automation_controller = None
+camera_scan_controller = None
+camera_socket_server = None # NEW: TCP frame stream on port 8485 sharing this app's camera (ROVER_CAMERA_SOCKET=1)
+
+def start_services():
+    """Creates the controllers and starts hardware init and background threads.
+       Shared by the Flask dev server (below) and the ASGI server (asgi_server.py).
+    """
+    global automation_controller, camera_scan_controller, camera_socket_server
+
+    # --- NEW: Queued logging; per-sample encoder/odometry DEBUG output is sampled 1-in-100, warnings rate-limited ---
+    setup_logging(sample={'encoder': 100, 'odometry': 100}, rate_limit={'encoder': 2.0, 'hardware': 5.0})
+
+    if realtime.realtime_enabled():
+        realtime.apply(True) # Before any thread starts: they inherit the general CPUs, control threads move when registered
+
+    image_store.open() # Loads the index and starts the thumbnail thread
+    qr_module.set_image_store(image_store)
+    photo_writer.start()
+    teleop.start()
+
+    motor_funcs = { # Pass specific motor functions as a dict
+        'forward': forward,
+        'backward': backward,
+        'turn_left': turn_left,
+        'turn_right': turn_right,
+        'stop': stop
+    }
+    recording = os.environ.get(FLIGHT_RECORDER_ENV, '0' if SIM_MODE else '1') == '1'
+    if recording:
+        flight_recorder.start()
+        motor_funcs = {name: flight_recorder.wrap_motor_func(name, func, pose_time=lambda: automation_controller.pose_time)
+                       for name, func in motor_funcs.items()} # With the pose time each decision used, for replay.py
+    if replay:
+        motor_funcs = {name: replay.wrap_motor_func(name, func) for name, func in motor_funcs.items()} # Compared with the recording
 
-
-    print("PCA9685 motor control ready via hardware.py.") 
     # -- Instantiate the AutomationController ---
     # This object will manage the automation logic and state.
     automation_controller = AutomationController(
             app_instance=app,
             odometry_obj=odometry,
             encoder_lock=encoder_data_lock,
-            hardware_motor_funcs={ # Pass specific motor functions as a dict
-                'forward': forward,
-                'backward': backward,
-                'turn_left': turn_left,
-                'turn_right': turn_right,
-                'stop': stop
-            }
+            hardware_motor_funcs=motor_funcs,
+            clock=clock,
+            qr_index=qr_index
         )
+    if recording:
+        automation_controller.add_state_listener(flight_recorder.record_state)
+    if replay:
+        automation_controller.add_state_listener(replay.record_state)
+        replay.odometry = odometry
+        replay.on_command = execute_command
+        replay.on_targets = automation_controller.set_mission_targets
+        replay.on_finished = lambda: automation_controller.is_active() and automation_controller.stop_mission()
+        replay.qr_source = lambda: qr_module.last_detection[0]
+    # The servo is attached by on_servo_ready() once the I2C bus is up
     camera_scan_controller = CameraScanController(
         app_instance=app,
-        camera_servo_controller_obj=camera_servo_controller # Pass the already initialized servo controller
+        camera_servo_controller_obj=None,
+        panorama_builder=panorama_builder,
+        frame_source=get_scan_frame
 )
 
+    # --- NEW: Open camera, serial, GPIO and I2C in parallel; /health reports their progress ---
+    subsystems.start_all()
+    print("Hardware initialization started in background (see /health).")
+
+    if os.environ.get(PROFILER_ENV) == '1':
+        profiler.start()
+
+    if os.environ.get(CAMERA_SOCKET_ENV) == '1':
+        camera_socket_server = CameraSocketServer(frame_buffer) # Streams frame_buffer; no second camera open
+        try:
+            camera_socket_server.start()
+        except OSError as e:
+            print(f"[Camera Socket] Could not start: {e}")
+            camera_socket_server = None
 
     # This thread manages the mission.
-    automation_thread = threading.Thread(target=automation_controller.run_automation_thread, daemon=True) # CHANGED: Call run_automation_thread method
+    automation_thread = threading.Thread(target=automation_controller.run_automation_thread, name="automation", daemon=True) # CHANGED: Call run_automation_thread method
     automation_thread.start()
+    realtime.register_control_thread(automation_thread)
     print("Automation control thread started.")
-        # --- NEW: Start Camera Scan Control Thread ---
-    scan_control_thread = threading.Thread(target=camera_scan_controller, daemon=True)
-    scan_control_thread.start()
-    print("Camera scan control thread started.")
-    
-    if arduino_comm.ser is None: # Check if serial connection failed at startup
-        print("CRITICAL ERROR: Arduino serial communication not established for encoder data.")
-        # import sys; sys.exit(1) # Consider exiting if encoder data is critical
-    else:
-        print("Arduino serial communication ready for encoder data.")
-        # Start the encoder reading thread ONLY if serial is connected
-        encoder_read_thread = threading.Thread(target=read_encoder_data_thread, args=(arduino_comm,), daemon=True)
-        encoder_read_thread.start()
-        print("Encoder data reading thread started.")
+
+def stop_services():
+    if camera_socket_server:
+        camera_socket_server.stop()
+    if vision_workers:
+        vision_workers.stop()
+    cam = subsystems.get('camera')
+    if cam:
+        cam.release()
+        print("Camera released.")
+    if imu_reader:
+        imu_reader.stop()
+    teleop.stop()
+    if telemetry_pipeline:
+        telemetry_pipeline.stop()
+    if capture_thread:
+        capture_thread.join(timeout=2) # Let it leave OpenCV: a daemon thread killed inside cv2 at exit aborts the process
+    # arduino_comm.close() is handled for daemon thread exit by Python.
+    # It's also handled by the ArduinoSerialComm's __del__ if implemented, or on process exit.
+    # cleanup_gpio() # This cleans up RPi.GPIO pins from hardware.py
+    # print("Application cleanup complete.")
+    if photo_writer.is_alive():
+        photo_jobs.put(None) # Finish the photos already taken first
+        photo_writer.join(timeout=5)
+    if frame_bus:
+        frame_bus.close() # Unlinks /dev/shm/rover_frames
+    flight_recorder.stop() # Writes the index and trailer of the current file
+    shutdown_logging()
+
+
+if __name__ == '__main__':
+    print("Starting Flask application...")
+    if Sock is None:
+        print("[Teleop] flask-sock not installed: no /ws/teleop on this server, the dashboard uses HTTP commands.")
+    start_services()
 
     try:
         app.run(host='0.0.0.0', port=5000, debug=True, threaded=True, use_reloader=False)
@@ -460,11 +1201,4 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"\nAn unexpected error occurred: {e}. Performing cleanup...")
     finally:
-        if cam:
-            cam.release()
-            print("Camera released.")
-        # arduino_comm.close() is handled for daemon thread exit by Python.
-        # It's also handled by the ArduinoSerialComm's __del__ if implemented, or on process exit.
-        # cleanup_gpio() # This cleans up RPi.GPIO pins from hardware.py
-        # print("Application cleanup complete.")
-
+        stop_services()
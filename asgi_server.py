@@ -0,0 +1,128 @@
+# asgi_server.py - Async serving mode for the rover
+# Serves the same routes as app.py, but from an asyncio event loop (Starlette + uvicorn):
+#   - /mjpeg and /telemetry_stream are async generators fed from the shared frame and
+#     telemetry buffers, so each viewer costs a coroutine instead of an OS thread.
+#     /mjpeg takes the same per-client options as the Flask route (see mjpeg_streaming.py).
+#   - /ws/teleop is the teleop WebSocket (teleop.py), served on the loop itself.
+#   - Every other route is the unchanged Flask app, mounted through a WSGI bridge whose
+#     thread pool only ever runs short control requests, so they never queue behind streams.
+#
+# Requires: pip install starlette uvicorn a2wsgi (and websockets, for /ws/teleop)
+# Usage:    python asgi_server.py            (or: uvicorn asgi_server:asgi_app --host 0.0.0.0 --port 5000)
+
+import asyncio
+import json
+import socket
+import threading
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+try:
+    from a2wsgi import WSGIMiddleware # Maintained WSGI bridge with a bounded thread pool
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware # Deprecated in Starlette, but works
+
+import app as rover_app
+from mjpeg_streaming import MjpegClient, mjpeg_frames_async, parse_stream_options, SEND_BUFFER_BYTES
+
+HOST = '0.0.0.0'
+PORT = 5000
+WSGI_WORKERS = 8 # Threads for the Flask (control) routes; streams don't use any
+
+
+def mjpeg_stream(query_params):
+    if rover_app.subsystems.get('camera') is None:
+        print("[ASGI] Camera not ready; /mjpeg will start once frames arrive.")
+    client = MjpegClient(**parse_stream_options(query_params))
+    return mjpeg_frames_async(rover_app.frame_buffer, client)
+
+
+async def telemetry_stream_events():
+    last_seq = 0
+    while True:
+        seq = await rover_app.telemetry_buffer.wait_for_new_async(last_seq, timeout=15.0)
+        if seq == last_seq:
+            yield ": keep-alive\n\n"
+            continue
+        last_seq, sample, _ = rover_app.telemetry_buffer.get()
+        yield f"data: {json.dumps(sample)}\n\n"
+
+
+async def mjpeg(request):
+    return StreamingResponse(mjpeg_stream(request.query_params), media_type='multipart/x-mixed-replace; boundary=frame')
+
+
+async def telemetry_stream(request):
+    return StreamingResponse(telemetry_stream_events(), media_type='text/event-stream')
+
+
+async def teleop_ws(websocket):
+    """WebSocket teleop (teleop.py). Acks and telemetry come from other threads, so they go through a queue
+       drained by a sender task on this loop."""
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    outgoing = asyncio.Queue()
+    session = rover_app.teleop.open_session(lambda message: loop.call_soon_threadsafe(outgoing.put_nowait, message))
+
+    async def sender():
+        while True:
+            await websocket.send_text(json.dumps(await outgoing.get()))
+
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            rover_app.teleop.receive(session, await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender_task.cancel()
+        rover_app.teleop.close_session(session)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    threading.current_thread().name = "asgi-loop" # Labelled in the profiler
+    rover_app.start_services()
+    yield
+    rover_app.stop_services()
+
+
+def _wsgi_bridge(flask_app):
+    try:
+        return WSGIMiddleware(flask_app, workers=WSGI_WORKERS)
+    except TypeError: # starlette.middleware.wsgi has no 'workers' argument
+        return WSGIMiddleware(flask_app)
+
+
+asgi_app = Starlette(
+    routes=[
+        Route('/mjpeg', mjpeg),
+        Route('/telemetry_stream', telemetry_stream),
+        WebSocketRoute('/ws/teleop', teleop_ws), # uvicorn needs a WebSocket library: pip install websockets
+        Mount('/', app=_wsgi_bridge(rover_app.app)), # Everything else: the unchanged Flask routes
+    ],
+    lifespan=lifespan,
+)
+
+
+def listening_socket():
+    """Listening socket with a small send buffer (inherited by accepted connections), so a slow
+    /mjpeg link makes uvicorn's send() wait instead of vanishing into megabytes of kernel buffer.
+    proto must be IPPROTO_TCP: asyncio only sets TCP_NODELAY on accepted sockets that say so, and
+    with Nagle on every keep-alive response waits ~40 ms for the client's delayed ACK."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+    sock.bind((HOST, PORT))
+    return sock
+
+
+if __name__ == '__main__':
+    import uvicorn
+    print(f"Starting ASGI server on {HOST}:{PORT}...")
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level='warning'))
+    server.run(sockets=[listening_socket()])
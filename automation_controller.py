@@ -4,28 +4,56 @@ import threading
 import time
 import math
 
+import metrics
+import realtime
+from rover_logging import get_logger
+
+log = get_logger('automation')
+
+LOOP_PERIOD_SECONDS = metrics.histogram('rover_automation_loop_period_seconds', 'Period of the automation turn/drive control loop',
+                                        buckets=(0.04, 0.045, 0.05, 0.055, 0.06, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0))
+LOOP_JITTER = realtime.monitor('automation') # The same periods, kept for percentiles on /admin/jitter
+
 class AutomationController:
-    def __init__(self, app_instance, odometry_obj, encoder_lock, hardware_motor_funcs):
+    def __init__(self, app_instance, odometry_obj, encoder_lock, hardware_motor_funcs, clock=time, qr_index=None):
         """
         Initializes the AutomationController.
         :param app_instance: The Flask app object, needed for app.app_context().
         :param odometry_obj: The global SkidSteerOdometry object.
         :param encoder_lock: The threading.Lock for accessing odometry/encoder data.
         :param hardware_motor_funcs: A dictionary or object containing motor control functions (forward, backward, turn_left, turn_right, stop).
+        :param clock: Source of perf_counter() and sleep() for the control loop (the time module, or replay.ReplayClock).
+        :param qr_index: Optional spatial_index.QrSpatialIndex of QR sightings, for codes_near() / nearest_code().
         """
         self.app = app_instance
         self.odometry = odometry_obj
         self.encoder_data_lock = encoder_lock
         self.motor_funcs = hardware_motor_funcs # e.g., {'forward': forward, 'stop': stop}
+        self.clock = clock
+        self.qr_index = qr_index
 
         self.automation_active = threading.Event() # Event to signal the thread to run/wait
         self.automation_target_distance = 0.0 # meters
         self.automation_target_direction = 0.0 # degrees
         self.automation_speed = 30 # Default speed for automation (in %)
         self.automation_state = "IDLE" # States: IDLE, TURNING, DRIVING, FINISHED, STOPPED
+        self.pose_time = None # NEW: Odometry time of the pose the last turn/drive decision used (flight recorder, replay.py)
+        self.state_listeners = [] # NEW: Called as listener(old_state, new_state) on every transition
 
         print("[AutomationController] Initialized.")
 
+    def add_state_listener(self, listener):
+        """Registers listener(old_state, new_state), e.g. the flight recorder."""
+        self.state_listeners.append(listener)
+
+    def _set_state(self, new_state):
+        old_state, self.automation_state = self.automation_state, new_state
+        for listener in self.state_listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                print(f"[AutomationController] State listener failed: {e}")
+
     def set_mission_targets(self, distance, direction):
         """Sets the new target distance and direction for the autonomous mission."""
         self.automation_target_distance = distance
@@ -36,7 +64,7 @@ class AutomationController:
         """Activates the automation thread to begin the mission."""
         if not self.automation_active.is_set(): # Only set if not already active
             self.automation_active.set()
-            self.automation_state = "STARTED"
+            self._set_state("STARTED")
             print("[AutomationController] Mission started.")
         else:
             print("[AutomationController] Mission already active. Ignoring start command.")
@@ -47,13 +75,44 @@ class AutomationController:
             self.automation_active.clear()
             # Immediately stop motors using the provided function
             self.motor_funcs['stop']() 
-            self.automation_state = "STOPPED"
+            self._set_state("STOPPED")
             print("[AutomationController] Mission stopped.")
         else:
             print("[AutomationController] Mission already inactive. Ignoring stop command.")
     def is_active(self): # For app.py to check automation status
         return self.automation_active.is_set()
 
+    # --- NEW: Where QR codes were seen, relative to the current pose ---
+    def codes_near(self, radius):
+        """QR sightings within radius meters of the rover, nearest first."""
+        if self.qr_index is None:
+            return []
+        x, y, _ = self.odometry.get_pose()
+        return self.qr_index.within(x, y, radius)
+
+    def nearest_code(self, exclude=()):
+        """The closest QR sighting (skipping payloads in exclude), or None."""
+        if self.qr_index is None:
+            return None
+        x, y, _ = self.odometry.get_pose()
+        found = self.qr_index.nearest(x, y, 1, exclude=exclude)
+        return found[0] if found else None
+
+    def area_visited(self, radius=0.5):
+        """True if a QR code was already seen within radius of the rover, so this area can be skipped."""
+        if self.qr_index is None:
+            return False
+        x, y, _ = self.odometry.get_pose()
+        return self.qr_index.visited(x, y, radius)
+
+    def _observe_loop_period(self, previous_start):
+        """Records the time since the previous loop iteration started; returns this iteration's start."""
+        now = self.clock.perf_counter()
+        if previous_start is not None:
+            LOOP_PERIOD_SECONDS.observe(now - previous_start)
+            LOOP_JITTER.observe(now - previous_start)
+        return now
+
     def run_automation_thread(self):
         """
         This is the main loop for the automation thread.
@@ -78,24 +137,26 @@ class AutomationController:
 
                     
  # --- Step 1: Turn to Target Direction ---
-                    self.automation_state = "TURNING"
+                    self._set_state("TURNING")
                     print(f"[AutomationController Thread] State: {self.automation_state}. Current Theta: {initial_theta_deg:.1f}°, Target: {self.automation_target_direction}°")
                     
                     angle_tolerance = 2.0 # Degrees +/- for alignment
                     turn_speed = self.automation_speed # Use the instance's automation speed
 
                     turn_count = 0 # NEW: counter for debug
+                    loop_start = None # For the loop period metric
                     
                     # Turn loop: continues until aligned or automation is stopped
                     while self.automation_active.is_set(): 
+                        loop_start = self._observe_loop_period(loop_start)
                         with self.encoder_data_lock: 
-                            current_x, current_y, current_theta_deg = self.odometry.get_pose()
+                            current_x, current_y, current_theta_deg, self.pose_time = self.odometry.get_timed_pose()
                         
                         angle_error = self.automation_target_direction - current_theta_deg
                         angle_error = self.odometry.normalize_angle_deg(angle_error) # Normalize error to -180 to 180
 
-                        if turn_count % 10 == 0: # Print every 10 iterations (0.5s) to avoid spam
-                            print(f"[AutomationController Thread] Turn Error: {angle_error:.1f}°, Current: {current_theta_deg:.1f}°")
+                        if turn_count % 10 == 0: # Log every 10 iterations (0.5s) to avoid spam
+                            log.info("Turn Error: %.1f°, Current: %.1f°", angle_error, current_theta_deg)
                         turn_count += 1
 
                         if abs(angle_error) <= angle_tolerance:
@@ -108,34 +169,36 @@ class AutomationController:
                         else: # Negative error: target is to the right
                             self.motor_funcs['turn_right'](turn_speed)
                         
-                        time.sleep(0.05) 
+                        self.clock.sleep(0.05) 
 
                     # Check if automation was stopped during the turning phase
                     if not self.automation_active.is_set(): 
                         self.motor_funcs['stop']() 
-                        self.automation_state = "IDLE"
+                        self._set_state("IDLE")
                         print("[AutomationController Thread] Automation stopped during turn.")
                         continue # Go back to waiting for next activation
 
 
 # --- Step 2: Drive to Target Distance ---
-                    self.automation_state = "DRIVING"
+                    self._set_state("DRIVING")
                     print(f"[AutomationController Thread] State: {self.automation_state}. Target Distance: {self.automation_target_distance}m")
                     drive_speed = self.automation_speed 
                     distance_driving_tolerance = 0.05 # Meters, how close to target distance to stop (e.g., 5cm)
 
                     drive_count = 0 # NEW: counter for debug
+                    loop_start = None
 
                     # Driving loop: continues until distance reached or automation stopped
                     while self.automation_active.is_set(): 
+                        loop_start = self._observe_loop_period(loop_start)
                         with self.encoder_data_lock: 
-                            current_x, current_y, current_theta_deg = self.odometry.get_pose()
+                            current_x, current_y, current_theta_deg, self.pose_time = self.odometry.get_timed_pose()
                         
                         distance_traveled = math.sqrt((current_x - initial_x)**2 + (current_y - initial_y)**2)
                         distance_remaining = self.automation_target_distance - distance_traveled
 
-                        if drive_count % 10 == 0: # Print every 10 iterations (0.5s)
-                            print(f"[AutomationController Thread] Drive Remaining: {distance_remaining:.2f}m, Traveled: {distance_traveled:.2f}m")
+                        if drive_count % 10 == 0: # Log every 10 iterations (0.5s)
+                            log.info("Drive Remaining: %.2fm, Traveled: %.2fm", distance_remaining, distance_traveled)
                         drive_count += 1
 
                         if distance_remaining <= distance_driving_tolerance: 
@@ -144,19 +207,19 @@ class AutomationController:
                             break # Exit driving loop
                         
                         self.motor_funcs['forward'](drive_speed) 
-                        print(f"[AutomationController Thread] Driving, remaining: {distance_remaining:.2f}m") # Uncomment for verbose driving debug
-                        time.sleep(0.05) 
+                        log.debug("Driving, remaining: %.2fm", distance_remaining) # Enable with ROVER_LOG_LEVELS=automation=DEBUG
+                        self.clock.sleep(0.05) 
 
                     # Check if automation was stopped during the driving phase
                     if not self.automation_active.is_set(): 
                         self.motor_funcs['stop']() 
-                        self.automation_state = "IDLE"
+                        self._set_state("IDLE")
                         print("[AutomationController Thread] Automation stopped during drive.")
                         continue # Go back to waiting for next activation
 
 
 # --- Step 3: Mission Finished ---
-                    self.automation_state = "FINISHED"
+                    self._set_state("FINISHED")
                     self.motor_funcs['stop']() 
                     print("[AutomationController Thread] Automation sequence completed.")
                     
@@ -165,6 +228,6 @@ class AutomationController:
                     self.motor_funcs['stop']() # Attempt to stop motors on error
                 finally:
                     self.automation_active.clear() # Clear the event, so it waits for next activation
-                    self.automation_state = "IDLE" # Reset state for next mission
+                    self._set_state("IDLE") # Reset state for next mission
                     print("[AutomationController Thread] Automation loop reset to IDLE.")
-            time.sleep(0.1) # Sleep briefly when automation is IDLE
\ No newline at end of file
+            self.clock.sleep(0.1) # Sleep briefly when automation is IDLE
\ No newline at end of file
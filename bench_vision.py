@@ -0,0 +1,209 @@
+# bench_vision.py - Vision pipeline benchmark
+# Replays the captured images in the repo (static/qr_*.jpg, data/photos/, data/undecoded_qr_*.jpg),
+# plus rotated, blurred and scaled variants, through qr.qr(), the alternative detectors available
+# in this OpenCV build and the JPEG encoder. Prints machine-readable JSON.
+#
+# Usage: python bench_vision.py [--repeat 3] [--variants all|none] [--output bench.json]
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import qr
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Image Sets (relative to the repo root) ---
+IMAGE_SETS = {
+    'qr_captures': ['static/qr_*.jpg', 'qr_*.jpg'],
+    'photos': ['data/photos/*.jpg', 'static/photo_*.jpg'],
+    'undecoded': ['data/undecoded_qr_*.jpg'],
+}
+
+JPEG_QUALITIES = (50, 80, 95)
+
+
+# --- Synthetic Variants ---
+def _rotate(img, angle):
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+VARIANTS = {
+    'original': lambda img: img,
+    'rotate_15': lambda img: _rotate(img, 15),
+    'rotate_45': lambda img: _rotate(img, 45),
+    'rotate_90': lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE),
+    'blur_5': lambda img: cv2.GaussianBlur(img, (5, 5), 0),
+    'blur_9': lambda img: cv2.GaussianBlur(img, (9, 9), 0),
+    'scale_0.5': lambda img: cv2.resize(img, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA),
+    'scale_0.75': lambda img: cv2.resize(img, None, fx=0.75, fy=0.75, interpolation=cv2.INTER_AREA),
+    'scale_1.5': lambda img: cv2.resize(img, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_LINEAR),
+}
+
+
+# --- Detectors ---
+def build_detectors():
+    """Returns {name: callable(img) -> decoded text or ''} for every detector available here."""
+    detectors = {
+        # The full per-frame path used by the app (detect + overlay), without saving files
+        'qr.qr': _qr_pipeline,
+        'cv2.QRCodeDetector': _opencv_detector(cv2.QRCodeDetector()),
+    }
+    if hasattr(cv2, 'QRCodeDetectorAruco'): # OpenCV >= 4.8
+        detectors['cv2.QRCodeDetectorAruco'] = _opencv_detector(cv2.QRCodeDetectorAruco())
+    if hasattr(cv2, 'wechat_qrcode_WeChatQRCode'): # opencv-contrib only
+        wechat = cv2.wechat_qrcode_WeChatQRCode()
+        detectors['cv2.wechat_qrcode'] = lambda img: (wechat.detectAndDecode(img)[0] or ('',))[0]
+    try:
+        from pyzbar import pyzbar
+        detectors['pyzbar'] = lambda img: next((c.data.decode('utf-8', 'ignore') for c in pyzbar.decode(img)
+                                                if c.type == 'QRCODE'), '')
+    except ImportError:
+        pass
+    return detectors
+
+def _qr_pipeline(img):
+    qr.qr(img.copy(), record=False) # Copy: qr() draws the overlay in place
+    return qr.last_detection[0]
+
+def _opencv_detector(detector):
+    return lambda img: detector.detectAndDecode(img)[0]
+
+
+# --- Statistics ---
+def summarize(latencies, successes=None):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if latencies.size == 0:
+        return {}
+    summary = {
+        'runs': int(latencies.size),
+        'throughput_fps': round(float(latencies.size / latencies.sum()), 2) if latencies.sum() > 0 else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        'max_ms': round(float(latencies.max()) * 1000, 3),
+    }
+    if successes is not None:
+        summary['success_rate'] = round(float(np.mean(successes)), 4)
+    return summary
+
+
+def load_images(sets):
+    images = {}
+    for set_name in sets:
+        paths = []
+        for pattern in IMAGE_SETS[set_name]:
+            paths.extend(glob.glob(os.path.join(BASE_DIR, pattern)))
+        loaded = []
+        for path in sorted(set(paths)):
+            img = cv2.imread(path)
+            if img is not None:
+                loaded.append((os.path.relpath(path, BASE_DIR), img))
+        images[set_name] = loaded
+    return images
+
+
+def bench_detectors(images, variants, detectors, repeat):
+    results = {}
+    for detector_name, detect in detectors.items():
+        per_detector = {}
+        for set_name, set_images in images.items():
+            for variant_name in variants:
+                make_variant = VARIANTS[variant_name]
+                latencies, successes = [], []
+                for _, img in set_images:
+                    variant = make_variant(img)
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        decoded = detect(variant)
+                        latencies.append(time.perf_counter() - start)
+                        successes.append(bool(decoded))
+                per_detector[f"{set_name}/{variant_name}"] = summarize(latencies, successes)
+        results[detector_name] = per_detector
+    return results
+
+
+def bench_jpeg(images, repeat):
+    results = {}
+    frames = [img for set_images in images.values() for _, img in set_images]
+    for quality in JPEG_QUALITIES:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        latencies, sizes = [], []
+        for img in frames:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ok, buffer = cv2.imencode('.jpg', img, params)
+                latencies.append(time.perf_counter() - start)
+                if ok:
+                    sizes.append(buffer.size)
+        summary = summarize(latencies)
+        if sizes:
+            summary['mean_bytes'] = int(np.mean(sizes))
+        results[f"quality_{quality}"] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QR detection and JPEG encoding on the repo's captured images.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per image and variant")
+    parser.add_argument('--sets', default=','.join(IMAGE_SETS), help="Comma-separated image sets")
+    parser.add_argument('--variants', default='all', help="'all', 'none' (originals only) or a comma-separated list")
+    parser.add_argument('--detectors', default='', help="Comma-separated detector names (default: all available)")
+    parser.add_argument('--output', default='', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.variants == 'all':
+        variants = list(VARIANTS)
+    elif args.variants == 'none':
+        variants = ['original']
+    else:
+        variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+
+    detectors = build_detectors()
+    if args.detectors:
+        wanted = {d.strip() for d in args.detectors.split(',')}
+        detectors = {name: fn for name, fn in detectors.items() if name in wanted}
+
+    images = load_images([s.strip() for s in args.sets.split(',') if s.strip()])
+
+    started = time.time()
+    report = {
+        'timestamp': started,
+        'platform': {'machine': platform.machine(), 'python': platform.python_version(), 'opencv': cv2.__version__},
+        'images': {name: len(set_images) for name, set_images in images.items()},
+        'repeat': args.repeat,
+        'detectors': bench_detectors(images, variants, detectors, args.repeat),
+        'jpeg_encode': bench_jpeg(images, args.repeat),
+    }
+    report['duration_seconds'] = round(time.time() - started, 3)
+
+    # Peak memory in a second, untimed pass: tracemalloc hooks every allocation and would inflate the latencies
+    tracemalloc.start()
+    bench_detectors(images, variants, detectors, 1)
+    bench_jpeg(images, 1)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report['peak_memory'] = {
+        'traced_bytes': peak_traced, # Python + NumPy allocations during one pass over the images
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, # Whole process, includes OpenCV buffers
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"[Bench] Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,37 @@
-# server_socket_cam.py (Run this on your Raspberry Pi)
+# camera_feed.py - TCP camera socket server
+# Streams length-prefixed JPEG frames (4-byte big-endian size, then the JPEG) to any number of clients.
+#
+# CHANGED: Used to accept exactly one client, run qr() inline and exit when that client left. Now:
+#   - frames come from a shared FrameBuffer (stream_buffers.py), encoded once for every client
+#   - one selector thread serves all clients with non-blocking sends, so a slow reader never
+#     stalls the others; each client has its own small queue and drop policy:
+#       latest     - keep only the newest unsent frame (default, lowest latency)
+#       queue      - keep up to N frames, dropping the oldest when full
+#       disconnect - close the client once its queue is full (for consumers that need every frame)
+#     A client picks its policy by sending "policy=<name>\n" after connecting (optional)
+#   - clients can come and go; the server keeps running
+#
+# Two ways to run it:
+#   - inside app.py with ROVER_CAMERA_SOCKET=1: shares the Flask app's camera (and its QR pass)
+#     instead of fighting it for /dev/video0
+#   - standalone on the Pi: python camera_feed.py [--port 8485] [--policy latest] [--no-qr]
 
+import argparse
+import collections
+import selectors
 import socket
-import cv2
 import struct
+import threading
 import time
-import os
 
-# --- Import your QR code logic ---
-# This assumes your qr.py is in the same directory.
-# We'll call qr() to process the frame before sending.
-from qr import qr # Just need the qr function for processing
+import cv2
+
+import metrics
+from stream_buffers import FrameBuffer
 
 # --- Camera Initialization ---
 # Using the native V4L2 backend, which you confirmed worked in recent tests.
-CAMERA_INDEX = 0 
+CAMERA_INDEX = 0
 GST_PIPELINE = ( # Fallback if native V4L2 doesn't work, but try direct first
     "v4l2src device=/dev/video0 ! "
     "image/jpeg,width=640,height=480,framerate=30/1 ! "
@@ -22,20 +40,283 @@ GST_PIPELINE = ( # Fallback if native V4L2 doesn't work, but try direct first
 
 # --- Socket Setup ---
 PORT = 8485 # Port to listen on
+CAMERA_SOCKET_ENV = "ROVER_CAMERA_SOCKET" # app.py starts the server on its own camera when set to 1
+DROP_POLICIES = ('latest', 'queue', 'disconnect')
+MAX_QUEUED_FRAMES = 3          # Per client, for the 'queue' and 'disconnect' policies
+SEND_BUFFER_BYTES = 256 * 1024 # Kernel send buffer per client; keeps slow clients' backlog (and latency) small
+HELLO_MAX_BYTES = 64
 
-def main():
-    print("Starting camera socket server on Pi...")
+SOCKET_CLIENTS = metrics.gauge('rover_camera_socket_clients', 'Connected camera socket clients')
+SOCKET_FRAMES_SENT = metrics.counter('rover_camera_socket_frames_sent_total', 'Frames fully sent to camera socket clients')
+SOCKET_FRAMES_DROPPED = metrics.counter('rover_camera_socket_frames_dropped_total', 'Frames dropped for slow camera socket clients')
+SOCKET_DISCONNECTS = metrics.counter('rover_camera_socket_slow_disconnects_total', "Clients closed by the 'disconnect' policy")
+
+
+class _Client:
+    """One connected client: its send queue, the frame currently being written, and its drop policy."""
+    def __init__(self, sock, addr, policy, max_queue):
+        self.sock = sock
+        self.addr = addr
+        self.policy = policy
+        self.max_queue = max_queue
+        self.queue = collections.deque()
+        self.out = None # memoryview of the rest of the frame being sent
+        self.hello = b''
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, packet):
+        """Queues a frame according to the drop policy. Returns False if the client should be closed."""
+        if self.policy == 'latest':
+            if self.queue:
+                self.dropped += len(self.queue)
+                SOCKET_FRAMES_DROPPED.inc(len(self.queue))
+                self.queue.clear()
+        elif len(self.queue) >= self.max_queue:
+            if self.policy == 'disconnect':
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+            SOCKET_FRAMES_DROPPED.inc()
+        self.queue.append(packet)
+        return True
+
+    def flush(self):
+        """Writes as much as the socket accepts without blocking. Returns True while data is still pending.
+           A frame that has started is always finished, so the stream stays correctly framed."""
+        while True:
+            if self.out is None:
+                if not self.queue:
+                    return False
+                self.out = memoryview(self.queue.popleft())
+            try:
+                n = self.sock.send(self.out)
+            except BlockingIOError:
+                return True
+            self.out = self.out[n:]
+            if len(self.out):
+                return True
+            self.out = None
+            self.sent += 1
+            SOCKET_FRAMES_SENT.inc()
+
+    def read_hello(self, data):
+        """Parses the optional 'policy=<name>\\n' line. Returns False if the client sent something invalid."""
+        self.hello += data
+        if b'\n' not in self.hello:
+            return len(self.hello) <= HELLO_MAX_BYTES
+        line = self.hello.split(b'\n', 1)[0].decode('ascii', 'ignore').strip()
+        self.hello = b''
+        if line.startswith('policy='):
+            policy = line[len('policy='):]
+            if policy in DROP_POLICIES:
+                self.policy = policy
+                print(f"[Camera Socket] {self.addr} uses drop policy '{policy}'.")
+                return True
+        print(f"[Camera Socket] {self.addr} sent an unknown request: {line!r}")
+        return True # Ignore it; keep streaming with the current policy
+
+
+class CameraSocketServer:
+    """
+    Serves the newest frames of a FrameBuffer to many TCP clients with non-blocking, per-client-queued sends.
+
+    :param frame_buffer: FrameBuffer to stream (its JPEG bytes are sent as-is).
+    :param host: Interface to bind ('' = all).
+    :param port: TCP port.
+    :param drop_policy: Default drop policy for new clients ('latest', 'queue' or 'disconnect').
+    :param max_queue: Frames a 'queue'/'disconnect' client may have waiting.
+    """
+    def __init__(self, frame_buffer, host='', port=PORT, drop_policy='latest', max_queue=MAX_QUEUED_FRAMES):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}' (expected one of {DROP_POLICIES})")
+        self.frame_buffer = frame_buffer
+        self.host = host
+        self.port = port
+        self.drop_policy = drop_policy
+        self.max_queue = max_queue
+        self.clients = {}
+        self.running = threading.Event()
+        self.packet_lock = threading.Lock()
+        self.latest_packet = None
+        self.selector = None
+        self.server_socket = None
+        self._wake_r = self._wake_w = None
+        self._threads = []
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Restart without waiting out TIME_WAIT
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(8)
+        self.server_socket.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair() # Lets the frame thread wake the selector
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ, 'listen')
+        self.selector.register(self._wake_r, selectors.EVENT_READ, 'wake')
+        self.running.set()
+        self._threads = [threading.Thread(target=self._frame_pump, name="camera-socket-frames", daemon=True),
+                         threading.Thread(target=self._serve, name="camera-socket", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        print(f"[Camera Socket] Listening on port {self.port} (default drop policy '{self.drop_policy}').")
+
+    def stop(self):
+        self.running.clear()
+        self._wake()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        for client in list(self.clients.values()):
+            self._close(client)
+        self.selector.close()
+        self.server_socket.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        print("[Camera Socket] Stopped.")
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass # Already has a pending wake-up, or shutting down
+
+    def _frame_pump(self):
+        """Builds the length-prefixed packet once per new frame and wakes the selector thread."""
+        last_seq = 0
+        while self.running.is_set():
+            seq = self.frame_buffer.wait_for_new(last_seq, timeout=1.0)
+            if seq == last_seq:
+                continue
+            last_seq, _, jpeg_bytes, _ = self.frame_buffer.get()
+            if jpeg_bytes is None:
+                continue
+            with self.packet_lock:
+                self.latest_packet = struct.pack(">L", len(jpeg_bytes)) + jpeg_bytes
+            self._wake()
 
+    def _serve(self):
+        while self.running.is_set():
+            for key, mask in self.selector.select(timeout=1.0):
+                if key.data == 'listen':
+                    self._accept()
+                elif key.data == 'wake':
+                    self._broadcast()
+                else:
+                    self._service(key.data, mask)
+
+    def _accept(self):
+        try:
+            conn, addr = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # Notice clients that vanished off the Wi-Fi
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+        client = _Client(conn, addr, self.drop_policy, self.max_queue)
+        self.clients[conn] = client
+        self.selector.register(conn, selectors.EVENT_READ, client)
+        SOCKET_CLIENTS.set(len(self.clients))
+        print(f"[Camera Socket] Client connected: {addr} ({len(self.clients)} connected)")
+
+    def _broadcast(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.packet_lock:
+            packet, self.latest_packet = self.latest_packet, None
+        if packet is None:
+            return
+        for client in list(self.clients.values()):
+            if not client.offer(packet):
+                SOCKET_DISCONNECTS.inc()
+                print(f"[Camera Socket] {client.addr} fell {client.max_queue} frames behind; disconnecting.")
+                self._close(client)
+                continue
+            self._flush(client)
+
+    def _service(self, client, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = client.sock.recv(HELLO_MAX_BYTES)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b''
+            if data == b'' or (data and not client.read_hello(data)):
+                self._close(client)
+                return
+        if mask & selectors.EVENT_WRITE:
+            self._flush(client)
+
+    def _flush(self, client):
+        try:
+            pending = client.flush()
+        except OSError: # BrokenPipe / ConnectionReset: the client went away mid-frame
+            self._close(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def _close(self, client):
+        if self.clients.pop(client.sock, None) is None:
+            return
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        SOCKET_CLIENTS.set(len(self.clients))
+        print(f"[Camera Socket] Client disconnected: {client.addr} (sent {client.sent}, dropped {client.dropped})")
+
+
+def receive_frames(host, port=PORT, policy=None, retry_delay=1.0):
+    """
+    Client side: yields JPEG bytes from a CameraSocketServer, reconnecting (with backoff) whenever
+    the connection drops. Decode with cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR).
+    """
+    delay = retry_delay
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=10) as sock:
+                print(f"[Camera Client] Connected to {host}:{port}")
+                if policy:
+                    sock.sendall(f"policy={policy}\n".encode('ascii'))
+                delay = retry_delay
+                while True:
+                    size = struct.unpack(">L", _recv_exact(sock, 4))[0]
+                    yield _recv_exact(sock, size)
+        except (OSError, ConnectionError) as e:
+            print(f"[Camera Client] Connection lost ({e}); retrying in {delay:.1f} s")
+            time.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+# --- Standalone mode: open the camera here and stream it ---
+def open_camera():
     # --- Initialize Camera (Robustly) ---
     cap = None
     max_retries = 3
-    retry_delay = 1 
+    retry_delay = 1
 
     for i in range(max_retries):
         print(f"Attempting to open camera (Attempt {i+1}/{max_retries})...")
         # Try native V4L2 first (simpler)
-        cap = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_V4L2) 
-        
+        cap = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_V4L2)
+
         # Set properties explicitly for native V4L2
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
@@ -43,70 +324,66 @@ def main():
 
         if cap.isOpened():
             print("Camera opened successfully.")
-            break 
+            return cap
         else:
             print(f"WARNING: Camera failed to open on attempt {i+1} with native V4L2. Retrying with GStreamer pipeline...")
             cap = cv2.VideoCapture(GST_PIPELINE, cv2.CAP_GSTREAMER) # Try GStreamer pipeline
             if cap.isOpened():
                 print("Camera opened successfully with GStreamer pipeline.")
-                break
+                return cap
             else:
                 print(f"WARNING: Camera failed to open on attempt {i+1} with GStreamer too. Retrying in {retry_delay} seconds...")
                 if cap: cap.release()
                 time.sleep(retry_delay)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the Pi camera to TCP clients as length-prefixed JPEG frames.")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--policy', choices=DROP_POLICIES, default='latest', help="Default drop policy for slow clients")
+    parser.add_argument('--no-qr', action='store_true', help="Skip QR detection (send the raw camera frames)")
+    args = parser.parse_args()
 
+    print("Starting camera socket server on Pi...")
+    cap = open_camera()
     if not cap or not cap.isOpened():
         print("CRITICAL ERROR: Failed to open camera after multiple retries. Exiting.")
         return # Exit if camera fails
 
-    # --- Socket Setup ---
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if not args.no_qr:
+        from qr import qr # Just need the qr function for processing
+
+    frame_buffer = FrameBuffer()
+    server = CameraSocketServer(frame_buffer, port=args.port, drop_policy=args.policy)
     try:
-        server_socket.bind(('', PORT)) # Bind to all available interfaces
-        server_socket.listen(1) # Listen for one client connection
-        print(f"[SERVER] Listening on port {PORT}. Waiting for client connection...")
-        conn, addr = server_socket.accept()
-        print(f"[SERVER] Connected to client: {addr}")
-    except socket.error as e:
+        server.start()
+    except OSError as e:
         print(f"[SERVER] Socket error: {e}. Exiting.")
         cap.release()
-        server_socket.close()
         return
 
-    # --- Main Streaming Loop ---
+    # --- Main Capture Loop: encode once, every client shares it ---
     try:
         while True:
             ret, frame = cap.read() # Read a frame from the camera
             if not ret:
-                print("Failed to grab frame from camera. Breaking stream loop.")
-                break
-
-            # Process frame with QR detection (from your qr.py)
-            processed_frame = qr(frame) # qr() function also prints to terminal
-            
-            if processed_frame is None: # Fallback if qr() function returns None
-                processed_frame = frame
-
-            # Encode the frame as JPEG
-            _, buffer = cv2.imencode('.jpg', processed_frame)
-            data = buffer.tobytes()
-            size = len(data)
-
-            # Send size and then the data
-            conn.sendall(struct.pack(">L", size)) # Pack size as unsigned long (4 bytes)
-            conn.sendall(data)
-
-    except (socket.error, BrokenPipeError) as e:
-        print(f"[SERVER] Client disconnected or socket error: {e}")
+                print("Failed to grab frame from camera. Retrying...")
+                time.sleep(0.5)
+                continue
+
+            if not args.no_qr:
+                processed = qr(frame) # qr() function also prints to terminal
+                frame = processed if processed is not None else frame
+
+            _, buffer = cv2.imencode('.jpg', frame)
+            frame_buffer.publish(frame, buffer.tobytes())
     except KeyboardInterrupt:
         print("\n[SERVER] Server stopped by user.")
     finally:
         print("[SERVER] Cleaning up...")
+        server.stop()
         cap.release()
-        if 'conn' in locals() and conn: # Check if conn was established
-            conn.close()
-        server_socket.close()
         print("[SERVER] Cleanup complete.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
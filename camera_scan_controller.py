@@ -7,14 +7,18 @@ import math # Needed for angle calculations if you include custom servo math
 # Or you pass it directly to the constructor if it's not a Flask app specific design.
 
 class CameraScanController:
-    def __init__(self, app_instance, camera_servo_controller_obj):
+    def __init__(self, app_instance, camera_servo_controller_obj, panorama_builder=None, frame_source=None):
         """
         Initializes the CameraScanController.
         :param app_instance: The Flask app object, needed for app.app_context().
         :param camera_servo_controller_obj: The instantiated CameraServoController object.
+        :param panorama_builder: Optional PanoramaBuilder that stitches the frames of each sweep.
+        :param frame_source: Callable returning a raw camera frame (no overlay) captured after the call (needed for the panorama).
         """
         self.app = app_instance
         self.camera_servo_controller = camera_servo_controller_obj
+        self.panorama_builder = panorama_builder
+        self.frame_source = frame_source
 
         # --- Camera Scan Configuration (now instance variables) ---
         self.scan_active = threading.Event() # Event to signal the thread to run/stop
@@ -22,11 +26,12 @@ class CameraScanController:
         self.scan_max_angle = 135 # Degrees
         self.scan_step_angle = 5 # Degrees per step during scan
         self.scan_delay = 0.01 # Seconds delay between steps
+        self.settle_time = 0.1 # Seconds after a step before the view is steady (5° of travel plus a frame at 30 fps); panorama only
         
         print("[CameraScanController] Initialized.")
 
         # Start the camera scan control thread
-        self.scan_thread = threading.Thread(target=self._run_scan_loop, daemon=True)
+        self.scan_thread = threading.Thread(target=self._run_scan_loop, name="camera-scan", daemon=True)
         self.scan_thread.start()
         print("[CameraScanController] Camera scan control thread launched.")
 
@@ -75,15 +80,22 @@ class CameraScanController:
                             if current_scan_angle > self.scan_max_angle:
                                 current_scan_angle = self.scan_max_angle # Clamp at max
                                 scan_direction_up = False # Change direction
+                                self._finish_panorama_sweep() # One sweep ends at each reversal
                         else:
                             current_scan_angle -= self.scan_step_angle
                             if current_scan_angle < self.scan_min_angle:
                                 current_scan_angle = self.scan_min_angle # Clamp at min
                                 scan_direction_up = True # Change direction
+                                self._finish_panorama_sweep()
                         
                         # Command the servo to the new angle
                         if self.camera_servo_controller:
                             self.camera_servo_controller.set_angle(current_scan_angle)
+
+                        # --- NEW: Feed a frame taken after the servo settled into the panorama at the commanded angle ---
+                        if self.panorama_builder is not None:
+                            self._wait_for_servo()
+                            self._add_panorama_frame(current_scan_angle)
                         
                         time.sleep(self.scan_delay) # Delay between steps
                 
@@ -92,11 +104,32 @@ class CameraScanController:
                     if self.camera_servo_controller:
                         self.camera_servo_controller.set_angle(90) # Return to center on error
                 finally:
+                    self._finish_panorama_sweep() # Keep the partial sweep when the scan is stopped
                     self.scan_active.clear() # Clear the event for next activation
                     self.current_state = "IDLE" # Reset state
                     print("[CameraScanController Thread] Camera scan loop reset to IDLE (waiting for next scan).")
             time.sleep(0.1) # Sleep briefly when scan is IDLE
 
+    # --- Panorama Helpers ---
+    def _wait_for_servo(self):
+        """Sleeps until settle_time has passed since the servo's last move."""
+        last_move = getattr(self.camera_servo_controller, 'last_move_time', None)
+        if last_move:
+            remaining = last_move + self.settle_time - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _add_panorama_frame(self, angle):
+        if self.panorama_builder is None or self.frame_source is None:
+            return
+        frame = self.frame_source()
+        if frame is not None:
+            self.panorama_builder.add_frame(angle, frame)
+
+    def _finish_panorama_sweep(self):
+        if self.panorama_builder is not None:
+            self.panorama_builder.finish_sweep()
+
     def cleanup(self):
         """Ensure the scan thread is stopped and servo is reset on app shutdown."""
         self.stop_scan() # Ensure thread event is cleared
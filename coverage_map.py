@@ -0,0 +1,164 @@
+# coverage_map.py - Coverage / trajectory grid built from odometry
+# The area the rover has driven over, as a grid of small cells stored in square chunks that are created
+# as the rover reaches them, so a long mission only costs memory where it went. Each pose update marks
+# just the cells swept since the previous one: the rover's footprint along that segment (COVERED) and
+# its centre line (PATH). QR codes are marked where the rover was when it first saw them.
+#
+# The dashboard gets the map as one PNG tile per chunk (/map/tiles/<cx>/<cy>.png). A tile is re-rendered
+# only after its chunk changed; the chunk's version number is in the tile URL, so browsers cache the rest.
+
+import math
+import threading
+
+import cv2
+import numpy as np
+
+COVERED = 1 # Cell flags
+PATH = 2
+
+CELL_M = 0.05      # 5 cm cells
+CHUNK_CELLS = 64   # 64 x 64 cells (3.2 m) per chunk / tile
+TILE_SCALE = 4     # Tile pixels per cell (256 px tiles)
+FOOTPRINT_M = 0.25 # Width swept by the rover (track width + wheels)
+MAX_STEP_M = 2.0   # A longer jump between updates is a pose reset, not a drive
+
+# BGRA colours for the tiles (uncovered cells are transparent)
+COVERED_COLOR = (80, 160, 60, 140)
+PATH_COLOR = (255, 170, 40, 255)
+MARKER_COLOR = (40, 40, 230, 255)
+MARKER_RADIUS_PX = 6
+
+
+class CoverageMap:
+    """
+    Coverage grid fed with odometry poses.
+
+    :param cell_m: Cell size in meters.
+    :param chunk_cells: Cells per chunk side; a chunk is also one PNG tile.
+    :param footprint_m: Width of the swept strip.
+    """
+    def __init__(self, cell_m=CELL_M, chunk_cells=CHUNK_CELLS, footprint_m=FOOTPRINT_M, tile_scale=TILE_SCALE):
+        self.cell_m = cell_m
+        self.chunk_cells = chunk_cells
+        self.chunk_m = cell_m * chunk_cells
+        self.radius_m = footprint_m / 2.0
+        self.tile_scale = tile_scale
+        self.lock = threading.Lock()
+        self.chunks = {}   # (cx, cy) -> uint8 (chunk_cells, chunk_cells) array, [row = y, col = x]
+        self.versions = {} # (cx, cy) -> int, bumped whenever the chunk (or a marker on it) changes
+        self.markers = {}  # QR data -> (x, y)
+        self.last_point = None
+        self.tile_lock = threading.Lock()
+        self.tiles = {}    # (cx, cy) -> (version, png bytes)
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.markers.clear()
+            for key in self.versions:
+                self.versions[key] += 1 # Cached tiles and browser caches go stale
+            self.last_point = None
+
+    def update(self, x, y):
+        """Marks the cells swept moving from the previous pose to (x, y). Cheap when the rover hasn't moved."""
+        with self.lock:
+            if self.last_point is None:
+                self.last_point = (x, y)
+                self._sweep(x, y, x, y)
+                return
+            x0, y0 = self.last_point
+            step = math.hypot(x - x0, y - y0)
+            if step < self.cell_m / 2:
+                return
+            self.last_point = (x, y)
+            if step > MAX_STEP_M:
+                x0, y0 = x, y # Pose reset: start a new track here
+            self._sweep(x0, y0, x, y)
+
+    def _sweep(self, x0, y0, x1, y1):
+        """Sets the flags of the cells within radius of the segment, only in the chunks its bounding box touches. Lock held."""
+        r = self.radius_m
+        c = self.cell_m
+        n = self.chunk_cells
+        i_min, i_max = math.floor((min(x0, x1) - r) / c), math.floor((max(x0, x1) + r) / c)
+        j_min, j_max = math.floor((min(y0, y1) - r) / c), math.floor((max(y0, y1) + r) / c)
+        dx, dy = x1 - x0, y1 - y0
+        length_sq = dx * dx + dy * dy
+        path_r = c * 0.75
+        for cx in range(i_min // n, i_max // n + 1):
+            for cy in range(j_min // n, j_max // n + 1):
+                # Cell index range of the bounding box inside this chunk
+                ia, ib = max(i_min, cx * n), min(i_max, cx * n + n - 1)
+                ja, jb = max(j_min, cy * n), min(j_max, cy * n + n - 1)
+                px = (np.arange(ia, ib + 1) + 0.5) * c - x0 # Cell centres relative to the segment start
+                py = (np.arange(ja, jb + 1) + 0.5) * c - y0
+                px, py = px[np.newaxis, :], py[:, np.newaxis]
+                t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0) if length_sq else 0.0
+                dist_sq = (px - t * dx) ** 2 + (py - t * dy) ** 2
+                flags = np.where(dist_sq <= r * r, COVERED, 0).astype(np.uint8)
+                flags[dist_sq <= path_r * path_r] |= PATH
+                if not flags.any():
+                    continue
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    chunk = self.chunks[(cx, cy)] = np.zeros((n, n), dtype=np.uint8) # Grows one chunk at a time
+                block = chunk[ja - cy * n:jb - cy * n + 1, ia - cx * n:ib - cx * n + 1]
+                if (flags & ~block).any(): # Only a real change dirties the tile
+                    block |= flags
+                    self.versions[(cx, cy)] = self.versions.get((cx, cy), 0) + 1
+
+    def add_marker(self, data, x, y):
+        """Marks a QR code at (x, y); a code already marked there (same data within 0.5 m) is a no-op."""
+        with self.lock:
+            old = self.markers.get(data)
+            if old is not None and math.hypot(x - old[0], y - old[1]) < 0.5:
+                return
+            self.markers[data] = (x, y)
+            for key in self._marker_chunks(x, y) | (self._marker_chunks(*old) if old else set()):
+                self.versions[key] = self.versions.get(key, 0) + 1
+                self.chunks.setdefault(key, np.zeros((self.chunk_cells, self.chunk_cells), dtype=np.uint8))
+
+    def _marker_chunks(self, x, y):
+        """The chunks whose tiles show part of a marker at (x, y): its own, plus neighbours within the circle's radius."""
+        r = (MARKER_RADIUS_PX + 1) * self.chunk_m / (self.chunk_cells * self.tile_scale) # +1 px for antialiasing/rounding
+        return {(math.floor(px / self.chunk_m), math.floor(py / self.chunk_m))
+                for px in (x - r, x + r) for py in (y - r, y + r)}
+
+    def to_dict(self):
+        """What the dashboard needs to lay out the tiles: the chunks with their versions, and the markers."""
+        with self.lock:
+            return {'cell_m': self.cell_m, 'chunk_m': self.chunk_m, 'tile_px': self.chunk_cells * self.tile_scale,
+                    'tiles': [{'cx': cx, 'cy': cy, 'v': self.versions.get((cx, cy), 0)} for cx, cy in self.chunks],
+                    'markers': [{'data': data, 'x': x, 'y': y} for data, (x, y) in self.markers.items()]}
+
+    def tile(self, cx, cy):
+        """(png bytes, version) of one chunk, rendered only if it changed since the last call; None if no such chunk."""
+        with self.lock:
+            chunk = self.chunks.get((cx, cy))
+            if chunk is None:
+                return None
+            version = self.versions.get((cx, cy), 0)
+            cached = self.tiles.get((cx, cy))
+            if cached is not None and cached[0] == version:
+                return cached[1], version
+            chunk = chunk.copy()
+            markers = [(x, y) for x, y in self.markers.values()
+                       if abs(x - (cx + 0.5) * self.chunk_m) < self.chunk_m and abs(y - (cy + 0.5) * self.chunk_m) < self.chunk_m]
+        with self.tile_lock: # Render outside the map lock: the encoder thread keeps updating
+            png = self._render(chunk, cx, cy, markers)
+            self.tiles[(cx, cy)] = (version, png)
+        return png, version
+
+    def _render(self, chunk, cx, cy, markers):
+        s = self.tile_scale
+        cells = np.flipud(chunk) # Image rows go down, y goes up
+        image = np.zeros(cells.shape + (4,), dtype=np.uint8)
+        image[(cells & COVERED) > 0] = COVERED_COLOR
+        image[(cells & PATH) > 0] = PATH_COLOR
+        image = np.repeat(np.repeat(image, s, axis=0), s, axis=1)
+        size = self.chunk_cells * s
+        for x, y in markers: # Includes markers just off this tile, so circles on a tile edge are drawn on both
+            col = int(round((x / self.chunk_m - cx) * size))
+            row = int(round((cy + 1 - y / self.chunk_m) * size))
+            cv2.circle(image, (col, row), MARKER_RADIUS_PX, MARKER_COLOR, -1)
+        return cv2.imencode('.png', image)[1].tobytes()
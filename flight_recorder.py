@@ -0,0 +1,432 @@
+# flight_recorder.py - Mission flight recorder
+# Continuously records telemetry samples, motor commands, mission targets, automation state changes, direct
+# IMU samples (ROVER_IMU=1) and (optionally) decimated camera JPEGs into compact binary files, so a failed mission can be replayed
+# (replay.py) and scrubbed afterwards instead of reconstructed from stdout and robot_pose.txt.
+#
+# File format (.rfr, little-endian):
+#   file header   magic b'RFR1', version u16, reserved u16, start time f64                 (16 bytes)
+#   record        type u8, reserved u8, reserved u16, payload length u32, timestamp f64    (16 bytes)
+#                 followed by the payload
+#   index record  (type INDEX) every INDEX_EVERY_SECONDS: previous index offset u64, entry count u32,
+#                 then (timestamp f64, offset u64) entries - roughly one per INDEX_RESOLUTION seconds
+#   trailer       (type TRAILER) on close: last index offset u64, record count u64, first/last timestamp f64,
+#                 then the fixed 16-byte footer: last index offset u64 + b'RFRTAIL\0'
+# Files rotate at max_bytes; the oldest are deleted beyond max_files. A file without a trailer
+# (power cut) is still readable: the reader rebuilds its index by walking the length prefixes.
+#
+# Writing is off the hot path: record_*() packs a few bytes and appends to a bounded deque; the
+# 'flight-recorder' thread does all file I/O through a large buffered writer.
+#
+# Usage: python flight_recorder.py dump data/flight [--start 1752626053] [--types telemetry,state] [--frames-out out/]
+
+import argparse
+import bisect
+import collections
+import glob
+import os
+import struct
+import threading
+import time
+
+import metrics
+
+FLIGHT_RECORDER_ENV = "ROVER_FLIGHT_RECORDER"
+FLIGHT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'flight')
+
+MAGIC = b'RFR1'
+VERSION = 1
+FOOTER_MAGIC = b'RFRTAIL\0'
+FILE_HEADER = struct.Struct('<4sHHd')
+RECORD_HEADER = struct.Struct('<BBHId')
+INDEX_HEADER = struct.Struct('<QI')
+INDEX_ENTRY = struct.Struct('<dQ')
+TRAILER = struct.Struct('<QQdd')
+FOOTER = struct.Struct('<Q8s')
+
+# --- Record types ---
+TELEMETRY, COMMAND, STATE, FRAME, TARGETS, IMU, INDEX, TRAILER_RECORD = 1, 2, 3, 4, 5, 6, 0x7E, 0x7F
+TYPE_NAMES = {TELEMETRY: 'telemetry', COMMAND: 'command', STATE: 'state', FRAME: 'frame', TARGETS: 'targets',
+              IMU: 'imu', INDEX: 'index', TRAILER_RECORD: 'trailer'}
+
+TELEMETRY_FIELDS = ('yaw', 'pitch', 'roll', 'rpm1', 'speed1', 'rpm2', 'speed2', 'x', 'y', 'theta')
+TELEMETRY_STRUCT = struct.Struct('<' + 'f' * len(TELEMETRY_FIELDS))
+COMMAND_STRUCT = struct.Struct('<f') # Speed, followed by b'source|command' or b'source|command|pose time'
+TARGETS_STRUCT = struct.Struct('<ff') # Mission distance (m), direction (deg)
+IMU_FIELDS = ('yaw', 'pitch', 'roll', 'yaw_rate')
+IMU_STRUCT = struct.Struct('<' + 'f' * len(IMU_FIELDS)) # Degrees, degrees/s
+
+INDEX_EVERY_SECONDS = 1.0
+INDEX_RESOLUTION = 0.1 # At most one index entry per 100 ms: ~36k entries for an hour, instant bisect
+MAX_PENDING_RECORDS = 20000 # ~3 minutes of 100 Hz telemetry if the SD card stalls; then we drop
+
+RECORDS_WRITTEN = metrics.counter('rover_flight_records_total', 'Records written by the flight recorder')
+RECORDS_DROPPED = metrics.counter('rover_flight_records_dropped_total', 'Records dropped because the writer fell behind')
+BYTES_WRITTEN = metrics.counter('rover_flight_bytes_total', 'Bytes written by the flight recorder')
+
+
+class FlightRecorder:
+    """
+    Buffered, rotating writer for the flight log.
+
+    :param folder: Where the .rfr files go.
+    :param max_bytes: Rotate to a new file past this size.
+    :param max_files: Delete the oldest files beyond this many (bounds disk usage to ~max_bytes * max_files).
+    :param frame_interval: Seconds between recorded camera frames (0 disables frames).
+    """
+    def __init__(self, folder=FLIGHT_FOLDER, max_bytes=64 * 1024 * 1024, max_files=20, frame_interval=1.0):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.frame_interval = frame_interval
+        self.pending = collections.deque()
+        self.wakeup = threading.Event()
+        self.running = threading.Event()
+        self.thread = None
+        self.last_frame_time = 0.0
+        # Writer-thread state
+        self.file = None
+        self.path = None
+        self.offset = 0
+        self.record_count = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.index_entries = []
+        self.last_index_offset = 0
+        self.last_index_time = 0.0
+        self.last_entry_ts = None
+
+    # --- Producer side (any thread; never touches the disk) ---
+    def _enqueue(self, record_type, payload, timestamp=None):
+        if not self.running.is_set():
+            return
+        if len(self.pending) >= MAX_PENDING_RECORDS:
+            RECORDS_DROPPED.inc()
+            return
+        self.pending.append((record_type, time.time() if timestamp is None else timestamp, payload))
+        if len(self.pending) >= 256:
+            self.wakeup.set()
+
+    def record_telemetry(self, sample, timestamp=None):
+        """sample: dict with TELEMETRY_FIELDS (missing fields are stored as NaN)."""
+        values = [float(sample.get(field, float('nan'))) for field in TELEMETRY_FIELDS]
+        self._enqueue(TELEMETRY, TELEMETRY_STRUCT.pack(*values), timestamp)
+
+    def record_command(self, command, speed=0.0, source='api', timestamp=None, pose_time=None):
+        """pose_time: for automation commands, the odometry time of the pose the decision was made on (replay.py
+           ticks the replayed controller at the same point in the telemetry)."""
+        text = f"{source}|{command}" if pose_time is None else f"{source}|{command}|{pose_time!r}"
+        self._enqueue(COMMAND, COMMAND_STRUCT.pack(float(speed or 0.0)) + text.encode('utf-8'), timestamp)
+
+    def record_state(self, old_state, new_state, timestamp=None):
+        self._enqueue(STATE, f"{old_state}|{new_state}".encode('utf-8'), timestamp)
+
+    def record_targets(self, distance, direction, timestamp=None):
+        """Mission targets as set from the dashboard (needed to re-run the mission in replay.py)."""
+        self._enqueue(TARGETS, TARGETS_STRUCT.pack(float(distance), float(direction)), timestamp)
+
+    def record_imu(self, sample):
+        """An imu.ImuSample read directly from the BNO08x (replay.py feeds these back into the odometry)."""
+        self._enqueue(IMU, IMU_STRUCT.pack(*(getattr(sample, field) for field in IMU_FIELDS)), sample.timestamp)
+
+    def frame_due(self, timestamp=None):
+        """True if record_frame() would keep a frame now, so the capture thread only encodes the ones it needs."""
+        now = time.time() if timestamp is None else timestamp
+        return self.running.is_set() and bool(self.frame_interval) and now - self.last_frame_time >= self.frame_interval
+
+    def record_frame(self, jpeg_bytes, timestamp=None):
+        """Records a JPEG if frame_interval has passed since the last one (decimation)."""
+        now = time.time() if timestamp is None else timestamp
+        if not self.frame_due(now):
+            return
+        self.last_frame_time = now
+        self._enqueue(FRAME, bytes(jpeg_bytes), now)
+
+    def wrap_motor_func(self, name, func, source='automation', pose_time=None):
+        """Returns func wrapped so every call is also recorded as a command.
+           pose_time: optional function returning the caller's pose_time for record_command()."""
+        def recorded(*args):
+            self.record_command(name, args[0] if args else 0.0, source, pose_time=pose_time() if pose_time else None)
+            return func(*args)
+        return recorded
+
+    # --- Writer thread ---
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.running.set()
+        self.thread = threading.Thread(target=self._run, name="flight-recorder", daemon=True)
+        self.thread.start()
+        print(f"[FlightRecorder] Recording to {self.folder}")
+
+    def stop(self):
+        self.running.clear()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        self._open_file()
+        last_flush = time.time()
+        while self.running.is_set() or self.pending:
+            self.wakeup.wait(timeout=0.5)
+            self.wakeup.clear()
+            while self.pending:
+                self._write_record(*self.pending.popleft())
+                if self.offset >= self.max_bytes:
+                    self._close_file()
+                    self._open_file()
+            now = time.time()
+            if now - self.last_index_time >= INDEX_EVERY_SECONDS and self.index_entries:
+                self._write_index()
+            if now - last_flush >= 1.0:
+                self.file.flush() # At most ~1 s of data lost on a power cut
+                last_flush = now
+        self._close_file()
+
+    def _open_file(self):
+        self.path = os.path.join(self.folder, time.strftime("flight_%Y%m%d_%H%M%S") + f"_{int(time.time() * 1000) % 1000:03d}.rfr")
+        self.file = open(self.path, 'wb', buffering=1024 * 1024)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, time.time()))
+        self.offset = FILE_HEADER.size
+        self.record_count = 0
+        self.first_ts = self.last_ts = None
+        self.index_entries = []
+        self.last_index_offset = 0
+        self.last_index_time = time.time()
+        self.last_entry_ts = None
+        self._prune_old_files()
+
+    def _write_record(self, record_type, timestamp, payload):
+        if record_type not in (INDEX, TRAILER_RECORD):
+            if self.last_entry_ts is None or timestamp - self.last_entry_ts >= INDEX_RESOLUTION:
+                self.index_entries.append((timestamp, self.offset))
+                self.last_entry_ts = timestamp
+            if self.first_ts is None:
+                self.first_ts = timestamp
+            self.last_ts = timestamp if self.last_ts is None else max(self.last_ts, timestamp)
+            self.record_count += 1
+        self.file.write(RECORD_HEADER.pack(record_type, 0, 0, len(payload), timestamp))
+        self.file.write(payload)
+        size = RECORD_HEADER.size + len(payload)
+        self.offset += size
+        RECORDS_WRITTEN.inc()
+        BYTES_WRITTEN.inc(size)
+
+    def _write_index(self):
+        offset = self.offset
+        payload = INDEX_HEADER.pack(self.last_index_offset, len(self.index_entries)) + \
+            b''.join(INDEX_ENTRY.pack(ts, off) for ts, off in self.index_entries)
+        self._write_record(INDEX, time.time(), payload)
+        self.last_index_offset = offset
+        self.index_entries = []
+        self.last_index_time = time.time()
+
+    def _close_file(self):
+        if self.file is None:
+            return
+        if self.index_entries:
+            self._write_index()
+        self._write_record(TRAILER_RECORD, time.time(),
+                           TRAILER.pack(self.last_index_offset, self.record_count, self.first_ts or 0.0, self.last_ts or 0.0))
+        self.file.write(FOOTER.pack(self.last_index_offset, FOOTER_MAGIC))
+        self.file.close()
+        self.file = None
+        print(f"[FlightRecorder] Closed {os.path.basename(self.path)} ({self.record_count} records, {self.offset / 1e6:.1f} MB)")
+
+    def _prune_old_files(self):
+        files = sorted(glob.glob(os.path.join(self.folder, '*.rfr')))
+        for path in files[:-self.max_files]:
+            try:
+                os.remove(path)
+                print(f"[FlightRecorder] Removed old log {os.path.basename(path)}")
+            except OSError:
+                pass
+
+
+# --- Reading ---
+class Record:
+    __slots__ = ('type', 'timestamp', 'payload', 'offset')
+
+    def __init__(self, record_type, timestamp, payload, offset):
+        self.type = record_type
+        self.timestamp = timestamp
+        self.payload = payload
+        self.offset = offset
+
+    @property
+    def type_name(self):
+        return TYPE_NAMES.get(self.type, str(self.type))
+
+    def decode(self):
+        """Returns the payload as a dict (telemetry/command/state/targets/imu) or the raw JPEG bytes (frame)."""
+        if self.type == TELEMETRY:
+            return dict(zip(TELEMETRY_FIELDS, TELEMETRY_STRUCT.unpack(self.payload)))
+        if self.type == COMMAND:
+            speed, = COMMAND_STRUCT.unpack_from(self.payload)
+            source, _, command = self.payload[COMMAND_STRUCT.size:].decode('utf-8').partition('|')
+            command, _, pose_time = command.partition('|')
+            if pose_time:
+                return {'command': command, 'speed': speed, 'source': source, 'pose_time': float(pose_time)}
+            return {'command': command, 'speed': speed, 'source': source}
+        if self.type == STATE:
+            old, _, new = self.payload.decode('utf-8').partition('|')
+            return {'from': old, 'to': new}
+        if self.type == TARGETS:
+            distance, direction = TARGETS_STRUCT.unpack(self.payload)
+            return {'distance': distance, 'direction': direction}
+        if self.type == IMU:
+            return dict(zip(IMU_FIELDS, IMU_STRUCT.unpack(self.payload)))
+        return self.payload
+
+
+class FlightLog:
+    """Reader for one .rfr file with timestamp seek through its index blocks."""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        magic, version, _, self.start_time = FILE_HEADER.unpack(self.file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a flight log")
+        self.index = [] # Sorted (timestamp, offset)
+        self.complete = self._load_index_from_footer()
+        if not self.complete:
+            self._rebuild_index() # No trailer (crash / power cut): walk the records once
+        self.first_ts = self.index[0][0] if self.index else None
+        self._index_times = [ts for ts, _ in self.index]
+
+    def close(self):
+        self.file.close()
+
+    def _load_index_from_footer(self):
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        if size < FILE_HEADER.size + FOOTER.size:
+            return False
+        self.file.seek(size - FOOTER.size)
+        last_index, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            return False
+        blocks = []
+        offset = last_index
+        while offset: # Walk the chain of index blocks backwards
+            record = self._read_at(offset)
+            previous, count = INDEX_HEADER.unpack_from(record.payload)
+            blocks.append([INDEX_ENTRY.unpack_from(record.payload, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+                           for i in range(count)])
+            offset = previous
+        for block in reversed(blocks):
+            self.index.extend(block)
+        self.index.sort()
+        return True
+
+    def _rebuild_index(self):
+        last_ts = None
+        for record in self._scan(FILE_HEADER.size, read_payload=False):
+            if record.type in (INDEX, TRAILER_RECORD):
+                continue
+            if last_ts is None or record.timestamp - last_ts >= INDEX_RESOLUTION:
+                self.index.append((record.timestamp, record.offset))
+                last_ts = record.timestamp
+        self.index.sort()
+
+    def _read_at(self, offset):
+        self.file.seek(offset)
+        header = self.file.read(RECORD_HEADER.size)
+        record_type, _, _, length, timestamp = RECORD_HEADER.unpack(header)
+        return Record(record_type, timestamp, self.file.read(length), offset)
+
+    def _scan(self, offset, read_payload=True):
+        """Yields records from offset to the trailer, or to the end (stops cleanly at a truncated tail)."""
+        self.file.seek(offset)
+        while True:
+            header = self.file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            record_type, _, _, length, timestamp = RECORD_HEADER.unpack(header)
+            if record_type not in TYPE_NAMES: # Reached the footer, or garbage after a crash
+                return
+            if read_payload:
+                payload = self.file.read(length)
+                if len(payload) < length:
+                    return
+            else:
+                payload = None
+                self.file.seek(length, os.SEEK_CUR)
+            yield Record(record_type, timestamp, payload, offset)
+            if record_type == TRAILER_RECORD: # Only the footer follows, and it can look like a record header
+                return
+            offset += RECORD_HEADER.size + length
+
+    def seek_offset(self, timestamp):
+        """File offset of the last indexed record at or before timestamp (start of file if none)."""
+        i = bisect.bisect_right(self._index_times, timestamp) - 1
+        return self.index[i][1] if i >= 0 else FILE_HEADER.size
+
+    def records(self, start=None, end=None, types=None):
+        """Yields Records with start <= timestamp <= end, optionally only the given type ids."""
+        offset = self.seek_offset(start) if start is not None else FILE_HEADER.size
+        for record in self._scan(offset):
+            if record.type in (INDEX, TRAILER_RECORD):
+                continue
+            if start is not None and record.timestamp < start:
+                continue
+            if end is not None and record.timestamp > end + INDEX_EVERY_SECONDS: # Allow for writer reordering
+                return
+            if end is not None and record.timestamp > end:
+                continue
+            if types is None or record.type in types:
+                yield record
+
+
+def open_flight_logs(path):
+    """Returns FlightLogs for a file or every .rfr in a folder, oldest first."""
+    paths = sorted(glob.glob(os.path.join(path, '*.rfr'))) if os.path.isdir(path) else [path]
+    return [FlightLog(p) for p in paths]
+
+
+def iter_records(logs, start=None, end=None, types=None):
+    """Yields records across rotated files, skipping files that end before start."""
+    for i, log in enumerate(logs):
+        next_start = logs[i + 1].first_ts if i + 1 < len(logs) else None
+        if start is not None and next_start is not None and next_start <= start:
+            continue # The whole file is before the window
+        if end is not None and log.first_ts is not None and log.first_ts > end:
+            return
+        yield from log.records(start, end, types)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect flight recorder logs.")
+    sub = parser.add_subparsers(dest='action', required=True)
+    dump = sub.add_parser('dump', help="Print records (one per line)")
+    dump.add_argument('path', help="A .rfr file or a folder of them")
+    dump.add_argument('--start', type=float, default=None, help="Unix time to seek to")
+    dump.add_argument('--end', type=float, default=None)
+    dump.add_argument('--types', default='', help="Comma-separated: telemetry,command,state,frame,targets")
+    dump.add_argument('--frames-out', default='', help="Write frame records as JPEG files into this folder")
+    info = sub.add_parser('info', help="Summarize the files")
+    info.add_argument('path')
+    args = parser.parse_args()
+
+    logs = open_flight_logs(args.path)
+    if args.action == 'info':
+        for log in logs:
+            print(f"{os.path.basename(log.path)}: {len(log.index)} index entries, first {log.first_ts}, "
+                  f"{'complete' if log.complete else 'no trailer (recovered)'}")
+        return
+
+    name_to_type = {name: t for t, name in TYPE_NAMES.items()}
+    types = {name_to_type[t.strip()] for t in args.types.split(',') if t.strip()} or None
+    if args.frames_out:
+        os.makedirs(args.frames_out, exist_ok=True)
+    for record in iter_records(logs, args.start, args.end, types):
+        value = record.decode()
+        if record.type == FRAME:
+            if args.frames_out:
+                with open(os.path.join(args.frames_out, f"frame_{record.timestamp:.3f}.jpg"), 'wb') as f:
+                    f.write(value)
+            value = f"<jpeg {len(value)} bytes>"
+        print(f"{record.timestamp:.3f} {record.type_name:9s} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+# frame_bus.py - Shared-memory frame ring between processes
+# The camera side writes each frame ONCE into a preallocated slot of a multiprocessing.shared_memory
+# segment; the vision, recording and streaming processes map the same segment and read the pixels in
+# place - no pickling, no pipes, no per-reader copies - so they can run on other cores, outside the
+# Flask process's GIL.
+#
+# Layout (all offsets 64-byte aligned):
+#   header   8 x uint64   magic, slots, height, width, channels, jpeg capacity, write seq, max readers
+#   readers  max_readers x (pid, cursor) uint64 + a 32-byte name each, so lag is visible to everyone
+#   meta     slots x (seq_begin, seq_end, jpeg_len, flags) uint64, plus a float64 timestamp per slot
+#   frames   slots x height x width x channels uint8 (BGR)
+#   jpegs    slots x jpeg capacity uint8 (the encoded frame, if the writer has one)
+#
+# Each slot is a seqlock: the writer sets seq_begin, fills the slot, then sets seq_end. A reader that
+# sees seq_begin == seq_end == the seq it wanted AFTER using the data knows nothing overwrote it.
+#
+# Usage (writer):  bus = FrameBus.create(); bus.write(frame, jpeg)
+# Usage (reader):  bus = FrameBus.attach(); reader = bus.reader("qr"); f = reader.read(timeout=1.0)
+
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+BUS_NAME = "rover_frames"
+FRAME_BUS_ENV = "ROVER_FRAME_BUS"
+DEFAULT_SLOTS = 8 # ~270 ms of history at 30 fps before a slot is reused
+DEFAULT_SHAPE = (480, 640, 3)
+DEFAULT_JPEG_CAPACITY = 256 * 1024
+DEFAULT_MAX_READERS = 8
+NAME_BYTES = 32
+
+MAGIC = 0x524F564552425553 # "ROVERBUS"
+H_MAGIC, H_SLOTS, H_HEIGHT, H_WIDTH, H_CHANNELS, H_JPEG_CAP, H_WRITE_SEQ, H_MAX_READERS = range(8)
+M_BEGIN, M_END, M_JPEG_LEN, M_FLAGS = range(4)
+R_PID, R_CURSOR = range(2)
+HAS_FRAME = 1
+HAS_JPEG = 2
+
+POLL_SECONDS = 0.002 # Readers poll the write seq; cheaper than a cross-process condition at 30 Hz
+
+
+def _align(n, to=64):
+    return (n + to - 1) // to * to
+
+
+def _layout(slots, shape, jpeg_capacity, max_readers):
+    """Returns {region: (offset, nbytes)} and the total segment size."""
+    sizes = [
+        ('header', 8 * 8),
+        ('readers', max_readers * 2 * 8),
+        ('names', max_readers * NAME_BYTES),
+        ('meta', slots * 4 * 8),
+        ('timestamps', slots * 8),
+        ('frames', slots * int(np.prod(shape))),
+        ('jpegs', slots * jpeg_capacity),
+    ]
+    regions, offset = {}, 0
+    for region, nbytes in sizes:
+        regions[region] = (offset, nbytes)
+        offset = _align(offset + nbytes)
+    return regions, offset
+
+
+class BusFrame:
+    """One frame read from the bus. frame/jpeg are views into shared memory unless read(copy=True)."""
+    def __init__(self, bus, slot, seq, timestamp, frame, jpeg):
+        self.bus = bus
+        self.slot = slot
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame # BGR ndarray view, or None if the writer only had JPEG
+        self.jpeg = jpeg   # uint8 ndarray view of the JPEG bytes, or None
+
+    def valid(self):
+        """True if the slot still holds this frame. Check it after using the views: False means the
+           writer lapped us mid-read and the pixels may be torn."""
+        meta = self.bus.meta[self.slot]
+        return int(meta[M_BEGIN]) == self.seq and int(meta[M_END]) == self.seq
+
+
+class FrameBus:
+    """
+    Shared-memory ring of preallocated frame slots. Create it once (the camera side) and attach from
+    any other process by name.
+
+    :param shm: The SharedMemory segment (use create() / attach() rather than the constructor).
+    :param owner: True for the creating process, which unlinks the segment on close().
+    """
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+        if int(header[H_MAGIC]) != MAGIC:
+            raise RuntimeError(f"Shared memory '{shm.name}' is not a frame bus")
+        self.slots = int(header[H_SLOTS])
+        self.shape = (int(header[H_HEIGHT]), int(header[H_WIDTH]), int(header[H_CHANNELS]))
+        self.jpeg_capacity = int(header[H_JPEG_CAP])
+        self.max_readers = int(header[H_MAX_READERS])
+        regions, _ = _layout(self.slots, self.shape, self.jpeg_capacity, self.max_readers)
+        view = lambda region, dtype, shape: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=regions[region][0])
+        self.header = header
+        self.readers = view('readers', np.uint64, (self.max_readers, 2))
+        self.names = view('names', np.uint8, (self.max_readers, NAME_BYTES))
+        self.meta = view('meta', np.uint64, (self.slots, 4))
+        self.timestamps = view('timestamps', np.float64, (self.slots,))
+        self.frames = view('frames', np.uint8, (self.slots,) + self.shape)
+        self.jpegs = view('jpegs', np.uint8, (self.slots, self.jpeg_capacity))
+
+    @classmethod
+    def create(cls, name=BUS_NAME, slots=DEFAULT_SLOTS, shape=DEFAULT_SHAPE, jpeg_capacity=DEFAULT_JPEG_CAPACITY,
+               max_readers=DEFAULT_MAX_READERS):
+        regions, size = _layout(slots, shape, jpeg_capacity, max_readers)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError: # Left behind by a crashed run; nobody else should be writing it
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        control_bytes = regions['frames'][0]
+        shm.buf[:control_bytes] = bytes(control_bytes) # Zero the header, reader table and slot metadata
+        header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (MAGIC, slots, shape[0], shape[1], shape[2], jpeg_capacity, 0, max_readers)
+        print(f"[FrameBus] Created '{name}': {slots} slots of {shape[1]}x{shape[0]}, {size / 1e6:.1f} MB")
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=BUS_NAME, untrack=True):
+        """Maps an existing bus. Pass untrack=False from processes spawned by the bus's creator: they share
+           its resource tracker, and unregistering there would drop the creator's registration."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=False, track=False) # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name, create=False)
+            if untrack: # Before 3.13 our own resource tracker would unlink the creator's segment when we exit
+                try:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+                except Exception:
+                    pass
+        return cls(shm, owner=False)
+
+    # --- Writer side ---
+    @property
+    def write_seq(self):
+        return int(self.header[H_WRITE_SEQ])
+
+    def write(self, frame=None, jpeg=None, timestamp=None):
+        """Publishes one frame (BGR of the bus's shape and/or JPEG bytes). Returns its seq. Single writer only."""
+        seq = self.write_seq + 1
+        slot = seq % self.slots
+        meta = self.meta[slot]
+        meta[M_BEGIN] = seq # From here until M_END == seq, readers treat the slot as being rewritten
+        flags = 0
+        if frame is not None:
+            if frame.shape != self.shape:
+                raise ValueError(f"Frame shape {frame.shape} does not match the bus {self.shape}")
+            np.copyto(self.frames[slot], frame)
+            flags |= HAS_FRAME
+        length = 0
+        if jpeg is not None and len(jpeg) <= self.jpeg_capacity:
+            length = len(jpeg)
+            self.jpegs[slot, :length] = np.frombuffer(jpeg, dtype=np.uint8)
+            flags |= HAS_JPEG
+        meta[M_JPEG_LEN] = length
+        meta[M_FLAGS] = flags
+        self.timestamps[slot] = timestamp if timestamp is not None else time.time()
+        meta[M_END] = seq
+        self.header[H_WRITE_SEQ] = seq
+        return seq
+
+    # --- Reader side ---
+    def reader(self, name, mode='latest', shard=(0, 1)):
+        return BusReader(self, name, mode, shard)
+
+    def reader_status(self):
+        """[{name, pid, cursor, lag}] for every registered reader (lag in frames behind the writer)."""
+        write_seq = self.write_seq
+        status = []
+        for index in range(self.max_readers):
+            pid = int(self.readers[index, R_PID])
+            if pid and _pid_alive(pid): # Slots of crashed readers are reclaimed by the next registration
+                cursor = int(self.readers[index, R_CURSOR])
+                name = bytes(self.names[index]).rstrip(b'\0').decode('utf-8', 'ignore')
+                status.append({'name': name, 'pid': pid, 'cursor': cursor, 'lag': write_seq - cursor})
+        return status
+
+    def close(self):
+        name = self.shm.name
+        # Drop our numpy views first; SharedMemory.close() refuses while buffers are exported
+        self.header = self.readers = self.names = self.meta = self.timestamps = self.frames = self.jpegs = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            print(f"[FrameBus] Removed '{name}'.")
+
+
+class BusReader:
+    """
+    A cursor into the bus.
+
+    :param bus: The FrameBus.
+    :param name: Shown in reader_status() (up to 32 bytes).
+    :param mode: 'latest' jumps to the newest frame (vision, streaming); 'every' reads frames in order and
+                 counts the ones the writer overwrote before we got to them (recording).
+    :param shard: (index, count): only frames with seq % count == index, so N worker processes split the load.
+    """
+    def __init__(self, bus, name, mode='latest', shard=(0, 1)):
+        if mode not in ('latest', 'every'):
+            raise ValueError(f"Unknown reader mode '{mode}'")
+        self.bus = bus
+        self.mode = mode
+        self.shard_index, self.shard_count = shard
+        self.cursor = bus.write_seq
+        self.overruns = 0 # Frames lost in 'every' mode
+        self.torn = 0     # Reads whose slot was rewritten while we copied it
+        self.index = self._register(name)
+
+    def _register(self, name):
+        for index in range(self.bus.max_readers):
+            pid = int(self.bus.readers[index, R_PID])
+            if pid == 0 or not _pid_alive(pid): # Free, or left over by a dead process
+                self.bus.readers[index] = (os.getpid(), self.cursor)
+                encoded = name.encode('utf-8')[:NAME_BYTES]
+                self.bus.names[index] = 0
+                self.bus.names[index, :len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+                return index
+        raise RuntimeError(f"Frame bus has no free reader slots ({self.bus.max_readers} in use)")
+
+    def close(self):
+        if self.index is not None:
+            self.bus.readers[self.index] = (0, 0)
+            self.index = None
+
+    def _next_seq(self, write_seq):
+        """The seq to read next given the writer's position, or None if nothing new is for us."""
+        if self.mode == 'latest':
+            target = write_seq - (write_seq - self.shard_index) % self.shard_count # Newest frame in our shard
+        else:
+            target = self.cursor + 1
+            while target % self.shard_count != self.shard_index:
+                target += 1
+            oldest = write_seq - self.bus.slots + 2 # The slot after the one being written next is the oldest safe one
+            if target < oldest:
+                skipped = (oldest - target + self.shard_count - 1) // self.shard_count
+                self.overruns += skipped
+                target += skipped * self.shard_count
+        return target if self.cursor < target <= write_seq else None
+
+    def read(self, timeout=None, copy=False):
+        """Waits for the next frame for this reader. Returns a BusFrame, or None on timeout.
+           With copy=False (the point of the bus) frame/jpeg are views: call .valid() once done with them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            target = self._next_seq(self.bus.write_seq)
+            if target is not None:
+                frame = self._read_slot(target, copy)
+                if frame is not None:
+                    return frame
+                continue # Lapped between choosing and reading; pick again
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_SECONDS)
+
+    def _read_slot(self, seq, copy):
+        bus = self.bus
+        slot = seq % bus.slots
+        meta = bus.meta[slot]
+        if int(meta[M_END]) != seq or int(meta[M_BEGIN]) != seq:
+            self.torn += 1
+            return None
+        flags = int(meta[M_FLAGS])
+        frame = bus.frames[slot] if flags & HAS_FRAME else None
+        jpeg = bus.jpegs[slot, :int(meta[M_JPEG_LEN])] if flags & HAS_JPEG else None
+        if copy:
+            frame = frame.copy() if frame is not None else None
+            jpeg = jpeg.copy() if jpeg is not None else None
+        result = BusFrame(bus, slot, seq, float(bus.timestamps[slot]), frame, jpeg)
+        if copy and not result.valid():
+            self.torn += 1
+            return None
+        self.cursor = seq
+        bus.readers[self.index, R_CURSOR] = seq
+        return result
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
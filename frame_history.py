@@ -0,0 +1,159 @@
+# frame_history.py - The last N camera frames, for instant photos
+# The capture thread copies every raw frame (before the QR overlay) into a ring of preallocated
+# slots, so /take_photo never has to read the camera itself (which stole a frame from the stream
+# and returned a frame captured *after* the click). A photo is the sharpest frame of the last few
+# hundred ms - the rover shakes while driving - or a burst of frames around the click time.
+#
+# Sharpness is the variance of the Laplacian on a 4x downscaled grey copy, computed for all candidate
+# frames at once with numpy (~5 ms for the 0.3 s /take_photo looks back over). In JPEG passthrough mode the slots hold
+# the camera's JPEG bytes instead and the grey copy comes from a reduced-size decode.
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+SHARPNESS_SCALE = 4 # Downscale factor before the Laplacian
+
+
+def laplacian_variance(grays):
+    """Variance of the 4-neighbour Laplacian of each image in an (n, h, w) stack, all n in one pass."""
+    g = grays.astype(np.float32)
+    laplacian = g[:, 1:-1, 2:] + g[:, 1:-1, :-2] + g[:, 2:, 1:-1] + g[:, :-2, 1:-1] - 4.0 * g[:, 1:-1, 1:-1]
+    return laplacian.reshape(len(g), -1).var(axis=1)
+
+
+def downscale(sources):
+    """(n, h, w) grey stack, SHARPNESS_SCALE times smaller, from an (n, H, W) uint8 stack or a list of JPEGs."""
+    s = SHARPNESS_SCALE
+    if isinstance(sources, np.ndarray):
+        n, h, w = sources.shape
+        sums = np.zeros((n, h // s, w // s), dtype=np.uint16)
+        for dy in range(s): # Block means as s*s strided adds: several times faster than reshape().sum()
+            for dx in range(s):
+                sums += sources[:, dy:h // s * s:s, dx:w // s * s:s]
+        return sums / np.float32(s * s)
+    return np.stack([cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+                     for jpeg in sources])
+
+
+class HistoryFrame:
+    """A frame copied out of the ring: frame (BGR) or jpeg (passthrough) is set."""
+    __slots__ = ('seq', 'timestamp', 'frame', 'jpeg', 'sharpness')
+
+    def __init__(self, seq, timestamp, frame, jpeg, sharpness=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame
+        self.jpeg = jpeg
+        self.sharpness = sharpness
+
+    def image(self):
+        """The frame as BGR pixels (decoding the JPEG in passthrough mode), or None if it doesn't decode."""
+        if self.frame is not None:
+            return self.frame
+        return cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class FrameHistory:
+    """
+    Ring of the most recent camera frames with their timestamps.
+
+    :param capacity: Number of frames kept (30 = about a second at 30 fps; ~28 MB at 640x480).
+    """
+    def __init__(self, capacity=30):
+        self.capacity = capacity
+        self.cond = threading.Condition()
+        self.frames = None # (capacity, h, w, 3) uint8, allocated on the first frame
+        self.jpegs = [None] * capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.seqs = np.zeros(capacity, dtype=np.int64) # 0 = empty slot
+        self.seq = 0
+
+    def push(self, frame=None, jpeg=None, timestamp=None):
+        """Called by the capture thread for every frame: copies a BGR frame into the next slot (no allocation)
+           or keeps a reference to the JPEG bytes."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.cond:
+            slot = self.seq % self.capacity
+            if frame is not None:
+                if self.frames is None or self.frames.shape[1:] != frame.shape:
+                    self.frames = np.empty((self.capacity,) + frame.shape, dtype=np.uint8)
+                    self.seqs[:] = 0 # Size changed: the old slots no longer fit
+                np.copyto(self.frames[slot], frame)
+                self.jpegs[slot] = None
+            else:
+                self.jpegs[slot] = jpeg
+            self.seq += 1
+            self.seqs[slot] = self.seq
+            self.timestamps[slot] = timestamp
+            self.cond.notify_all()
+
+    def latest_time(self):
+        with self.cond:
+            return float(self.timestamps[(self.seq - 1) % self.capacity]) if self.seq else None
+
+    def _slots(self, start, end):
+        """Slots with start <= timestamp <= end, oldest first. Lock held."""
+        valid = (self.seqs > 0) & (self.timestamps >= start) & (self.timestamps <= end)
+        slots = np.flatnonzero(valid)
+        return slots[np.argsort(self.seqs[slots])]
+
+    def _copy(self, slot):
+        """Copies a slot out before the capture thread reuses it. Lock held."""
+        jpeg = self.jpegs[slot]
+        frame = None if jpeg is not None else self.frames[slot].copy()
+        return HistoryFrame(int(self.seqs[slot]), float(self.timestamps[slot]), frame, jpeg)
+
+    def sharpest(self, start, end):
+        """The sharpest frame with start <= timestamp <= end (the newest frame if none is that recent), or None."""
+        with self.cond:
+            if not self.seq:
+                return None
+            slots = self._slots(start, end)
+            if not len(slots):
+                slots = np.array([(self.seq - 1) % self.capacity])
+            scored_seqs = self.seqs[slots].copy() # To tell if the capture thread reuses a slot while we score
+            if self.jpegs[slots[0]] is None:
+                sources = self.frames[slots, :, :, 1] # One copy of the green channel (a free stand-in for luminance)
+            else:
+                sources = [self.jpegs[slot] for slot in slots]
+        scores = laplacian_variance(downscale(sources)) # Outside the lock: the capture thread keeps pushing
+        with self.cond:
+            for best in np.argsort(-scores, kind='stable'): # The sharpest frame the capture thread hasn't overwritten since
+                if self.seqs[slots[best]] == scored_seqs[best]:
+                    picked = self._copy(slots[best])
+                    picked.sharpness = float(scores[best])
+                    return picked
+        return None
+
+    def first_after(self, timestamp, timeout=1.0):
+        """The first frame captured after timestamp, waiting (up to timeout) for it to arrive; None on timeout."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                slots = self._slots(np.nextafter(timestamp, np.inf), np.inf)
+                if len(slots):
+                    return self._copy(slots[0])
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def around(self, timestamp, count, timeout=2.0):
+        """A burst: the count frames nearest to timestamp, about half of them from after it.
+           Waits (up to timeout) for the frames after the click to arrive."""
+        after_needed = count - count // 2
+        deadline = time.time() + timeout
+        with self.cond:
+            while np.count_nonzero((self.seqs > 0) & (self.timestamps > timestamp)) < after_needed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            slots = self._slots(-np.inf, np.inf)
+            distance = np.abs(self.timestamps[slots] - timestamp)
+            nearest = np.sort(slots[np.argsort(distance, kind='stable')[:count]])
+            nearest = nearest[np.argsort(self.seqs[nearest])]
+            return [self._copy(slot) for slot in nearest]
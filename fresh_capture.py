@@ -0,0 +1,87 @@
+# fresh_capture.py - Freshest-frame camera capture
+# cv2.VideoCapture keeps a queue of driver buffers (4 with V4L2). Whenever the capture thread falls
+# behind (a slow QR decode, a JPEG encode under load), cam.read() hands out the oldest queued frame, and
+# the stream stays that many frames behind reality for good. FreshestFrameCapture shrinks the driver
+# queue to one buffer and drains the camera on its own thread as fast as it delivers, keeping only the
+# newest frame; read() returns the newest frame not handed out yet. Frames nobody read in time are dropped.
+# Opt-in with ROVER_FRESH_CAPTURE=1. Measure the difference with latency_test.py.
+
+import os
+import threading
+import time
+
+import cv2
+
+import metrics
+
+FRESH_CAPTURE_ENV = "ROVER_FRESH_CAPTURE"
+
+FRESH_DROPPED = metrics.counter('rover_camera_stale_frames_dropped_total', 'Frames replaced by a newer one before anyone read them')
+FRESH_FRAME_AGE = metrics.histogram('rover_camera_frame_age_seconds', 'Time from the grabber reading a frame to read() handing it out')
+
+
+def fresh_capture_enabled():
+    return os.environ.get(FRESH_CAPTURE_ENV) == '1'
+
+
+class FreshestFrameCapture:
+    """
+    Drop-in wrapper for a cv2.VideoCapture (or SimCamera): read(), isOpened(), get(), set(), release().
+
+    :param cam: An opened camera. Configure it (size, FOURCC, CONVERT_RGB) before wrapping: the grabber
+                thread owns it afterwards and VideoCapture is not thread-safe.
+    :param read_timeout: Seconds read() waits for a new frame before reporting a failed read.
+    """
+    def __init__(self, cam, read_timeout=2.0):
+        self.cam = cam
+        self.read_timeout = read_timeout
+        cam.set(cv2.CAP_PROP_BUFFERSIZE, 1) # Not every backend honours it; the grabber keeps the queue empty either way
+        self.cond = threading.Condition()
+        self.frame = None
+        self.captured_at = 0.0 # time.monotonic() when the grabber got self.frame
+        self.seq = 0           # Frames grabbed
+        self.read_seq = 0      # seq of the last frame read() returned
+        self.running = True
+        self.thread = threading.Thread(target=self._grab_loop, name="camera-grabber", daemon=True)
+        self.thread.start()
+
+    def _grab_loop(self):
+        while self.running and self.cam.isOpened():
+            ret, frame = self.cam.read()
+            if not ret:
+                time.sleep(0.05) # read() reports the failure to the capture thread by timing out
+                continue
+            with self.cond:
+                if self.seq > self.read_seq:
+                    FRESH_DROPPED.inc() # The previous frame was never read: nobody wants it any more
+                self.frame, self.captured_at = frame, time.monotonic()
+                self.seq += 1
+                self.cond.notify_all()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def read(self):
+        """(True, newest frame not returned before), waiting for the next one if needed; (False, None) on timeout or close."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > self.read_seq or not self.running, timeout=self.read_timeout)
+            if self.seq == self.read_seq:
+                return False, None
+            self.read_seq = self.seq
+            frame, captured_at = self.frame, self.captured_at
+        FRESH_FRAME_AGE.observe(time.monotonic() - captured_at)
+        return True, frame
+
+    def isOpened(self):
+        return self.running and self.cam.isOpened()
+
+    def get(self, prop):
+        return self.cam.get(prop)
+
+    def set(self, prop, value):
+        return self.cam.set(prop, value)
+
+    def release(self):
+        self.running = False
+        self.thread.join(timeout=2)
+        self.cam.release()
@@ -124,14 +124,14 @@
 
 # hardware.py (Refactored to use gpiozero for motors, PCA9685 for servo cam)
 
-# --- CHANGED: Use gpiozero instead of RPi.GPIO ---
-from gpiozero import PWMOutputDevice, DigitalOutputDevice
+# --- CHANGED: gpiozero, board/busio and the PCA9685 are now opened lazily (see init_motors / init_servo_pca) ---
+# Importing this module no longer touches GPIO or I2C, so app.py can start serving before the hardware is up.
+import threading
 import time
 
-# --- PCA9685 Imports (for servo cam only) ---
-import board
-import busio
-import adafruit_pca9685
+from rover_logging import get_logger
+
+log = get_logger('hardware') # Motor calls log at DEBUG: they happen on every key press and every 50 ms in automation
 
 
 # --- Motor Pin Definitions (gpiozero uses BCM numbering directly) ---
@@ -149,27 +149,61 @@ SERVO_MIN_PULSE_VALUE = int(500 * (65535 / 20000.0))
 SERVO_MAX_PULSE_VALUE = int(2500 * (65535 / 20000.0))
 
 
-# --- gpiozero Setup (for Motors) ---
-# Initialize PWM for motors using PWMOutputDevice
-pwm1_motor = PWMOutputDevice(PWM1, frequency=1000) # Left Motor PWM object
-pwm2_motor = PWMOutputDevice(PWM2, frequency=1000) # Right Motor PWM object
+# --- gpiozero Devices (for Motors), created by init_motors() ---
+pwm1_motor = None # Left Motor PWM object
+pwm2_motor = None # Right Motor PWM object
+dir1_pin = None   # Left Motor Direction pin
+dir2_pin = None   # Right Motor Direction pin
+
+# --- PCA9685 Object (for Servo Cam PCA ONLY), created by init_servo_pca() ---
+servo_cam_pca = None
 
-# Initialize DigitalOutputDevice for direction pins
-dir1_pin = DigitalOutputDevice(DIR1) # Left Motor Direction pin
-dir2_pin = DigitalOutputDevice(DIR2) # Right Motor Direction pin
+_init_lock = threading.Lock() # Prevents two threads from opening the same pins at once
 
 
-# --- PCA9685 I2C and Object Setup (for Servo Cam PCA ONLY) ---
-i2c = busio.I2C(board.SCL, board.SDA) 
-servo_cam_pca = adafruit_pca9685.PCA9685(i2c, address=SERVO_CAM_PCA_ADDRESS)
-servo_cam_pca.frequency = 50 
+def init_motors():
+    """Opens the motor PWM and direction pins. Safe to call more than once.
+       Returns True once the motors are ready.
+    """
+    global pwm1_motor, pwm2_motor, dir1_pin, dir2_pin
+    if pwm1_motor is not None: # Fast path once the pins are open
+        return True
+    with _init_lock:
+        if pwm1_motor is None:
+            from gpiozero import PWMOutputDevice, DigitalOutputDevice
+            # Initialize PWM for motors using PWMOutputDevice
+            pwm1_motor = PWMOutputDevice(PWM1, frequency=1000)
+            pwm2_motor = PWMOutputDevice(PWM2, frequency=1000)
+            # Initialize DigitalOutputDevice for direction pins
+            dir1_pin = DigitalOutputDevice(DIR1)
+            dir2_pin = DigitalOutputDevice(DIR2)
+            log.info("Motor GPIO initialized (via gpiozero)")
+    return True
+
+
+def init_servo_pca():
+    """Opens the I2C bus and the camera servo PCA9685. Returns the PCA9685 object."""
+    global servo_cam_pca
+    if servo_cam_pca is not None:
+        return servo_cam_pca
+    with _init_lock:
+        if servo_cam_pca is None:
+            import board
+            import busio
+            import adafruit_pca9685
+            i2c = busio.I2C(board.SCL, board.SDA)
+            pca = adafruit_pca9685.PCA9685(i2c, address=SERVO_CAM_PCA_ADDRESS)
+            pca.frequency = 50
+            servo_cam_pca = pca
+    return servo_cam_pca
 
 
 # --- Motor Control Functions (using gpiozero) ---
 
 def forward(speed):
     """Moves the rover straight forward. Speed is 0-100."""
-    print(f"[Hardware] Moving forward at {speed}% speed (via gpiozero)")
+    init_motors()
+    log.debug("Moving forward at %s%% speed (via gpiozero)", speed)
     # Set direction pins (False for LOW, True for HIGH) - VERIFY THIS LOGIC ON YOUR ROBOT
     dir1_pin.on() # Left Motor Direction (adjust on()/off() based on testing)
     dir2_pin.off() # Right Motor Direction (adjust on()/off() based on testing)
@@ -179,7 +213,8 @@ def forward(speed):
 
 def backward(speed):
     """Moves the rover straight backward. Speed is 0-100."""
-    print(f"[Hardware] Moving backward at {speed}% speed (via gpiozero)")
+    init_motors()
+    log.debug("Moving backward at %s%% speed (via gpiozero)", speed)
     dir1_pin.off() # Left Motor Direction
     dir2_pin.on() # Right Motor Direction
     pwm1_motor.value = speed / 100.0
@@ -187,7 +222,8 @@ def backward(speed):
 
 def turn_left(speed):
     """Turns the rover left (left wheels backward, right wheels forward). Speed is 0-100."""
-    print(f"[Hardware] Turning left at {speed}% speed (via gpiozero)")
+    init_motors()
+    log.debug("Turning left at %s%% speed (via gpiozero)", speed)
     dir1_pin.off()  # Left motor backward
     dir2_pin.off() # Right motor forward
     pwm1_motor.value = speed / 100.0
@@ -195,7 +231,8 @@ def turn_left(speed):
 
 def turn_right(speed):
     """Turns the rover right (left wheels forward, right wheels backward). Speed is 0-100."""
-    print(f"[Hardware] Turning right at {speed}% speed (via gpiozero)")
+    init_motors()
+    log.debug("Turning right at %s%% speed (via gpiozero)", speed)
     dir1_pin.on() # Left motor forward
     dir2_pin.on()  # Right motor backward
     pwm1_motor.value = speed / 100.0
@@ -203,22 +240,28 @@ def turn_right(speed):
 
 def stop():
     """Stops all motors (sets PWM duty cycle to 0)."""
-    print("[Hardware] Stopping motors (via gpiozero)")
+    init_motors()
+    log.debug("Stopping motors (via gpiozero)")
     pwm1_motor.value = 0.0 # 0% duty cycle
     pwm2_motor.value = 0.0 # 0% duty cycle
     # Reset direction pins to a consistent state
     dir1_pin.off() 
     dir2_pin.off() 
 
+def motors_active():
+    """True while either motor has a non-zero duty cycle (the rover is driving or turning)."""
+    return pwm1_motor is not None and (pwm1_motor.value > 0 or pwm2_motor.value > 0)
+
 # --- Camera Tilt Servo Control Function (using SERVO_CAM_PCA) ---
 def set_camera_tilt_angle(angle_degrees):
     """Sets the tilt angle of the camera servo on SERVO_CAM_PCA.
        Angle: 0 to 180 degrees. Uses calibrated min/max pulse values.
     """
+    init_servo_pca()
     angle_degrees = max(0, min(180, angle_degrees))
     value = SERVO_MIN_PULSE_VALUE + (angle_degrees / 180.0) * (SERVO_MAX_PULSE_VALUE - SERVO_MIN_PULSE_VALUE)
     servo_cam_pca.channels[CAMERA_TILT_SERVO_CHANNEL].duty_cycle = int(value)
-    print(f"[Hardware] Camera tilt set to {angle_degrees} degrees (PCA9685 Channel {CAMERA_TILT_SERVO_CHANNEL})")
+    log.debug("Camera tilt set to %s degrees (PCA9685 Channel %d)", angle_degrees, CAMERA_TILT_SERVO_CHANNEL)
     time.sleep(0.1) # Give servo time to move (adjust as needed)
 
 
@@ -228,19 +271,24 @@ def cleanup_gpio(): # This function cleans up gpiozero (motors) and PCA9685 (ser
     """Cleans up gpiozero (motors) and PCA9685 (servo) resources."""
     print("[Hardware] Performing cleanup...")
     # gpiozero Cleanup (for motors)
-    pwm1_motor.close() # Close gpiozero devices
-    pwm2_motor.close()
-    dir1_pin.close()
-    dir2_pin.close()
+    if pwm1_motor is not None:
+        pwm1_motor.close() # Close gpiozero devices
+        pwm2_motor.close()
+        dir1_pin.close()
+        dir2_pin.close()
 
     # PCA9685 Servo Cleanup
-    servo_cam_pca.channels[CAMERA_TILT_SERVO_CHANNEL].duty_cycle = 0 
+    if servo_cam_pca is not None:
+        servo_cam_pca.channels[CAMERA_TILT_SERVO_CHANNEL].duty_cycle = 0 
     
     print("Hardware cleanup complete.")
 
 
 # --- Example Usage (for testing this hardware.py independently) ---
 if __name__ == '__main__':
+    import logging
+    from rover_logging import setup_logging
+    setup_logging(levels={'hardware': logging.DEBUG}) # Show every motor call when testing by hand
     try:
         print("--- Testing Camera Tilt Servo (PCA9685 Channel 3) ---")
         set_camera_tilt_angle(0)   # 0 degrees
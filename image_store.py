@@ -0,0 +1,401 @@
+# image_store.py - Append-only photo / QR detection image store with thumbnails
+# Photos (/take_photo) and QR detections used to be loose JPEGs in data/photos, static/ and the repo
+# root, served one by one at full size. The store packs them into segment files instead:
+#
+#   data/images/seg_000001.dat   records: header (magic b'IMGR', kind u8, reserved u8, label length u16,
+#                                image id u32, JPEG length u32, time f64) + label (utf-8 'kind|label',
+#                                empty for thumbnails) + JPEG bytes
+#   data/images/index.jsonl      one line per image ({"id", "kind", "label", "t", "seg", "off", "len"})
+#                                and per thumbnail ({"id", "thumb": [seg, off, len], "w", "h"})
+#   data/images/store_id         random token made with the store; ids restart at 1 when the folder is wiped
+#
+# Segments are only ever appended to; past max_bytes the oldest whole segment is deleted (and its
+# images dropped from the index), so disk use stays bounded. A thread makes a small thumbnail for each
+# new image, appended like any other record. Reads slice a read-only mmap of the segment (no open/read
+# per request), and the routes in app.py add ETag / Cache-Control / Range headers. The ETag and the
+# ?v= of the listed URLs are the store token plus the record's (segment, offset), so they never name
+# two different images: browsers cache versioned URLs for good and revalidate the rest, and a gallery
+# of thousands of thumbnails reloads with 304s.
+#
+# Usage: python image_store.py import data/photos static   (copy existing loose JPEGs into the store)
+#        python image_store.py info
+
+import argparse
+import binascii
+import glob
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+IMAGE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'images')
+RECORD_MAGIC = b'IMGR'
+RECORD_HEADER = struct.Struct('<4sBBHIId')
+IMAGE, THUMBNAIL = 1, 2
+THUMB_WIDTH = 200
+THUMB_QUALITY = 70
+
+IMAGES_STORED = metrics.counter('rover_images_stored_total', 'Images added to the image store')
+THUMBNAIL_SECONDS = metrics.histogram('rover_thumbnail_seconds', 'Time to decode, shrink and encode one thumbnail')
+IMAGE_STORE_BYTES = metrics.gauge('rover_image_store_bytes', 'Bytes used by the image store segments')
+
+
+class StoredImage:
+    __slots__ = ('id', 'kind', 'label', 'time', 'location', 'thumb', 'width', 'height')
+
+    def __init__(self, image_id, kind, label, timestamp, location):
+        self.id = image_id
+        self.kind = kind
+        self.label = label
+        self.time = timestamp
+        self.location = location # (segment number, payload offset, length)
+        self.thumb = None        # Same, once the thumbnail exists
+        self.width = None
+        self.height = None
+
+    def to_dict(self, token):
+        thumb_url = f'/images/{self.id}/thumb' + (f'?v={version(token, self.thumb)}' if self.thumb else '')
+        return {'id': self.id, 'kind': self.kind, 'label': self.label, 'time': self.time,
+                'width': self.width, 'height': self.height, 'bytes': self.location[2],
+                'url': f'/images/{self.id}?v={version(token, self.location)}', 'thumb_url': thumb_url}
+
+
+def version(token, location):
+    """ETag / ?v= value of the record at location (segment, offset, length) in the store with this token."""
+    return f"{token}-{location[0]}-{location[1]}"
+
+
+class ImageStore:
+    """
+    Segment-file image store.
+
+    :param folder: Where the segments and index live.
+    :param segment_bytes: Start a new segment past this size.
+    :param max_bytes: Delete the oldest segments beyond this total (bounds disk use).
+    :param thumb_width: Width of the generated thumbnails in pixels.
+    """
+    def __init__(self, folder=IMAGE_FOLDER, segment_bytes=16 * 1024 * 1024, max_bytes=512 * 1024 * 1024,
+                 thumb_width=THUMB_WIDTH):
+        self.folder = folder
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.thumb_width = thumb_width
+        self.lock = threading.Lock()
+        self.images = {}          # id -> StoredImage (dicts keep insertion order: oldest first)
+        self.segment_sizes = {}   # segment number -> bytes
+        self.maps = {}            # segment number -> read-only mmap (remapped as the active segment grows)
+        self.next_id = 1
+        self.active = None        # (segment number, fd)
+        self.index_file = None
+        self.thumb_queue = queue.Queue()
+        self.thumb_thread = None
+        self.loaded = False
+        self.token = None         # Contents of store_id
+
+    # --- Startup ---
+    def open(self):
+        """Loads the index (recovering records written after its last line) and starts the thumbnail thread."""
+        with self.lock:
+            if self.loaded:
+                return self
+            os.makedirs(self.folder, exist_ok=True)
+            self.token = self._load_token()
+            for path in sorted(glob.glob(os.path.join(self.folder, 'seg_*.dat'))):
+                self.segment_sizes[int(os.path.basename(path)[4:10])] = os.path.getsize(path)
+            self._load_index()
+            self._recover_tail()
+            self.index_file = open(os.path.join(self.folder, 'index.jsonl'), 'a', buffering=1) # Line buffered
+            self._open_segment(max(self.segment_sizes) if self.segment_sizes else 1)
+            self.loaded = True
+            IMAGE_STORE_BYTES.set(sum(self.segment_sizes.values()))
+        self.thumb_thread = threading.Thread(target=self._thumbnail_loop, name="image-thumbs", daemon=True)
+        self.thumb_thread.start()
+        for image in self.images.values():
+            if image.thumb is None:
+                self.thumb_queue.put(image.id) # Thumbnails lost in a crash, or images imported before one was made
+        print(f"[ImageStore] {len(self.images)} images in {len(self.segment_sizes)} segment(s), "
+              f"{sum(self.segment_sizes.values()) / 1e6:.1f} MB")
+        return self
+
+    def _load_token(self):
+        path = os.path.join(self.folder, 'store_id')
+        if os.path.exists(path):
+            with open(path) as f:
+                token = f.read().strip()
+            if token:
+                return token
+        token = binascii.hexlify(os.urandom(4)).decode('ascii')
+        with open(path, 'w') as f:
+            f.write(token + '\n')
+        return token
+
+    def _load_index(self):
+        path = os.path.join(self.folder, 'index.jsonl')
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Torn last line after a power cut; the tail scan recovers it
+                self._apply(entry)
+
+    def _apply(self, entry):
+        if 'thumb' in entry:
+            image = self.images.get(entry['id'])
+            if image is not None and entry['thumb'][0] in self.segment_sizes:
+                image.thumb = tuple(entry['thumb'])
+                image.width, image.height = entry.get('w'), entry.get('h')
+        elif entry['seg'] in self.segment_sizes:
+            self.images[entry['id']] = StoredImage(entry['id'], entry['kind'], entry['label'], entry['t'],
+                                                   (entry['seg'], entry['off'], entry['len']))
+            self.next_id = max(self.next_id, entry['id'] + 1)
+
+    def _recover_tail(self):
+        """Re-indexes records appended to the last segment after the last index line made it to disk."""
+        if not self.segment_sizes:
+            return
+        segment = max(self.segment_sizes)
+        indexed_end = 0
+        for image in self.images.values():
+            for location in (image.location, image.thumb):
+                if location and location[0] == segment:
+                    indexed_end = max(indexed_end, location[1] + location[2])
+        recovered = []
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            offset = indexed_end # Records are contiguous: the next header starts where the last indexed payload ends
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                magic, kind, _, label_length, image_id, length, timestamp = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                payload_offset = offset + RECORD_HEADER.size + label_length
+                if magic != RECORD_MAGIC or payload_offset + length > size:
+                    break # Torn record
+                label = f.read(label_length).decode('utf-8', 'replace')
+                if kind == IMAGE:
+                    kind_name, _, label = label.partition('|')
+                    recovered.append({'id': image_id, 'kind': kind_name, 'label': label, 't': timestamp,
+                                      'seg': segment, 'off': payload_offset, 'len': length})
+                else:
+                    recovered.append({'id': image_id, 'thumb': [segment, payload_offset, length]})
+                offset = payload_offset + length
+        if offset < size:
+            os.truncate(self._segment_path(segment), offset) # Drop the torn tail so appends stay aligned
+            self.segment_sizes[segment] = offset
+        with open(os.path.join(self.folder, 'index.jsonl'), 'a') as f:
+            for entry in recovered:
+                self._apply(entry)
+                f.write(json.dumps(entry) + '\n')
+        if recovered:
+            print(f"[ImageStore] Recovered {len(recovered)} record(s) missing from the index.")
+
+    # --- Writing ---
+    def _segment_path(self, segment):
+        return os.path.join(self.folder, f'seg_{segment:06d}.dat')
+
+    def _open_segment(self, segment):
+        if self.active:
+            os.close(self.active[1])
+        fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.active = (segment, fd)
+        self.segment_sizes.setdefault(segment, 0)
+
+    def _append(self, kind, image_id, label, payload, timestamp):
+        """Writes one record to the active segment; returns (segment, payload offset, length). Lock held."""
+        segment, fd = self.active
+        if self.segment_sizes[segment] >= self.segment_bytes:
+            segment += 1
+            self._open_segment(segment)
+            self._enforce_limit()
+            segment, fd = self.active
+        label_bytes = label.encode('utf-8')
+        header = RECORD_HEADER.pack(RECORD_MAGIC, kind, 0, len(label_bytes), image_id, len(payload), timestamp)
+        os.write(fd, header + label_bytes + payload) # One write: readers never see half a record in the index
+        offset = self.segment_sizes[segment] + RECORD_HEADER.size + len(label_bytes)
+        self.segment_sizes[segment] += len(header) + len(label_bytes) + len(payload)
+        IMAGE_STORE_BYTES.set(sum(self.segment_sizes.values()))
+        return segment, offset, len(payload)
+
+    def reserve_id(self):
+        """Hands out an image id now for an add() made later, so /take_photo can answer before the photo is written."""
+        if not self.loaded:
+            self.open()
+        with self.lock:
+            image_id = self.next_id
+            self.next_id += 1
+            return image_id
+
+    def add(self, jpeg_bytes, kind='photo', label='', timestamp=None, image_id=None):
+        """Stores a JPEG and queues its thumbnail. Returns the image id (the reserved one if image_id is given)."""
+        if not self.loaded:
+            self.open()
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if image_id is None:
+                image_id = self.next_id
+                self.next_id += 1
+            location = self._append(IMAGE, image_id, f"{kind}|{label}", bytes(jpeg_bytes), timestamp)
+            self.images[image_id] = StoredImage(image_id, kind, label, timestamp, location)
+            self.index_file.write(json.dumps({'id': image_id, 'kind': kind, 'label': label, 't': timestamp,
+                                              'seg': location[0], 'off': location[1], 'len': location[2]}) + '\n')
+        IMAGES_STORED.inc()
+        self.thumb_queue.put(image_id)
+        return image_id
+
+    def _enforce_limit(self):
+        """Deletes the oldest segments while over max_bytes (never the active one). Lock held."""
+        removed = False
+        while sum(self.segment_sizes.values()) > self.max_bytes and len(self.segment_sizes) > 1:
+            oldest = min(self.segment_sizes)
+            del self.segment_sizes[oldest]
+            old_map = self.maps.pop(oldest, None)
+            if old_map is not None:
+                old_map.close()
+            try:
+                os.remove(self._segment_path(oldest))
+            except OSError:
+                pass
+            for image_id in [i for i, image in self.images.items() if image.location[0] == oldest]:
+                del self.images[image_id]
+            for image in self.images.values():
+                if image.thumb and image.thumb[0] == oldest:
+                    image.thumb = None
+            removed = True
+            print(f"[ImageStore] Disk limit reached: removed segment {oldest}.")
+        if removed:
+            self._rewrite_index()
+
+    def _rewrite_index(self):
+        path = os.path.join(self.folder, 'index.jsonl')
+        with open(path + '.tmp', 'w') as f:
+            for image in self.images.values():
+                segment, offset, length = image.location
+                f.write(json.dumps({'id': image.id, 'kind': image.kind, 'label': image.label, 't': image.time,
+                                    'seg': segment, 'off': offset, 'len': length}) + '\n')
+                if image.thumb:
+                    f.write(json.dumps({'id': image.id, 'thumb': list(image.thumb), 'w': image.width, 'h': image.height}) + '\n')
+        self.index_file.close()
+        os.replace(path + '.tmp', path)
+        self.index_file = open(path, 'a', buffering=1)
+
+    # --- Thumbnails ---
+    def _thumbnail_loop(self):
+        while True:
+            image_id = self.thumb_queue.get()
+            try:
+                self._make_thumbnail(image_id)
+            except Exception as e:
+                print(f"[ImageStore] Thumbnail for image {image_id} failed: {e}")
+            finally:
+                self.thumb_queue.task_done()
+
+    def _make_thumbnail(self, image_id):
+        jpeg = self.read(image_id)
+        if jpeg is None:
+            return
+        started = time.perf_counter()
+        full = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if full is None:
+            return
+        height, width = full.shape[:2]
+        thumb_height = max(1, round(height * self.thumb_width / width))
+        thumb = cv2.resize(full, (self.thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+        THUMBNAIL_SECONDS.observe_since(started)
+        with self.lock:
+            image = self.images.get(image_id)
+            if image is None:
+                return # Deleted meanwhile
+            location = self._append(THUMBNAIL, image_id, '', buffer.tobytes(), time.time())
+            image.thumb, image.width, image.height = location, width, height
+            self.index_file.write(json.dumps({'id': image_id, 'thumb': list(location), 'w': width, 'h': height}) + '\n')
+
+    # --- Reading ---
+    def _slice(self, location):
+        """Bytes at (segment, offset, length) through the segment's mmap. Lock held."""
+        segment, offset, length = location
+        mapped = self.maps.get(segment)
+        if mapped is None or offset + length > len(mapped):
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = mapped
+        return mapped[offset:offset + length]
+
+    def read(self, image_id, thumbnail=False):
+        """JPEG bytes of an image (or its thumbnail), or None. Falls back to the full image until the thumbnail exists."""
+        with self.lock:
+            image = self.images.get(image_id)
+            if image is None:
+                return None
+            location = image.thumb if thumbnail and image.thumb else image.location
+            return self._slice(location)
+
+    def read_versioned(self, image_id, thumbnail=False):
+        """(JPEG bytes, version) like read(); version is the ETag of exactly those bytes. (None, None) if unknown."""
+        with self.lock:
+            image = self.images.get(image_id)
+            if image is None:
+                return None, None
+            location = image.thumb if thumbnail and image.thumb else image.location
+            return self._slice(location), version(self.token, location)
+
+    def list_images(self, kind=None, before=None, limit=100):
+        """Newest first; pass the last id of a page as before= to get the next one."""
+        with self.lock:
+            images = list(self.images.values())
+        result = []
+        for image in reversed(images):
+            if before is not None and image.id >= before:
+                continue
+            if kind and image.kind != kind:
+                continue
+            result.append(image.to_dict(self.token))
+            if len(result) >= limit:
+                break
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {'images': len(self.images), 'segments': len(self.segment_sizes),
+                    'bytes': sum(self.segment_sizes.values()), 'max_bytes': self.max_bytes,
+                    'thumbnails_pending': self.thumb_queue.qsize()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the rover image store.")
+    sub = parser.add_subparsers(dest='action', required=True)
+    importer = sub.add_parser('import', help="Copy loose JPEG files into the store")
+    importer.add_argument('paths', nargs='+', help="Files or folders")
+    sub.add_parser('info', help="Summarize the store")
+    args = parser.parse_args()
+
+    store = ImageStore().open()
+    if args.action == 'info':
+        print(json.dumps(store.stats(), indent=2))
+        return
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.jpg'))) if os.path.isdir(path) else [path])
+    for path in files:
+        name = os.path.basename(path)
+        kind = 'qr' if name.startswith('qr_') else 'photo'
+        with open(path, 'rb') as f:
+            image_id = store.add(f.read(), kind=kind, label=name, timestamp=os.path.getmtime(path))
+        print(f"{path} -> /images/{image_id}")
+    store.thumb_queue.join() # Wait for the thumbnails
+
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,175 @@
-# imu.py - Raspberry Pi IMU Sensor Script
-# This script initializes and reads data from the BNO08x IMU sensor over UART.
+# imu.py - BNO08x IMU reader service
+# Reads the BNO08x on the Pi's UART directly, instead of getting yaw second-hand (and late) through the
+# Arduino's CSV line. A daemon thread enables the rotation vector and gyroscope reports at a configurable
+# rate, timestamps each sample and hands it to a callback; app.py feeds it into SkidSteerOdometry so the
+# heading used for turns updates at the IMU's rate. Opt-in with ROVER_IMU=1 (ROVER_IMU_RATE_HZ, default 100).
+#
+# Run directly to print yaw/pitch/roll:  python imu.py [rate_hz]
 
-import board        # From adafruit-blinka
-import busio        # From adafruit-blinka (for I2C, not directly used here but common)
-import RPi.GPIO as GPIO # For controlling reset/interrupt pins if not using board.DXX
+import math
+import os
+import threading
+import time
 
-import adafruit_bno08x
-from adafruit_bno08x.uart import BNO08X_UART
+import metrics
 
-import serial       # For pyserial
-import time
+IMU_ENV = "ROVER_IMU"
+IMU_RATE_ENV = "ROVER_IMU_RATE_HZ"
+IMU_PORT = "/dev/serial0" # The Pi's UART (raspi-config: serial port on, login shell off)
+IMU_BAUD = 115200
+BNO_RESET_PIN = "D17" # board.D17 = GPIO17, Physical Pin 11
+BNO_INT_PIN = "D27"   # board.D27 = GPIO27, Physical Pin 13
+IMU_FRESH_SECONDS = 0.2 # Older samples are not used instead of the Arduino's yaw
+
+IMU_SAMPLES = metrics.counter('rover_imu_samples_total', 'Samples read from the BNO08x')
+IMU_READ_ERRORS = metrics.counter('rover_imu_read_errors_total', 'Failed BNO08x reads')
+IMU_READ_SECONDS = metrics.histogram('rover_imu_read_seconds', 'Time to read one rotation vector + gyro sample')
+
+
+def imu_enabled():
+    return os.environ.get(IMU_ENV) == '1'
+
+
+def quaternion_to_euler(i, j, k, real):
+    """Rotation vector quaternion -> (yaw, pitch, roll) in degrees."""
+    yaw = math.atan2(2.0 * (real * k + i * j), 1.0 - 2.0 * (j * j + k * k))
+    pitch = math.asin(max(-1.0, min(1.0, 2.0 * (real * j - k * i))))
+    roll = math.atan2(2.0 * (real * i + j * k), 1.0 - 2.0 * (i * i + j * j))
+    return math.degrees(yaw), math.degrees(pitch), math.degrees(roll)
+
+
+def open_bno08x(rate_hz, port=IMU_PORT):
+    """Opens the BNO08x over UART and enables the rotation vector and gyro reports at rate_hz."""
+    import board # Imported here: only needed (and installed) on the Pi
+    import serial
+    import adafruit_bno08x
+    from adafruit_bno08x.uart import BNO08X_UART
+    uart = serial.Serial(port, IMU_BAUD)
+    bno = BNO08X_UART(uart, getattr(board, BNO_RESET_PIN), getattr(board, BNO_INT_PIN))
+    interval_us = int(1e6 / rate_hz)
+    for feature in (adafruit_bno08x.BNO_REPORT_ROTATION_VECTOR, adafruit_bno08x.BNO_REPORT_GYROSCOPE):
+        try:
+            bno.enable_feature(feature, report_interval=interval_us)
+        except TypeError: # Older adafruit_bno08x: fixed 20 Hz report interval
+            bno.enable_feature(feature)
+    return bno
+
+
+class ImuSample:
+    __slots__ = ('timestamp', 'yaw', 'pitch', 'roll', 'yaw_rate')
+
+    def __init__(self, timestamp, yaw, pitch, roll, yaw_rate):
+        self.timestamp = timestamp
+        self.yaw = yaw           # degrees
+        self.pitch = pitch
+        self.roll = roll
+        self.yaw_rate = yaw_rate # degrees/s, from the gyro
+
+    def to_dict(self):
+        return {'t': self.timestamp, 'yaw': self.yaw, 'pitch': self.pitch, 'roll': self.roll, 'yaw_rate': self.yaw_rate}
+
+
+class ImuReader:
+    """
+    Reads the IMU on its own thread at rate_hz.
+
+    :param sensor: Object with .quaternion (i, j, k, real) and .gyro (x, y, z rad/s) properties: the
+                   adafruit BNO08x (see open_bno08x) or sim_hardware.SimImu.
+    :param rate_hz: Sample rate; the reports are enabled at the same rate.
+    :param on_sample: Optional callable run on the reader thread with each ImuSample.
+    :param clock: Anything with time(); samples are timestamped with it when read.
+    """
+    def __init__(self, sensor, rate_hz=100, on_sample=None, clock=time):
+        self.sensor = sensor
+        self.period = 1.0 / rate_hz
+        self.on_sample = on_sample
+        self.clock = clock
+        self.sample = None
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_env(cls, sensor=None, on_sample=None, clock=time):
+        """Opens the BNO08x (unless a sensor is given) at ROVER_IMU_RATE_HZ."""
+        rate_hz = float(os.environ.get(IMU_RATE_ENV, '100'))
+        return cls(sensor or open_bno08x(rate_hz), rate_hz, on_sample, clock)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="imu-reader", daemon=True)
+        self.thread.start()
+        print(f"[IMU] Reading at {1.0 / self.period:.0f} Hz.")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def latest(self, max_age=IMU_FRESH_SECONDS):
+        """The newest sample, or None if there is none this recent."""
+        sample = self.sample
+        if sample is None or self.clock.time() - sample.timestamp > max_age:
+            return None
+        return sample
+
+    def read(self):
+        """Reads one sample. The driver processes every pending report on each property read."""
+        read_start = time.perf_counter()
+        i, j, k, real = self.sensor.quaternion
+        gyro_z = self.sensor.gyro[2]
+        timestamp = self.clock.time()
+        IMU_READ_SECONDS.observe_since(read_start)
+        yaw, pitch, roll = quaternion_to_euler(i, j, k, real)
+        return ImuSample(timestamp, yaw, pitch, roll, math.degrees(gyro_z))
+
+    def _run(self):
+        next_time = time.monotonic()
+        while self.running:
+            try:
+                sample = self.read()
+            except Exception as e: # UART framing errors happen; skip the sample
+                IMU_READ_ERRORS.inc()
+                print(f"[IMU] Read failed: {e}")
+                time.sleep(0.5)
+                next_time = time.monotonic()
+                continue
+            self.sample = sample
+            IMU_SAMPLES.inc()
+            if self.on_sample:
+                self.on_sample(sample)
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic() # Fell behind: don't try to catch up in a burst
+
+
+def main():
+    import sys
+    rate_hz = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    try:
+        sensor = open_bno08x(rate_hz)
+        print("BNO08x sensor initialized.")
+    except Exception as e:
+        print(f"CRITICAL ERROR: Failed to initialize BNO08x sensor: {e}")
+        print("Please check wiring (VCC, GND, TX, RX, RST, INT), UART config in raspi-config, and permissions.")
+        sys.exit(1)
+
+    def show(sample):
+        print(f"Yaw: {sample.yaw:.2f}, Pitch: {sample.pitch:.2f}, Roll: {sample.roll:.2f}, Yaw rate: {sample.yaw_rate:.1f}°/s")
 
-# --- Configure UART Serial Port ---
-# This matches the /dev/serial0 setup on Raspberry Pi
-uart = serial.Serial("/dev/serial0", 115200)
-
-# --- Configure BNO08x Pins ---
-# Using BCM GPIO numbers for reset/interrupt pins
-# These map to the physical pins connected to BNO08x RST and INT
-BNO_RESET_PIN = board.D17 # GPIO17, Physical Pin 11
-BNO_INT_PIN = board.D27   # GPIO27, Physical Pin 13
-
-# --- Initialize BNO08x Sensor ---
-# Pass the UART object and the reset/interrupt pins
-try:
-    bno = BNO08X_UART(uart, BNO_RESET_PIN, BNO_INT_PIN)
-    print("BNO08x sensor initialized.")
-except Exception as e:
-    print(f"CRITICAL ERROR: Failed to initialize BNO08x sensor: {e}")
-    print("Please check wiring (VCC, GND, TX, RX, RST, INT), UART config in raspi-config, and permissions.")
-    exit() # Exit if sensor fails to initialize
-
-# --- Enable Sensor Reports (Choose the reports you need) ---
-# For orientation, enable Rotation Vector
-bno.enable_feature(adafruit_bno08x.BNO_REPORT_ROTATION_VECTOR)
-# You can enable other features as needed:
-# bno.enable_feature(adafruit_bno08x.BNO_REPORT_GEOMAGNETIC_ROTATION_VECTOR)
-# bno.enable_feature(adafruit_bno08x.BNO_REPORT_ACCELEROMETER)
-# bno.enable_feature(adafruit_bno08x.BNO_REPORT_GYROSCOPE)
-# bno.enable_feature(adafruit_bno08x.BNO_REPORT_LINEAR_ACCELERATION)
-# bno.enable_feature(adafruit_bno08x.BNO_REPORT_GRAVITY)
-
-# --- Main Loop to Read Data ---
-print("Reading BNO08x data (Ctrl+C to quit)...")
-try:
-    while True:
-        if bno.data_ready: # Check if new data is available
-            event = bno.read() # Read the event data
-            
-            # Check if the event contains orientation data
-            if event and event.orientation:
-                print("Yaw: {:.2f}, Pitch: {:.2f}, Roll: {:.2f}".format(
-                    event.orientation.yaw,
-                    event.orientation.pitch,
-                    event.orientation.roll
-                ))
-            # You can add checks for other data types if you enable them
-            # elif event and event.acceleration:
-            #     print(f"Accel X:{event.acceleration.x:.2f}, Y:{event.acceleration.y:.2f}, Z:{event.acceleration.z:.2f}")
-
-        time.sleep(0.01) # Small delay to prevent busy-looping
-
-except KeyboardInterrupt:
-    print("\nScript interrupted by user.")
-except Exception as e:
-    print(f"An unexpected error occurred: {e}")
-finally:
-    # --- Cleanup ---
-    print("Cleaning up serial connection.")
-    uart.close() # Close the serial port
-    print("Cleanup complete.")
+    reader = ImuReader(sensor, rate_hz, on_sample=show)
+    print("Reading BNO08x data (Ctrl+C to quit)...")
+    reader.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nScript interrupted by user.")
+    finally:
+        reader.stop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
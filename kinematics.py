@@ -3,6 +3,12 @@
 import serial
 import math
 import time # Used for dt calculation within the class
+import threading
+
+import metrics
+
+ODOMETRY_DT_SECONDS = metrics.histogram('rover_odometry_update_dt_seconds', 'Time between consecutive odometry updates',
+                                        buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0))
 
 # --- Kinematics Configuration ---
 WHEEL_DIAMETER_MM = 134 # Your wheel diameter in mm
@@ -14,13 +20,17 @@ track_width_m = TRACK_WIDTH_MM / 1000.0 # Convert to meters
 
 
 class SkidSteerOdometry:
-    def __init__(self, track_width_m, alpha=0.5):
+    def __init__(self, track_width_m, alpha=0.5, clock=time):
         self.x = 0.0      # meters
         self.y = 0.0      # meters
         self.theta = 0.0  # radians
         self.track_width = track_width_m
         self.alpha = alpha # Fusion factor for IMU and odometry (1 = only odometry, 0 = only IMU)
-        self.last_update_time = time.time() # To calculate dt
+        self.clock = clock # NEW: Anything with time(); replay.py passes its recorded-time clock
+        self.last_update_time = self.clock.time() # To calculate dt
+        self.rpm_l = 0.0 # NEW: Last wheel RPMs, held between encoder lines for update_heading()
+        self.rpm_r = 0.0
+        self.lock = threading.Lock() # NEW: The encoder thread and the IMU thread (imu.py) both update the pose
 
     def normalize_angle_deg(self, angle_deg):
         """Normalizes an angle to be within -180 to 180 degrees."""
@@ -30,14 +40,32 @@ class SkidSteerOdometry:
             angle_deg += 360
         return angle_deg
 
-    def update(self, rpm_l, rpm_r, imu_yaw_deg):
+    def update(self, rpm_l, rpm_r, imu_yaw_deg, timestamp=None):
         """Updates the robot's pose based on left and right wheel RPMs.
            rpm_l: RPM of the left wheel.
            rpm_r: RPM of the right wheel.
+           timestamp: NEW: When the reading was taken (clock time); default now. dt is measured between these,
+                      so time a reading spent queued before reaching us doesn't count.
+        """
+        with self.lock:
+            self.rpm_l, self.rpm_r = rpm_l, rpm_r
+            self._integrate(imu_yaw_deg, timestamp)
+
+    def update_heading(self, imu_yaw_deg, timestamp=None):
+        """NEW: A high-rate IMU heading (imu.py) between encoder lines. Advances the pose with the last wheel RPMs,
+           so turns see the IMU's rate and latency instead of the Arduino line's.
         """
-        current_time = time.time()
+        with self.lock:
+            self._integrate(imu_yaw_deg, timestamp)
+
+    def _integrate(self, imu_yaw_deg, timestamp=None):
+        rpm_l, rpm_r = self.rpm_l, self.rpm_r
+        current_time = self.clock.time() if timestamp is None else timestamp
+        if current_time < self.last_update_time:
+            return # Taken before the last update (an IMU heading got in first); that interval is already integrated
         dt = current_time - self.last_update_time
         self.last_update_time = current_time
+        ODOMETRY_DT_SECONDS.observe(dt)
 
         if dt == 0: # Avoid division by zero if time hasn't advanced
             return
@@ -63,4 +91,9 @@ class SkidSteerOdometry:
 
     def get_pose(self):
         """Returns the current pose (x, y, theta) in meters and degrees."""
-        return (self.x, self.y, self.normalize_angle_deg(math.degrees(self.theta)))
\ No newline at end of file
+        return (self.x, self.y, self.normalize_angle_deg(math.degrees(self.theta)))
+
+    def get_timed_pose(self):
+        """NEW: (x, y, theta, time of the last reading integrated into it), read together."""
+        with self.lock:
+            return self.get_pose() + (self.last_update_time,)
\ No newline at end of file
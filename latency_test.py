@@ -0,0 +1,213 @@
+# latency_test.py - Glass-to-glass camera latency measurement
+# Shows the current time (ms) as a row of three ArUco markers in a window, redrawn every screen frame.
+# Point the rover's camera at the window; the tool reads the rover's /mjpeg stream back, decodes the
+# time shown in each frame and reports receive time minus displayed time: everything from the screen,
+# through the camera, its driver buffers, the capture thread, QR detection, JPEG encoding and the
+# network, to this machine. Run it on the machine with the screen, so both times come from the same clock.
+# ArUco rather than a QR code: the rover's own QR overlay would be drawn over a QR pattern and break
+# its decoding, and ArUco detection is a few milliseconds.
+#
+# With --spawn-sim the app runs on simulated hardware and its SimCamera stamps the pattern into each
+# frame itself (ROVER_SIM_CLOCK_PATTERN=1): no window, no camera; that measures the rover-side pipeline.
+#
+# Usage: python latency_test.py --url http://rover.local:5000 --duration 20
+#        python latency_test.py --spawn-sim [--fresh-capture]
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+from loadtest import DEFAULT_URL, _percentiles, spawn_sim_server
+
+PATTERN_DICT = cv2.aruco.DICT_4X4_1000
+PATTERN_DIGITS = 3     # Markers; marker k shows ms digits 2k..2k+1 (base 100) as id k * 100 + value
+PATTERN_MODULO = 100 ** PATTERN_DIGITS # The pattern shows time.time() in ms modulo this (about 16 minutes)
+MAX_LATENCY = 10.0     # Seconds; a larger result comes from a torn frame (markers from two screen refreshes)
+MARKER_PX = 240        # Marker side on screen; larger decodes more reliably from across the room
+SIM_MARKER_PX = 80     # Marker side in the pattern SimCamera stamps into its frames
+DECODE_QUEUE = 8       # Received frames waiting for the decoder; older ones are dropped when it falls behind
+
+
+_dictionary = cv2.aruco.getPredefinedDictionary(PATTERN_DICT)
+
+
+def render_pattern(timestamp, marker_px=MARKER_PX):
+    """BGR image of the markers for timestamp (seconds), on white with a quarter-marker gap around each."""
+    value = int(timestamp * 1000) % PATTERN_MODULO
+    gap = marker_px // 4
+    image = np.full((marker_px + 2 * gap, PATTERN_DIGITS * (marker_px + gap) + gap), 255, dtype=np.uint8)
+    for k in range(PATTERN_DIGITS):
+        digit = value // 100 ** (PATTERN_DIGITS - 1 - k) % 100
+        x = gap + k * (marker_px + gap)
+        image[gap:gap + marker_px, x:x + marker_px] = cv2.aruco.generateImageMarker(_dictionary, k * 100 + digit, marker_px)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def draw_pattern(frame, timestamp, origin=(10, 10), marker_px=SIM_MARKER_PX):
+    """Stamps the pattern for timestamp into frame in place (top-left corner by default)."""
+    x, y = origin
+    pattern = render_pattern(timestamp, marker_px)[:frame.shape[0] - y, :frame.shape[1] - x]
+    frame[y:y + pattern.shape[0], x:x + pattern.shape[1]] = pattern
+    return frame
+
+
+def make_detector():
+    return cv2.aruco.ArucoDetector(_dictionary, cv2.aruco.DetectorParameters())
+
+
+def decode_pattern(img, detector):
+    """The time shown in img, in ms modulo PATTERN_MODULO, or None unless exactly one marker per digit was found."""
+    _, ids, _ = detector.detectMarkers(img)
+    if ids is None:
+        return None
+    digits = {}
+    for marker_id in ids.ravel().tolist():
+        k, digit = divmod(marker_id, 100)
+        if k >= PATTERN_DIGITS or digits.setdefault(k, digit) != digit:
+            return None
+    if len(digits) != PATTERN_DIGITS:
+        return None
+    return sum(digit * 100 ** (PATTERN_DIGITS - 1 - k) for k, digit in digits.items())
+
+
+def pattern_latency(received, shown_ms):
+    """Seconds from the pattern showing shown_ms to receipt at received (time.time()), or None if implausible."""
+    latency = ((int(received * 1000) - shown_ms) % PATTERN_MODULO) / 1000.0
+    return latency if latency <= MAX_LATENCY else None
+
+
+def stream_reader(base_url, stop_event, frames, stats):
+    """Splits /mjpeg into JPEGs, timestamping each one as its last byte arrives."""
+    try:
+        with requests.get(base_url + '/mjpeg', stream=True, timeout=10) as response:
+            data = b''
+            for chunk in response.iter_content(chunk_size=16384):
+                data += chunk
+                while True:
+                    start = data.find(b'\xff\xd8')
+                    end = data.find(b'\xff\xd9', start + 2) if start >= 0 else -1
+                    if end < 0:
+                        break
+                    received = time.time()
+                    jpeg, data = data[start:end + 2], data[end + 2:]
+                    stats['received'] += 1
+                    try:
+                        frames.put_nowait((received, jpeg))
+                    except queue.Full: # Latency comes from the receive time, so dropping some frames doesn't bias it
+                        stats['dropped'] += 1
+                if stop_event.is_set():
+                    break
+    except requests.RequestException as e:
+        stats['error'] = str(e)
+    finally:
+        frames.put(None)
+
+
+def decoder(frames, latencies, stats):
+    detector = make_detector()
+    while True:
+        item = frames.get()
+        if item is None:
+            return
+        received, jpeg = item
+        img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        shown = decode_pattern(img, detector) if img is not None else None
+        latency = pattern_latency(received, shown) if shown is not None else None
+        if latency is None:
+            stats['not_decoded'] += 1
+        else:
+            latencies.append(latency)
+
+
+def show_pattern(stop_event, fullscreen=False):
+    """Redraws the pattern in a window until stop_event is set or the window is closed with q / Esc. Main thread."""
+    window = "latency_test - point the rover camera here"
+    try:
+        cv2.namedWindow(window, cv2.WINDOW_NORMAL)
+    except cv2.error as e:
+        raise SystemExit(f"[LatencyTest] Cannot open a window ({e}). Install opencv-python (not -headless), "
+                         "or use --spawn-sim.")
+    if fullscreen:
+        cv2.setWindowProperty(window, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+    while not stop_event.is_set():
+        cv2.imshow(window, render_pattern(time.time()))
+        if cv2.waitKey(1) & 0xFF in (ord('q'), 27):
+            stop_event.set()
+    cv2.destroyWindow(window)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure camera-to-viewer latency through the rover's /mjpeg stream.")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds to measure")
+    parser.add_argument('--fullscreen', action='store_true', help="Show the pattern full screen")
+    parser.add_argument('--spawn-sim', action='store_true',
+                        help="Start the app with ROVER_SIM=1; the simulated camera draws the pattern (no window)")
+    parser.add_argument('--fresh-capture', action='store_true', help="With --spawn-sim: also set ROVER_FRESH_CAPTURE=1")
+    parser.add_argument('--output', default='', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    server = None
+    if args.spawn_sim:
+        os.environ['ROVER_SIM_CLOCK_PATTERN'] = '1' # Inherited by the spawned app
+        if args.fresh_capture:
+            os.environ['ROVER_FRESH_CAPTURE'] = '1'
+        server = spawn_sim_server(base_url)
+    try:
+        stop_event = threading.Event()
+        frames = queue.Queue(maxsize=DECODE_QUEUE)
+        latencies = []
+        stats = {'received': 0, 'dropped': 0, 'not_decoded': 0}
+        threads = [threading.Thread(target=stream_reader, args=(base_url, stop_event, frames, stats), daemon=True),
+                   threading.Thread(target=decoder, args=(frames, latencies, stats), daemon=True)]
+        for thread in threads:
+            thread.start()
+        threading.Timer(args.duration, stop_event.set).start()
+        started = time.perf_counter()
+        if args.spawn_sim:
+            stop_event.wait()
+        else:
+            show_pattern(stop_event, args.fullscreen)
+        elapsed = time.perf_counter() - started
+        for thread in threads:
+            thread.join(timeout=10)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    latency = _percentiles(latencies, errors=None, count_label='frames')
+    if latencies:
+        latency['min_ms'] = round(min(latencies) * 1000, 2)
+        latency['mean_ms'] = round(float(np.mean(latencies)) * 1000, 2)
+    report = {
+        'source': 'sim camera' if args.spawn_sim else base_url,
+        'duration': round(elapsed, 1),
+        'frames_received': stats['received'],
+        'stream_fps': round(stats['received'] / elapsed, 2) if elapsed > 0 else 0.0,
+        'frames_decoded': len(latencies),
+        'frames_not_decoded': stats['not_decoded'],
+        'frames_skipped': stats['dropped'], # Decoder busy
+        'latency': latency,
+    }
+    if 'error' in stats:
+        report['error'] = stats['error']
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"[LatencyTest] Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# loadtest.py - HTTP load generator for the Flask control API
+# Runs scripted scenarios against a running app (or starts one on the simulated hardware backend):
+#   - N pollers hitting /get_encoder_data and /get_pose at a fixed rate (the dashboard does 5 Hz)
+#   - M MJPEG viewers on /mjpeg
+#   - bursts of drive commands on /send_command
+# Reports request latency percentiles, stream FPS per viewer and command-to-motor latency
+# (from the server's /metrics histogram) as JSON.
+#
+# Usage: python loadtest.py --spawn-sim --pollers 4 --viewers 2 --duration 30
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+DEFAULT_URL = "http://127.0.0.1:5000"
+DRIVE_BURST = ('forward', 'left', 'right', 'backward', 'stop')
+MJPEG_BOUNDARY = b'--frame\r\n'
+
+
+class LatencyLog:
+    """Thread-safe collection of (endpoint -> latencies) and error counts."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, endpoint, seconds, ok=True):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(endpoint, []).append(seconds)
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            endpoints = set(self.latencies) | set(self.errors)
+            return {endpoint: _percentiles(self.latencies.get(endpoint, []), self.errors.get(endpoint, 0))
+                    for endpoint in sorted(endpoints)}
+
+
+def _percentiles(latencies, errors=0, count_label='requests'):
+    """Count and latency percentiles (ms). errors=None leaves out the error count (tools without failed requests)."""
+    result = {count_label: len(latencies)}
+    if errors is not None:
+        result['errors'] = errors
+    if latencies:
+        values = np.asarray(latencies) * 1000.0
+        for p in (50, 90, 99):
+            result[f'p{p}_ms'] = round(float(np.percentile(values, p)), 2)
+        result['max_ms'] = round(float(values.max()), 2)
+    return result
+
+
+def timed_request(session, log, method, url, endpoint, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=5, **kwargs)
+        log.add(endpoint, time.perf_counter() - start, ok=response.ok)
+    except requests.RequestException:
+        log.add(endpoint, time.perf_counter() - start, ok=False)
+
+
+# --- Scenario Workers ---
+def poller(base_url, rate_hz, stop_event, log):
+    session = requests.Session()
+    period = 1.0 / rate_hz
+    next_time = time.perf_counter()
+    while not stop_event.is_set():
+        timed_request(session, log, 'GET', base_url + '/get_encoder_data', '/get_encoder_data')
+        timed_request(session, log, 'GET', base_url + '/get_pose', '/get_pose')
+        next_time += period
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+
+
+def mjpeg_viewer(base_url, stop_event, results, index):
+    frames = 0
+    started = time.perf_counter()
+    first_frame = None
+    try:
+        with requests.get(base_url + '/mjpeg', stream=True, timeout=10) as response:
+            tail = b''
+            for chunk in response.iter_content(chunk_size=16384):
+                data = tail + chunk
+                count = data.count(MJPEG_BOUNDARY)
+                if count and first_frame is None:
+                    first_frame = time.perf_counter()
+                frames += count
+                tail = data[-(len(MJPEG_BOUNDARY) - 1):] # Boundary split across two chunks
+                if stop_event.is_set():
+                    break
+    except requests.RequestException as e:
+        results[index] = {'error': str(e), 'frames': frames}
+        return
+    elapsed = time.perf_counter() - started
+    results[index] = {
+        'frames': frames,
+        'fps': round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        'time_to_first_frame_ms': round((first_frame - started) * 1000, 1) if first_frame else None,
+    }
+
+
+def command_bursts(base_url, burst_size, interval, stop_event, log):
+    session = requests.Session()
+    while not stop_event.is_set():
+        for i in range(burst_size):
+            command = DRIVE_BURST[i % len(DRIVE_BURST)]
+            timed_request(session, log, 'POST', base_url + '/send_command', '/send_command', json={'command': command})
+        timed_request(session, log, 'POST', base_url + '/send_command', '/send_command', json={'command': 'stop'})
+        stop_event.wait(interval)
+
+
+# --- Server-side Metrics ---
+def scrape_histogram(base_url, name):
+    """Returns {le: cumulative count} for an unlabelled histogram on /metrics (empty if unavailable)."""
+    try:
+        text = requests.get(base_url + '/metrics', timeout=5).text
+    except requests.RequestException:
+        return {}
+    buckets = {}
+    prefix = name + '_bucket{le="'
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            le, value = line[len(prefix):].split('"} ')
+            buckets[float('inf') if le == '+Inf' else float(le)] = float(value)
+    return buckets
+
+
+def histogram_quantiles(before, after, quantiles=(0.5, 0.9, 0.99)):
+    """Estimates quantiles (bucket upper bounds) from the difference of two scrapes."""
+    bounds = sorted(after)
+    counts = [after[b] - before.get(b, 0.0) for b in bounds]
+    total = counts[-1] if counts else 0
+    result = {'count': int(total)}
+    for q in quantiles:
+        if total == 0:
+            break
+        bound = next(b for b, c in zip(bounds, counts) if c >= q * total)
+        result[f'p{int(q * 100)}_ms_upper'] = None if bound == float('inf') else round(bound * 1000, 3)
+    return result
+
+
+# --- Server Management ---
+def spawn_sim_server(base_url, server_mode='flask', timeout=30):
+    env = dict(os.environ, ROVER_SIM='1')
+    script = 'asgi_server.py' if server_mode == 'asgi' else 'app.py'
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    server = subprocess.Popen([sys.executable, app_path], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + '/health', timeout=1).json().get('status') == 'ok':
+                return server
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Simulated app did not become healthy in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the rover's Flask API.")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--spawn-sim', action='store_true', help="Start the app with ROVER_SIM=1 for the test")
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask', help="Server mode started by --spawn-sim")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds to run the scenario")
+    parser.add_argument('--pollers', type=int, default=4, help="Dashboards polling telemetry")
+    parser.add_argument('--poll-hz', type=float, default=5.0)
+    parser.add_argument('--viewers', type=int, default=2, help="MJPEG viewers")
+    parser.add_argument('--burst-size', type=int, default=10, help="Drive commands per burst")
+    parser.add_argument('--burst-interval', type=float, default=1.0, help="Seconds between bursts (0 disables)")
+    parser.add_argument('--output', default='', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    server = spawn_sim_server(base_url, args.server) if args.spawn_sim else None
+    try:
+        motor_before = scrape_histogram(base_url, 'rover_command_to_motor_seconds')
+        stop_event = threading.Event()
+        log = LatencyLog()
+        viewer_results = {}
+        threads = [threading.Thread(target=poller, args=(base_url, args.poll_hz, stop_event, log), daemon=True)
+                   for _ in range(args.pollers)]
+        threads += [threading.Thread(target=mjpeg_viewer, args=(base_url, stop_event, viewer_results, i), daemon=True)
+                    for i in range(args.viewers)]
+        if args.burst_interval > 0:
+            threads.append(threading.Thread(target=command_bursts, daemon=True,
+                                            args=(base_url, args.burst_size, args.burst_interval, stop_event, log)))
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        motor_after = scrape_histogram(base_url, 'rover_command_to_motor_seconds')
+
+        report = {
+            'scenario': {'server': args.server if args.spawn_sim else args.url, 'duration': args.duration, 'pollers': args.pollers, 'poll_hz': args.poll_hz,
+                         'viewers': args.viewers, 'burst_size': args.burst_size, 'burst_interval': args.burst_interval},
+            'requests': log.summary(),
+            'mjpeg_viewers': [viewer_results.get(i) for i in range(args.viewers)],
+            'command_to_motor': histogram_quantiles(motor_before, motor_after) if motor_after else None,
+        }
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"[LoadTest] Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# metrics.py
+# Counters, gauges and histograms for the hot paths, exposed in Prometheus text format on /metrics.
+# Recording takes no lock and allocates no containers: each metric only updates a few
+# preallocated slots. Single-writer metrics (most of them: one thread per loop) are exact;
+# metrics updated from several threads at once may under-count by a few events, which is
+# acceptable for monitoring and keeps the hot paths free of lock contention.
+
+import threading
+import time
+from bisect import bisect_left
+
+# --- Default Buckets ---
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # seconds
+SIZE_BUCKETS = (8e3, 16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6) # bytes
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1) # Last slot is the +Inf overflow bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, start):
+        """Observes time.perf_counter() - start; returns the current perf_counter for chaining."""
+        now = time.perf_counter()
+        self.observe(now - start)
+        return now
+
+    def samples(self):
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += bucket_count
+            yield self.name + "_bucket", self.labels + (("le", _format_value(float(bound))),), cumulative
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+    def quantile(self, q):
+        """Estimates a quantile from the buckets (upper bound of the bucket containing it)."""
+        total = sum(self.counts)
+        if total == 0:
+            return None
+        target = q * total
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {} # (name, labels) -> metric, in registration order
+        self._lock = threading.Lock() # Only taken when registering, never when recording
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls(name, help_text, labels, **kwargs)
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None):
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=None, buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        by_name = {} # Labelled series of one metric must be listed together under one HELP/TYPE
+        for metric in list(self._metrics.values()):
+            by_name.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {series[0].help}")
+            lines.append(f"# TYPE {name} {series[0].kind}")
+            for metric in series:
+                for sample_name, labels, value in metric.samples():
+                    lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Default registry shared by all modules ---
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
@@ -0,0 +1,286 @@
+# mjpeg_streaming.py - Per-client MJPEG streaming
+# /mjpeg used to send every frame at full size and default JPEG quality to every viewer.
+# Each client now gets its own MjpegClient, which:
+#   - honours query parameters: ?fps=10&width=320 (or &scale=0.5)&quality=60&adaptive=0
+#   - always sends the NEWEST frame, so a slow client skips frames instead of queueing them
+#   - (adaptive, the default) watches send backpressure - how long each send blocks and, when
+#     the socket is reachable, how many bytes are still sitting unsent in the kernel - and steps
+#     down quality -> resolution -> frame rate when the link can't keep up, and back up when it can
+# Re-encodes are shared between clients on the same settings through EncodeCache.
+
+import asyncio
+import fcntl
+import socket
+import termios
+import threading
+import time
+
+import cv2
+
+import metrics
+from stream_buffers import mjpeg_part
+
+# --- Adaptation ladder: (scale, JPEG quality), best first. Level 0 is the capture thread's shared JPEG. ---
+QUALITY_LADDER = [(1.0, None), (1.0, 70), (1.0, 50), (0.75, 50), (0.5, 50), (0.5, 35), (0.25, 35)]
+
+MIN_FPS = 1.0
+MAX_FPS = 30.0
+MIN_WIDTH = 80
+CONGESTED_RATIO = 0.5   # Sends taking > 50% of the frame interval -> step down
+IDLE_RATIO = 0.15       # Sends taking < 15% of the frame interval -> step up (after UPGRADE_HOLD_SECONDS)
+DOWNGRADE_HOLD_SECONDS = 1.0
+UPGRADE_HOLD_SECONDS = 3.0
+SEND_EWMA_ALPHA = 0.3
+SEND_BUFFER_BYTES = 128 * 1024 # Kernel send buffer per client; the default (MBs) would hide a slow link for seconds
+MAX_BACKLOG_FRAMES = 0.5       # Unsent share of the last frame, one interval later, before we skip instead of sending
+
+MJPEG_CLIENTS = metrics.gauge('rover_mjpeg_clients', 'Connected /mjpeg clients')
+MJPEG_FRAMES_SENT = metrics.counter('rover_mjpeg_frames_sent_total', 'Frames sent to /mjpeg clients')
+MJPEG_FRAMES_SKIPPED = metrics.counter('rover_mjpeg_frames_skipped_total', 'Captured frames a /mjpeg client never received (slow link or fps cap)')
+MJPEG_SEND_SECONDS = metrics.histogram('rover_mjpeg_send_seconds', 'Time a /mjpeg frame spent blocked on the client socket')
+MJPEG_BACKLOG_WAITS = metrics.counter('rover_mjpeg_backlog_waits_total', 'Times a /mjpeg client was held back because its socket still had a frame unsent')
+MJPEG_REENCODE_SECONDS = metrics.histogram('rover_mjpeg_reencode_seconds', 'Per-client resize + cv2.imencode time (cache misses only)')
+
+
+def _parse(args, key, cast, low, high):
+    """Reads one query parameter, clamped to [low, high]. Missing or malformed values give None."""
+    try:
+        value = cast(args.get(key))
+    except (TypeError, ValueError):
+        return None
+    return max(low, min(high, value))
+
+
+def parse_stream_options(args):
+    """Turns /mjpeg query parameters (Flask request.args or Starlette query_params) into MjpegClient kwargs."""
+    options = {
+        'max_fps': _parse(args, 'fps', float, MIN_FPS, MAX_FPS),
+        'width': _parse(args, 'width', int, MIN_WIDTH, 4096),
+        'scale': _parse(args, 'scale', float, 0.1, 1.0),
+        'quality': _parse(args, 'quality', int, 10, 95),
+    }
+    adaptive = args.get('adaptive')
+    options['adaptive'] = adaptive is None or adaptive.lower() not in ('0', 'false', 'no', 'off')
+    return options
+
+
+class EncodeCache:
+    """Holds the re-encoded JPEGs of the newest frame, keyed by (width, quality), so clients share them."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None
+        self.entries = {}
+
+    def get(self, seq, width, quality):
+        """The cached JPEG of frame seq at (width, quality), or None."""
+        with self.lock:
+            return self.entries.get((width, quality)) if seq == self.seq else None
+
+    def get_or_encode(self, seq, frame, width, quality):
+        """frame is the BGR image, or a callable returning it (passthrough frames are only decoded on a miss)."""
+        key = (width, quality)
+        with self.lock:
+            if seq == self.seq and key in self.entries:
+                return self.entries[key]
+        if callable(frame):
+            frame = frame()
+        start = time.perf_counter()
+        h, w = frame.shape[:2]
+        if width < w:
+            frame = cv2.resize(frame, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+        _, buffer = cv2.imencode('.jpg', frame, params)
+        jpeg = buffer.tobytes()
+        MJPEG_REENCODE_SECONDS.observe_since(start)
+        with self.lock:
+            if self.seq is None or seq > self.seq: # Only ever cache the newest frame
+                self.seq, self.entries = seq, {}
+            if seq == self.seq:
+                self.entries[key] = jpeg
+        return jpeg
+
+
+encode_cache = EncodeCache()
+
+
+class MjpegClient:
+    """
+    Frame pacing, encoding settings and backpressure tracking for one /mjpeg viewer.
+    Used by both the threaded (Flask) and the async (ASGI) generators below.
+
+    :param max_fps: Frame rate cap requested by the client (None = camera rate).
+    :param width: Requested output width in pixels (wins over scale).
+    :param scale: Requested output scale (0.1 - 1.0).
+    :param quality: Requested JPEG quality (10 - 95); None = the capture thread's default.
+    :param adaptive: Step quality/resolution/fps down when sends block, and back up when they don't.
+    :param sock: The client's socket, if the server exposes it (werkzeug does). Lets us cap the kernel
+                 send buffer and read how much is still unsent; without it only send blocking time is used.
+    """
+    def __init__(self, max_fps=None, width=None, scale=None, quality=None, adaptive=True, cache=encode_cache, sock=None):
+        self.max_fps = max_fps or MAX_FPS
+        self.fps = self.max_fps # Current cap; lowered by adaptation once resolution/quality bottom out
+        self.width = width
+        self.scale = scale or 1.0
+        self.quality = quality
+        self.adaptive = adaptive
+        self.cache = cache
+        self.level = 0
+        self.send_ewma = 0.0
+        self.last_seq = 0
+        self.last_send_time = 0.0
+        self.last_change = time.perf_counter()
+        self.last_congested = self.last_change
+        self.last_chunk_bytes = 0
+        self.sock = sock
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+            except OSError:
+                self.sock = None
+
+    def backlog_frames(self):
+        """Frames' worth of bytes still queued in the kernel for this client (0.0 if unknown)."""
+        if self.sock is None or not self.last_chunk_bytes:
+            return 0.0
+        try:
+            queued = fcntl.ioctl(self.sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0') # Linux: unsent bytes
+        except (OSError, ValueError):
+            self.sock = None # Closed socket, or not a TCP socket
+            return 0.0
+        return int.from_bytes(queued, 'little') / self.last_chunk_bytes
+
+    def seconds_until_due(self):
+        """How long to hold off before the next frame: the fps cap, then one more interval if the socket is backed up."""
+        delay = self.last_send_time + 1.0 / self.fps - time.perf_counter()
+        if delay > 0:
+            return delay
+        if self.backlog_frames() > MAX_BACKLOG_FRAMES: # Last frame still mostly unsent a whole interval later
+            MJPEG_BACKLOG_WAITS.inc()
+            if self.adaptive:
+                self._adapt(time.perf_counter(), congested=True)
+            self.last_send_time = time.perf_counter() # Skip ahead rather than queue another frame behind the backlog
+            return 1.0 / self.fps
+        return 0.0
+
+    def settings(self, frame_width):
+        """(width, quality) for the current adaptation level, capped by what the client asked for."""
+        level_scale, level_quality = QUALITY_LADDER[self.level]
+        width = self.width if self.width else frame_width * self.scale
+        width = max(MIN_WIDTH, int(min(width, frame_width) * level_scale))
+        quality = self.quality
+        if level_quality is not None:
+            quality = min(quality, level_quality) if quality is not None else level_quality
+        return width, quality
+
+    def render(self, seq, frame, jpeg, frame_width, decode=None, encode=True):
+        """Returns the multipart chunk for this frame at the client's current settings.
+           frame is None for passthrough frames; decode(seq, jpeg) is then used only if a re-encode is needed.
+           encode=False: returns None (and changes nothing) if that would mean a resize / re-encode here.
+        """
+        width, quality = self.settings(frame_width)
+        if width < frame_width or quality is not None:
+            cached = self.cache.get(seq, width, quality)
+            if cached is None and not encode:
+                return None
+            if cached is None:
+                if frame is None:
+                    frame = lambda: decode(seq, jpeg)
+                cached = self.cache.get_or_encode(seq, frame, width, quality)
+            jpeg = cached
+        if self.last_seq and seq > self.last_seq + 1:
+            MJPEG_FRAMES_SKIPPED.inc(seq - self.last_seq - 1)
+        self.last_seq = seq
+        chunk = mjpeg_part(jpeg)
+        self.last_chunk_bytes = len(chunk)
+        return chunk
+
+    def record_send(self, sent_at, seconds):
+        """Feeds back how long the last chunk took to leave (time until the server asked for the next one)."""
+        self.last_send_time = sent_at
+        MJPEG_FRAMES_SENT.inc()
+        MJPEG_SEND_SECONDS.observe(seconds)
+        self.send_ewma += SEND_EWMA_ALPHA * (seconds - self.send_ewma)
+        if self.adaptive:
+            self._adapt(time.perf_counter())
+
+    def _adapt(self, now, congested=False):
+        interval = 1.0 / self.fps
+        if congested or self.send_ewma > CONGESTED_RATIO * interval:
+            self.last_congested = now
+            if now - self.last_change < DOWNGRADE_HOLD_SECONDS:
+                return
+            if self.level < len(QUALITY_LADDER) - 1:
+                self.level += 1
+            else: # Smallest frames and still congested: send fewer of them
+                self.fps = max(MIN_FPS, self.fps / 1.5)
+            self.last_change = now
+        elif self.send_ewma < IDLE_RATIO * interval and now - self.last_congested > UPGRADE_HOLD_SECONDS \
+                and now - self.last_change > UPGRADE_HOLD_SECONDS:
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps * 1.5) # Undo in reverse order: fps first, then size/quality
+            elif self.level > 0:
+                self.level -= 1
+            self.last_change = now
+
+
+def frame_width(frame, jpeg):
+    """Width of a BGR frame, or of a JPEG read from its SOF header (passthrough frames aren't decoded)."""
+    if frame is not None:
+        return frame.shape[1]
+    i = 2
+    while i + 9 < len(jpeg):
+        if jpeg[i] != 0xFF:
+            break
+        marker = jpeg[i + 1]
+        if marker in (0xC0, 0xC1, 0xC2): # Start Of Frame: precision(1), height(2), width(2)
+            return int.from_bytes(jpeg[i + 7:i + 9], 'big')
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], 'big')
+    return 640 # Unparseable header: assume the default capture size
+
+
+def mjpeg_frames(frame_buffer, client):
+    """Threaded /mjpeg generator (Flask). Werkzeug writes each chunk before resuming us, so the
+    time spent at the yield is how long the socket took to accept the frame."""
+    MJPEG_CLIENTS.inc()
+    try:
+        while True:
+            delay = client.seconds_until_due()
+            if delay:
+                time.sleep(delay)
+                continue # Re-check: the socket may still be backed up
+            seq = frame_buffer.wait_for_new(client.last_seq, timeout=2.0)
+            if seq == client.last_seq:
+                continue # No new frame yet (camera stalled); keep the connection open
+            seq, frame, jpeg, _ = frame_buffer.get()
+            chunk = client.render(seq, frame, jpeg, frame_width(frame, jpeg), frame_buffer.decode)
+            sent_at = time.perf_counter()
+            yield chunk
+            client.record_send(sent_at, time.perf_counter() - sent_at)
+    finally:
+        MJPEG_CLIENTS.dec()
+
+
+async def mjpeg_frames_async(frame_buffer, client):
+    """asyncio /mjpeg generator (ASGI). The server awaits the socket drain before resuming us;
+    re-encodes run in the default executor so they don't stall other streams. The shared JPEG and
+    cache hits are sent straight from the event loop."""
+    MJPEG_CLIENTS.inc()
+    try:
+        while True:
+            delay = client.seconds_until_due()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            seq = await frame_buffer.wait_for_new_async(client.last_seq, timeout=2.0)
+            if seq == client.last_seq:
+                continue
+            seq, frame, jpeg, _ = frame_buffer.get()
+            width = frame_width(frame, jpeg)
+            chunk = client.render(seq, frame, jpeg, width, encode=False)
+            if chunk is None: # Needs a resize / re-encode
+                chunk = await asyncio.to_thread(client.render, seq, frame, jpeg, width, frame_buffer.decode)
+            sent_at = time.perf_counter()
+            yield chunk
+            client.record_send(sent_at, time.perf_counter() - sent_at)
+    finally:
+        MJPEG_CLIENTS.dec()
@@ -0,0 +1,125 @@
+# panorama_builder.py
+# Builds a downscaled mosaic from the frames captured during a camera scan sweep.
+# Frames are placed on the canvas using the known servo angle, so no feature matching is needed.
+
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# --- Mosaic Configuration ---
+CAMERA_FOV_DEG = 60.0 # Approximate field of view of the camera along the scan axis (degrees)
+MOSAIC_SCALE = 0.25   # Frames are downscaled by this factor before being placed on the canvas
+MAX_SWEEPS = 5        # Number of completed sweeps kept in memory
+
+
+class PanoramaBuilder:
+    def __init__(self, min_angle, max_angle, fov_deg=CAMERA_FOV_DEG, scale=MOSAIC_SCALE,
+                 max_sweeps=MAX_SWEEPS, axis='tilt', invert=False):
+        """
+        Initializes the PanoramaBuilder.
+        :param min_angle: Lowest servo angle of the sweep (degrees).
+        :param max_angle: Highest servo angle of the sweep (degrees).
+        :param fov_deg: Camera field of view along the scan axis (degrees).
+        :param scale: Downscale factor applied to each frame before stitching.
+        :param max_sweeps: How many finished mosaics to keep in memory.
+        :param axis: 'tilt' stacks frames vertically, 'pan' places them side by side.
+        :param invert: Flip the angle direction if the mosaic comes out mirrored.
+        """
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.fov_deg = fov_deg
+        self.scale = scale
+        self.axis = axis
+        self.invert = invert
+
+        self.sweeps = deque(maxlen=max_sweeps) # Finished mosaics: dicts with 'image', 'started', 'finished', 'frames'
+        self.lock = threading.Lock()
+
+        self._canvas = None     # Mosaic being built for the current sweep (NumPy array)
+        self._px_per_deg = 0.0  # Canvas pixels per servo degree along the scan axis
+        self._frame_count = 0
+        self._sweep_started = None
+
+    def _allocate_canvas(self, frame_h, frame_w):
+        """Allocates the canvas once the frame size of the sweep is known."""
+        small_h = int(frame_h * self.scale)
+        small_w = int(frame_w * self.scale)
+        scan_len = small_h if self.axis == 'tilt' else small_w
+        self._px_per_deg = scan_len / self.fov_deg
+        extra = int(round((self.max_angle - self.min_angle) * self._px_per_deg))
+        if self.axis == 'tilt':
+            self._canvas = np.zeros((small_h + extra, small_w, 3), dtype=np.uint8)
+        else:
+            self._canvas = np.zeros((small_h, small_w + extra, 3), dtype=np.uint8)
+
+    def add_frame(self, angle, frame):
+        """Pastes one frame into the current mosaic at the position given by the servo angle."""
+        if frame is None:
+            return
+        angle = max(self.min_angle, min(self.max_angle, angle))
+
+        with self.lock:
+            if self._canvas is None:
+                self._allocate_canvas(frame.shape[0], frame.shape[1])
+                self._sweep_started = time.time()
+                self._frame_count = 0
+
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            h, w = small.shape[:2]
+
+            offset_deg = (self.max_angle - angle) if self.invert else (angle - self.min_angle)
+            offset = int(round(offset_deg * self._px_per_deg))
+
+            # Only the region covered by this frame is touched, so each update is cheap
+            if self.axis == 'tilt':
+                offset = min(offset, self._canvas.shape[0] - h)
+                self._canvas[offset:offset + h, :w] = small
+            else:
+                offset = min(offset, self._canvas.shape[1] - w)
+                self._canvas[:h, offset:offset + w] = small
+            self._frame_count += 1
+
+    def finish_sweep(self):
+        """Closes the current mosaic and stores it with the last completed sweeps."""
+        with self.lock:
+            if self._canvas is None or self._frame_count == 0:
+                self._canvas = None
+                return
+            self.sweeps.append({
+                'image': self._canvas,
+                'started': self._sweep_started,
+                'finished': time.time(),
+                'frames': self._frame_count,
+            })
+            self._canvas = None
+        print(f"[PanoramaBuilder] Sweep finished ({len(self.sweeps)} mosaics in memory).")
+
+    def get_mosaic(self, index=-1):
+        """Returns a finished mosaic (newest by default) or the one in progress if none is finished."""
+        with self.lock:
+            if self.sweeps:
+                try:
+                    return self.sweeps[index]['image']
+                except IndexError:
+                    return None
+            if self._canvas is not None:
+                return self._canvas.copy()
+        return None
+
+    def get_mosaic_jpeg(self, index=-1):
+        """Returns the mosaic encoded as JPEG bytes, or None if there is nothing to show."""
+        mosaic = self.get_mosaic(index)
+        if mosaic is None:
+            return None
+        ok, buffer = cv2.imencode('.jpg', mosaic)
+        return buffer.tobytes() if ok else None
+
+    def list_sweeps(self):
+        """Returns metadata for the stored mosaics (oldest first)."""
+        with self.lock:
+            return [{'index': i, 'started': s['started'], 'finished': s['finished'], 'frames': s['frames'],
+                     'height': s['image'].shape[0], 'width': s['image'].shape[1]}
+                    for i, s in enumerate(self.sweeps)]
@@ -0,0 +1,161 @@
+# profiler.py
+# Opt-in sampling profiler: periodically captures the stacks of all threads with
+# sys._current_frames(), aggregates them in memory, and exports collapsed stacks
+# (for flamegraph.pl / speedscope) or a speedscope JSON document.
+
+import os
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.01 # Seconds between samples (100 Hz)
+MAX_STACK_DEPTH = 64
+PROFILER_ENV = "ROVER_PROFILER" # Set ROVER_PROFILER=1 to start sampling at app startup
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL, max_depth=MAX_STACK_DEPTH):
+        """
+        Initializes the SamplingProfiler (nothing is sampled until start() is called).
+        :param interval: Seconds between two samples of all thread stacks.
+        :param max_depth: Frames kept per stack (deeper frames are cut at the root side).
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self._stacks = {} # (thread name, tuple of code objects root->leaf) -> sample count
+        self._samples = 0
+        self._started_at = None
+        self._sampling_seconds = 0.0 # Time spent inside the sampler itself (overhead)
+        self._running = threading.Event()
+        self._thread = None
+
+    # --- Control ---
+    def start(self):
+        if self._running.is_set():
+            return False
+        if self._thread is not None:
+            self._thread.join() # A previous sampler may still be finishing its last sleep
+        self._running.set()
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        print(f"[Profiler] Sampling all threads every {self.interval * 1000:.0f} ms.")
+        return True
+
+    def stop(self):
+        if not self._running.is_set():
+            return False
+        self._running.clear()
+        print("[Profiler] Sampling stopped.")
+        return True
+
+    def reset(self):
+        with self.lock:
+            self._stacks = {}
+            self._samples = 0
+            self._sampling_seconds = 0.0
+            self._started_at = time.time() if self._running.is_set() else None
+
+    def is_running(self):
+        return self._running.is_set()
+
+    # --- Sampling Loop ---
+    def _run(self):
+        own_ident = threading.get_ident()
+        thread_names = {}
+        refresh = 0
+        while self._running.is_set():
+            sample_start = time.perf_counter()
+            if refresh == 0: # Threads can be renamed (MJPEG clients); refresh the names every 50 samples
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            refresh = (refresh + 1) % 50
+
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, frame in frames.items():
+                    if ident == own_ident:
+                        continue
+                    if ident not in thread_names: # New thread since the last refresh
+                        thread_names = {t.ident: t.name for t in threading.enumerate()}
+                    codes = []
+                    while frame is not None and len(codes) < self.max_depth:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    codes.reverse()
+                    key = (thread_names.get(ident, f"thread-{ident}"), tuple(codes))
+                    self._stacks[key] = self._stacks.get(key, 0) + 1
+                self._samples += 1
+                self._sampling_seconds += time.perf_counter() - sample_start
+            del frames # Don't keep other threads' frames alive while sleeping
+            time.sleep(self.interval)
+
+    # --- Export ---
+    @staticmethod
+    def _frame_name(code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _snapshot(self):
+        with self.lock:
+            return dict(self._stacks)
+
+    def status(self):
+        with self.lock:
+            samples = self._samples
+            overhead = self._sampling_seconds
+        elapsed = time.time() - self._started_at if self._started_at else 0.0
+        return {
+            'running': self.is_running(),
+            'interval': self.interval,
+            'samples': samples,
+            'elapsed_seconds': round(elapsed, 3),
+            'overhead_fraction': round(overhead / elapsed, 5) if elapsed > 0 else 0.0,
+            'threads': sorted({name for name, _ in self._snapshot()}),
+        }
+
+    def collapsed(self, thread=None):
+        """Returns 'thread;frame;frame... count' lines (Brendan Gregg's collapsed stack format)."""
+        lines = []
+        for (thread_name, codes), count in self._snapshot().items():
+            if thread and thread_name != thread:
+                continue
+            path = ";".join([thread_name] + [self._frame_name(code) for code in codes])
+            lines.append(f"{path} {count}")
+        lines.sort()
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self):
+        """Returns a speedscope.app JSON document with one sampled profile per thread."""
+        frames = []
+        frame_index = {}
+        profiles = {}
+        for (thread_name, codes), count in self._snapshot().items():
+            stack = []
+            for code in codes:
+                if code not in frame_index:
+                    frame_index[code] = len(frames)
+                    frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+                stack.append(frame_index[code])
+            profile = profiles.setdefault(thread_name, {'samples': [], 'weights': []})
+            profile['samples'].append(stack)
+            profile['weights'].append(count)
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': thread_name,
+                'unit': 'none', # Weights are sample counts
+                'startValue': 0,
+                'endValue': sum(profile['weights']),
+                'samples': profile['samples'],
+                'weights': profile['weights'],
+            } for thread_name, profile in sorted(profiles.items())],
+            'name': 'rover',
+            'exporter': 'rover profiler.py',
+        }
+
+
+# --- Shared profiler used by app.py ---
+profiler = SamplingProfiler()
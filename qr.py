@@ -4,6 +4,12 @@ import os
 import time
 import base64
 
+import metrics
+
+# --- Metrics ---
+QR_DECODE_SECONDS = metrics.histogram('rover_qr_decode_seconds', 'Time spent in detectAndDecode per frame')
+QR_NEW_CODES = metrics.counter('rover_qr_new_codes_total', 'QR codes decoded for the first time')
+
 
 # cam = cv2.VideoCapture(1)
 # cam.set(cv2.CAP_PROP_FRAME_WIDTH, 320)
@@ -11,16 +17,27 @@ import base64
 
 qr_detector = cv2.QRCodeDetector()
 detected_qr_data = set()
+last_detection = ('', None) # (data, bbox) from the most recent qr() call
+last_detection_fresh = False # False if that call's frame was skipped by the gate and last_detection is from an earlier one
+image_store = None # Set by app.py through set_image_store()
 
 STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
-os.makedirs(STATIC_FOLDER, exist_ok=True)
 
 QR_LOG_FILE = os.path.join(STATIC_FOLDER, 'qr_detected.log')
 
 DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
-os.makedirs(DATA_FOLDER, exist_ok=True)
 QR_LOG_FILE = os.path.join(DATA_FOLDER, 'qr_detected.log')
 
+_folders_ready = False
+
+def ensure_folders():
+    """Creates the output folders on first use instead of at import time."""
+    global _folders_ready
+    if not _folders_ready:
+        os.makedirs(STATIC_FOLDER, exist_ok=True)
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        _folders_ready = True
+
 # def take_pic():
 #     """Capture a photo without releasing the camera (no crash)."""
 #     ret, frame = cam.read()
@@ -56,41 +73,78 @@ QR_LOG_FILE = os.path.join(DATA_FOLDER, 'qr_detected.log')
 #                b'Content-Type: image/jpeg\r\n\r\n' + frame.tobytes() + b'\r\n')
 #         time.sleep(0.1)
 
-def qr(img):
+def detect_qr(img):
+    """Runs the QR detector only (no saving, no drawing). Returns (data, bbox)."""
+    decode_start = time.perf_counter()
     data, bbox, _ = qr_detector.detectAndDecode(img)
+    QR_DECODE_SECONDS.observe_since(decode_start)
+    return data, bbox
+
+def set_image_store(store):
+    """NEW: New detections go into this image_store.ImageStore (segments + thumbnails) instead of loose JPEG files."""
+    global image_store
+    image_store = store
+
+def record_detection(img, data, jpeg=None):
+    """Saves the image and logs the payload the first time a QR code is seen.
+       jpeg: the already-encoded image (from a vision worker process); img may then be None.
+    """
+    if data in detected_qr_data:
+        return
+    QR_NEW_CODES.inc()
+    print(f"[QR] New QR Code Detected: {data}")
+    ensure_folders()
+    detected_qr_data.add(data)
+    if image_store is not None:
+        if jpeg is None:
+            jpeg = cv2.imencode('.jpg', img)[1].tobytes()
+        image_id = image_store.add(jpeg, kind='qr', label=data)
+        image_filename = f"/images/{image_id}"
+        print(f"[QR] Stored image: {image_filename}")
+    else:
+        if img is None:
+            img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        filename = f"qr_{len(detected_qr_data)}.jpg"
+        cv2.imwrite(filename, img)
+        with open("qrs.html", "a") as f:
+            f.write(f'<div> <img src="qr_{len(detected_qr_data)}.jpg"><br> </div>')
+            f.write(f'<div> {data} </div>')
+
+        image_filename = f"qr_{len(detected_qr_data)}_{int(time.time())}.jpg"
+        image_path = os.path.join(STATIC_FOLDER, image_filename)
+        cv2.imwrite(image_path, img)
+        print(f"[QR] Saved image: {image_path}")
+    
+    with open(QR_LOG_FILE, "a") as f:
+        f.write(f"{time.ctime()} - {data} (Image: {image_filename})\n")
+    print(f"[QR] Logged to {QR_LOG_FILE}")
+
+def draw_qr_overlay(img, data, bbox):
+    """Draws the QR outline (and the decoded text, if any) onto img in place."""
+    if bbox is None:
+        return img
+    bbox = bbox.astype(int)
+    for i in range(len(bbox[0])):
+        pt1 = tuple(bbox[0][i])
+        pt2 = tuple(bbox[0][(i + 1) % len(bbox[0])])
+        cv2.line(img, pt1, pt2, (0, 255, 0), 2)
     if data:
-        if data not in detected_qr_data:
-            print(f"[QR] New QR Code Detected: {data}")
-            detected_qr_data.add(data)
-            filename = f"qr_{len(detected_qr_data)}.jpg"
-            cv2.imwrite(filename, img)
-            with open("qrs.html", "a") as f:
-                f.write(f'<div> <img src="qr_{len(detected_qr_data)}.jpg"><br> </div>')
-                f.write(f'<div> {data} </div>')
-            
-            image_filename = f"qr_{len(detected_qr_data)}_{int(time.time())}.jpg" 
-            image_path = os.path.join(STATIC_FOLDER, image_filename)
-            cv2.imwrite(image_path, img)
-            print(f"[QR] Saved image: {image_path}")
-            
-            with open(QR_LOG_FILE, "a") as f:
-                f.write(f"{time.ctime()} - {data} (Image: {image_filename})\n")
-            print(f"[QR] Logged to {QR_LOG_FILE}")
-
-        if bbox is not None:
-            bbox = bbox.astype(int)
-            for i in range(len(bbox[0])):
-                pt1 = tuple(bbox[0][i])
-                pt2 = tuple(bbox[0][(i + 1) % len(bbox[0])])
-                cv2.line(img, pt1, pt2, (0, 255, 0), 2)
-    if bbox is not None:
-        bbox = bbox.astype(int)
-        for i in range(len(bbox[0])):
-            pt1 = tuple(bbox[0][i])
-            pt2 = tuple(bbox[0][(i + 1) % len(bbox[0])])
-            cv2.line(img, pt1, pt2, (0, 255, 0), 2)
-            if data:
-                cv2.putText(img, data, (bbox[0][0][0], bbox[0][0][1] - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                #cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        cv2.putText(img, data, (bbox[0][0][0], bbox[0][0][1] - 10),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
     return img
+
+def qr(img, record=True, gate=None):
+    """Detects QR codes in img, saves/logs new ones (unless record=False) and draws the overlay.
+       gate: optional qr_gate.QrGate; on a frame it skips, the previous result is drawn again
+             (and last_detection_fresh is False).
+    """
+    global last_detection, last_detection_fresh
+    if gate is not None and not gate.check(img):
+        last_detection_fresh = False
+        return draw_qr_overlay(img, *last_detection) # Same scene as the last detected frame
+    data, bbox = detect_qr(img)
+    last_detection = (data, bbox)
+    last_detection_fresh = True
+    if data and record:
+        record_detection(img, data)
+    return draw_qr_overlay(img, data, bbox)
@@ -0,0 +1,207 @@
+# realtime.py - CPU isolation, real-time priority and loop jitter measurement
+# The encoder reader, odometry and the automation loop share the CPUs (and the GIL) with QR detection
+# and JPEG encoding, so their period jitters whenever vision is busy. ROVER_REALTIME=1:
+#   - runs QR detection in the frame-bus worker processes (vision_worker.py), off this process's GIL,
+#     pinned to the vision cores (os.sched_setaffinity);
+#   - pins the control threads to a core of their own and gives them SCHED_FIFO when permitted
+#     (root or CAP_SYS_NICE), otherwise the highest nice level allowed;
+#   - pins every other thread of this process (Flask, capture, JPEG encoding) to the remaining cores.
+# The control loops stay threads of the Flask process: they share odometry and the motor functions with
+# the API, and the GIL is rarely held for long once detection runs elsewhere. SCHED_FIFO makes the kernel
+# run a control thread as soon as it is runnable; it still has to wait for the GIL.
+#
+# JitterMonitor records every loop period in a numpy ring for /admin/jitter. POST /admin/realtime
+# switches the pinning and priorities on or off at runtime and keeps the previous periods as "before",
+# so one run shows both.
+#
+# ROVER_CONTROL_CPUS (default: the last CPU) and ROVER_VISION_CPUS (default: the others but CPU 0)
+# take lists like "3" or "1,2"; ROVER_RT_PRIORITY is the SCHED_FIFO priority (default 50).
+
+import os
+import threading
+
+import numpy as np
+
+import metrics
+
+REALTIME_ENV = "ROVER_REALTIME"
+CONTROL_CPUS_ENV = "ROVER_CONTROL_CPUS"
+VISION_CPUS_ENV = "ROVER_VISION_CPUS"
+RT_PRIORITY_ENV = "ROVER_RT_PRIORITY"
+FALLBACK_NICE = -10 # Without CAP_SYS_NICE this only works if RLIMIT_NICE allows it
+JITTER_CAPACITY = 4096 # Periods kept per loop
+PERIOD_BUCKETS = (0.005, 0.009, 0.0095, 0.01, 0.0105, 0.011, 0.015, 0.02, 0.05, 0.1, 0.25, 1.0)
+
+_lock = threading.Lock()
+_control_threads = set() # threading.Thread objects of the control loops
+_monitors = {}           # loop name -> JitterMonitor
+_state = {'enabled': False, 'threads': {}, 'vision_pids': []}
+
+
+def realtime_enabled():
+    return os.environ.get(REALTIME_ENV) == '1'
+
+
+def _parse_cpus(text):
+    return {int(part) for part in text.replace(' ', '').split(',') if part}
+
+
+def cpu_plan():
+    """(control cpus, general cpus, vision cpus) from the environment, defaulting to the last CPU for control."""
+    try:
+        available = sorted(os.sched_getaffinity(0))
+    except AttributeError: # Not Linux
+        available = list(range(os.cpu_count() or 1))
+    control = _parse_cpus(os.environ.get(CONTROL_CPUS_ENV, '')) or {available[-1]}
+    general = set(available) - control or set(available) # One CPU: nothing to isolate
+    vision = _parse_cpus(os.environ.get(VISION_CPUS_ENV, '')) or (general - {available[0]} or general)
+    return control, general, vision
+
+
+def set_affinity(cpus, tid=0):
+    """Pins a thread (Linux: tid = threading.Thread.native_id, 0 = the calling one) or process. Returns True on success."""
+    try:
+        os.sched_setaffinity(tid, cpus)
+        return True
+    except (AttributeError, OSError) as e:
+        print(f"[Realtime] Could not pin {tid or 'this thread'} to CPUs {sorted(cpus)}: {e}")
+        return False
+
+
+def set_priority(tid=0, realtime=True):
+    """SCHED_FIFO for a thread if permitted, else FALLBACK_NICE; realtime=False restores the defaults. Returns a label."""
+    if not hasattr(os, 'sched_setscheduler'):
+        return 'unsupported'
+    if not realtime:
+        try:
+            os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+            os.setpriority(os.PRIO_PROCESS, tid, 0)
+        except OSError:
+            pass
+        return 'normal'
+    priority = int(os.environ.get(RT_PRIORITY_ENV, '50'))
+    try:
+        os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(priority))
+        return f"SCHED_FIFO {priority}"
+    except OSError:
+        pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, FALLBACK_NICE)
+        return f"nice {FALLBACK_NICE}"
+    except OSError:
+        return 'normal (no permission)'
+
+
+def register_control_thread(thread):
+    """Marks a started thread as a control loop; pinned and prioritised now if the mode is on."""
+    with _lock:
+        _control_threads.add(thread)
+        if _state['enabled']:
+            _apply_thread(thread, *cpu_plan()[:2], True)
+
+
+def _apply_thread(thread, control, general, enabled):
+    if thread.native_id is None or not thread.is_alive():
+        return
+    is_control = thread in _control_threads
+    set_affinity(control if enabled and is_control else general | control, thread.native_id)
+    if is_control:
+        _state['threads'][thread.name] = set_priority(thread.native_id, realtime=enabled)
+
+
+def apply(enabled=True, vision_pids=()):
+    """Pins (or unpins) every thread of this process and the vision processes. Returns status()."""
+    control, general, vision = cpu_plan()
+    with _lock:
+        _state['enabled'] = enabled
+        for thread in threading.enumerate():
+            _apply_thread(thread, control, general, enabled)
+        for pid in vision_pids:
+            set_affinity(vision if enabled else general | control, pid)
+        _state['vision_pids'] = list(vision_pids)
+    if enabled:
+        print(f"[Realtime] Control threads on CPUs {sorted(control)} ({', '.join(f'{n}: {p}' for n, p in _state['threads'].items()) or 'none yet'}), "
+              f"vision processes on {sorted(vision)}, everything else on {sorted(general)}.")
+    else:
+        print("[Realtime] Off: all threads on all CPUs, normal priority.")
+    return status()
+
+
+def enter_vision_process():
+    """Called at the start of a vision worker process: pins it to the vision CPUs if the mode is on."""
+    if realtime_enabled():
+        set_affinity(cpu_plan()[2])
+
+
+def status():
+    control, general, vision = cpu_plan()
+    with _lock:
+        return {'enabled': _state['enabled'], 'control_cpus': sorted(control), 'general_cpus': sorted(general),
+                'vision_cpus': sorted(vision), 'control_threads': dict(_state['threads']),
+                'vision_pids': list(_state['vision_pids'])}
+
+
+class JitterMonitor:
+    """
+    Periods of one loop in a numpy ring, for percentiles, and in a rover_loop_period_seconds histogram.
+
+    :param name: Loop name (the histogram's 'loop' label).
+    :param max_period: Longer gaps (the loop was idle or its input paused) are not periods.
+    """
+    def __init__(self, name, max_period=1.0, capacity=JITTER_CAPACITY):
+        self.name = name
+        self.max_period = max_period
+        self.periods = np.zeros(capacity)
+        self.count = 0
+        self.last = None
+        self.histogram = metrics.histogram('rover_loop_period_seconds', 'Control loop period', {'loop': name},
+                                           buckets=PERIOD_BUCKETS)
+
+    def tick(self, now):
+        """Marks the start of an iteration at now (perf_counter seconds)."""
+        if self.last is not None:
+            self.observe(now - self.last)
+        self.last = now
+
+    def observe(self, period):
+        if period > self.max_period:
+            return
+        self.periods[self.count % len(self.periods)] = period
+        self.count += 1
+        self.histogram.observe(period)
+
+    def reset(self):
+        self.count = 0
+        self.last = None
+
+    def report(self):
+        periods = self.periods[:min(self.count, len(self.periods))] * 1000.0
+        result = {'loop': self.name, 'periods': len(periods)}
+        if len(periods):
+            p50, p90, p99, p999 = np.percentile(periods, (50, 90, 99, 99.9))
+            result.update({'mean_ms': round(float(periods.mean()), 3), 'p50_ms': round(float(p50), 3),
+                           'p90_ms': round(float(p90), 3), 'p99_ms': round(float(p99), 3),
+                           'p99.9_ms': round(float(p999), 3), 'max_ms': round(float(periods.max()), 3),
+                           'std_ms': round(float(periods.std()), 3), 'jitter_ms': round(float(p99 - p50), 3)})
+        return result
+
+
+def monitor(name, max_period=1.0):
+    """The JitterMonitor for a loop, created on first use."""
+    with _lock:
+        if name not in _monitors:
+            _monitors[name] = JitterMonitor(name, max_period)
+        return _monitors[name]
+
+
+def jitter_report():
+    with _lock:
+        monitors = list(_monitors.values())
+    return [m.report() for m in monitors]
+
+
+def reset_jitter():
+    with _lock:
+        monitors = list(_monitors.values())
+    for m in monitors:
+        m.reset()
@@ -0,0 +1,508 @@
+# replay.py - Deterministic replay of a recorded mission (flight_recorder.py logs)
+# ROVER_REPLAY=data/flight (a folder or one .rfr file) runs app.py with the serial link, the camera and
+# the clock fed from the recording instead of the hardware; motors and servo are simulated. IMU samples
+# recorded with ROVER_IMU=1 are applied to the odometry between the encoder lines, as they were live.
+#
+#   ROVER_REPLAY_SPEED=1 (default)  Plays back in real time (or 2, 0.5, ...) for reviewing a run in the dashboard.
+#   ROVER_REPLAY_SPEED=0            As fast as the CPU allows. Recorded time only moves when the replayed
+#                                   telemetry does, and every thread sleeping on the clock (automation loop,
+#                                   camera, injected commands) runs to its next sleep before time moves on,
+#                                   so two runs of the same log make the same decisions.
+#
+# The automation loop does not tick every 50 ms of recorded time: each recorded automation command carries
+# the odometry time of the pose it was decided on, and the replayed loop's sleep ends just before the first
+# telemetry or IMU sample after that, so it decides on the same pose the recorded loop did however late that loop
+# ran. Once a replayed command differs from the recorded one the loop falls back to its own 50 ms ticks.
+#
+# The recorded dashboard commands and mission targets are re-issued at their recorded times; the
+# automation commands and state changes the replayed AutomationController produces are compared with
+# the recorded ones, the replayed odometry with the recorded pose, and QR detections on the recorded
+# frames are listed. The report is printed when the log ends and served on /replay.
+#
+# Regression check (exits 1 if the automation decisions diverge from the recording):
+#   python replay.py data/flight --speed 0 --report replay_report.json
+#
+# Deterministic runs assume the in-process QR path (no ROVER_FRAME_BUS / ROVER_JPEG_PASSTHROUGH).
+
+import argparse
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+import time as _time
+
+import cv2
+import numpy as np
+
+from flight_recorder import open_flight_logs, iter_records, TELEMETRY, COMMAND, STATE, FRAME, TARGETS, IMU
+from sim_hardware import _SimPort, SIM_FRAME_SIZE
+
+REPLAY_ENV = "ROVER_REPLAY"
+REPLAY_SPEED_ENV = "ROVER_REPLAY_SPEED"
+REORDER_SECONDS = 1.0  # The recorder's producer threads can interleave slightly; sort within this window
+HANDOFF_TIMEOUT = 2.0  # Real seconds a woken thread gets to reach its next clock sleep (then it's assumed blocked elsewhere)
+DECISION_TOLERANCE_SECONDS = 0.25 # A replayed decision may land a few loop ticks off the recording's (jittery) timing
+PARTICIPANT_TIMEOUT = 10.0 # Real seconds to wait at startup for the camera and event threads to join the clock
+
+
+def _blocked_elsewhere(ident):
+    """True if the thread has exited or is parked in a threading wait (Event, Condition, queue) rather than running."""
+    frame = sys._current_frames().get(ident)
+    return frame is None or (frame.f_code.co_name == 'wait' and frame.f_code.co_filename == threading.__file__)
+
+
+class ReplayClock:
+    """
+    Stands in for the time module (time(), perf_counter(), monotonic(), sleep()) during a replay.
+
+    :param start_time: Recorded Unix time the replay starts at.
+    :param speed: Recorded seconds per wall second; 0 = only advance_to() moves time (fast, deterministic).
+    """
+    def __init__(self, start_time, speed=1.0):
+        self.speed = speed
+        self.cond = threading.Condition()
+        self._now = start_time
+        self._wall_start = _time.monotonic()
+        self.sleepers = {}   # Thread ident -> (deadline, thread name)
+        self.awake = set()   # Threads woken by advance_to() that have not gone back to sleep yet
+        self.schedules = {}  # Thread name -> function returning the recorded time its next sleep() ends at, or None
+        self.handing_off = set() # Threads in wait_until_sleeping(): still running as far as advance_to() is concerned
+        self.handoff_timeouts = 0
+
+    @property
+    def fast(self):
+        return self.speed == 0
+
+    def time(self):
+        return self._now + (_time.monotonic() - self._wall_start) * self.speed
+
+    perf_counter = time
+    monotonic = time
+
+    def sleep(self, seconds):
+        schedule = self.schedules.get(threading.current_thread().name)
+        deadline = schedule() if schedule else None
+        self.sleep_until(self.time() + seconds if deadline is None else deadline)
+
+    def sleep_until(self, deadline):
+        if self.fast:
+            me = threading.get_ident()
+            with self.cond:
+                self.awake.discard(me)
+                self.sleepers[me] = (deadline, threading.current_thread().name)
+                self.cond.notify_all()
+                while self.fast and self._now < deadline:
+                    self.cond.wait()
+                del self.sleepers[me]
+                if self.fast:
+                    self.awake.add(me) # The driver waits for us to sleep again before moving time on
+                    return
+        remaining = deadline - self.time()
+        if remaining > 0:
+            _time.sleep(remaining / self.speed)
+
+    def advance_to(self, timestamp):
+        """Fast mode driver: moves time to timestamp, running every sleeper that comes due on the way, in deadline order."""
+        with self.cond:
+            while True:
+                due = [deadline for deadline, _ in self.sleepers.values() if deadline <= timestamp]
+                if not due:
+                    break
+                self._now = max(self._now, min(due))
+                self.cond.notify_all()
+                if not self._wait_for_handoff():
+                    break
+            self._now = max(self._now, timestamp)
+
+    def _wait_for_handoff(self):
+        """Waits until every woken thread is sleeping on the clock again, has exited, or is blocked on something
+           else (the automation thread going back to its Event, say). Called with self.cond held."""
+        give_up = _time.monotonic() + HANDOFF_TIMEOUT
+        while True:
+            self.awake = {ident for ident in self.awake if ident in self.handing_off or not _blocked_elsewhere(ident)}
+            if not self.awake and all(deadline > self._now for deadline, _ in self.sleepers.values()):
+                return True
+            remaining = give_up - _time.monotonic()
+            if remaining <= 0:
+                self.handoff_timeouts += 1 # Still busy after HANDOFF_TIMEOUT: go on without it
+                self.awake.clear()
+                return False
+            self.cond.wait(min(0.005, remaining))
+
+    def wait_until_sleeping(self, thread_name, timeout):
+        """Fast mode: waits (in real time) until the named thread is sleeping on the clock. Time does not move on
+           meanwhile if the caller was woken by the clock."""
+        if not self.fast:
+            return True
+        me = threading.get_ident()
+        with self.cond:
+            self.handing_off.add(me)
+            try:
+                return self.cond.wait_for(lambda: any(name == thread_name for _, name in self.sleepers.values()), timeout=timeout)
+            finally:
+                self.handing_off.discard(me)
+
+    def finish(self):
+        """End of the log: from here on the clock runs in real time from the last recorded time."""
+        with self.cond:
+            self._now = self.time()
+            self._wall_start = _time.monotonic()
+            self.speed = 1.0
+            self.cond.notify_all()
+
+
+class ReplaySerial:
+    """ArduinoSerialComm stand-in: re-emits the recorded telemetry as 'yaw,pitch,roll,rpm1,speed1,rpm2,speed2' lines,
+       applying the recorded IMU samples in between. Its reader thread drives the clock in fast mode.
+    """
+    def __init__(self, replay):
+        self.replay = replay
+        self.ser = None
+        self._records = None
+        self._previous = None
+
+    def connect(self):
+        self.ser = _SimPort()
+        return True
+
+    def read_data(self):
+        if self.ser is None or self.replay.finished.is_set():
+            return None
+        if self._records is None:
+            self._records = self.replay._begin()
+        if self._previous is not None:
+            self.replay._check_pose(self._previous) # The reader thread has applied the previous line by now
+        record = next(self._records, None)
+        while record is not None and record.type == IMU:
+            self._wait_until(record.timestamp)
+            self.replay._apply_imu(record)
+            record = next(self._records, None)
+        if record is None:
+            self.replay._finish()
+            return None
+        self._wait_until(record.timestamp)
+        sample = record.decode()
+        self._previous = sample
+        self.replay.telemetry_samples += 1
+        return ",".join(repr(sample[field]) for field in ('yaw', 'pitch', 'roll', 'rpm1', 'speed1', 'rpm2', 'speed2'))
+
+    def _wait_until(self, timestamp):
+        clock = self.replay.clock
+        if clock.fast:
+            clock.advance_to(timestamp)
+        else:
+            clock.sleep_until(timestamp)
+
+    def send_command(self, command_str):
+        pass
+
+    def close(self):
+        self.ser = None
+
+
+class ReplayCamera:
+    """cv2.VideoCapture stand-in returning the recorded (decimated) frames at their recorded times.
+       After the last frame it keeps returning that frame once a second.
+    """
+    def __init__(self, replay):
+        self.replay = replay
+        self.opened = True
+        self.width, self.height = SIM_FRAME_SIZE
+        self._records = replay._records({FRAME})
+        self.frame = None
+        self.frame_time = None # Recorded time of the frame handed out last (QR result pending)
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        return False # The recording decides the format
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def read(self):
+        if self.frame_time is not None:
+            self.replay._frame_done(self.frame_time) # The capture thread has run QR on it by now
+            self.frame_time = None
+        record = next(self._records, None) if self._records is not None else None
+        if record is None:
+            self._records = None
+            self.replay.clock.sleep(1.0)
+            if self.frame is None:
+                self.frame = np.full((self.height, self.width, 3), 64, dtype=np.uint8) # Recording has no frames
+            return True, self.frame.copy()
+        self.replay.clock.sleep_until(record.timestamp)
+        frame = cv2.imdecode(np.frombuffer(record.payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None
+        self.height, self.width = frame.shape[:2]
+        self.frame = frame
+        self.frame_time = record.timestamp
+        return True, frame.copy() # The capture thread draws on its frame
+
+    def release(self):
+        self.opened = False
+
+
+class Replay:
+    """
+    One replay of a flight log, plus the stand-ins app.py uses instead of the hardware.
+
+    :param path: A .rfr file or a folder of them (rotated files are played in order).
+    :param speed: 1.0 = real time, 0 = as fast as possible (deterministic).
+    :param start: Optional Unix time to start at.
+    :param end: Optional Unix time to stop at.
+
+    app.py wires in: odometry (pose check), on_command(command, speed) and on_targets(distance, direction)
+    (re-issue dashboard input), on_finished() (stop the mission at the end of the log) and qr_source()
+    (payload of the last QR detection).
+    """
+    def __init__(self, path, speed=1.0, start=None, end=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        first = next(self._records(None), None)
+        if first is None:
+            raise ValueError(f"No records to replay in {path}")
+        self.first_time = first.timestamp
+        self.clock = ReplayClock(first.timestamp, speed)
+        self.pose_update_times = [record.timestamp for record in self._records({TELEMETRY, IMU})]
+        self.recorded_decisions = [(value['command'], round(value['speed'], 1), value.get('pose_time'))
+                                   for value in (record.decode() for record in self._records({COMMAND}))
+                                   if value['source'] == 'automation']
+        self.clock.schedules['automation'] = self._next_tick
+        self.serial = ReplaySerial(self)
+        self.camera = ReplayCamera(self)
+        self.camera.opened = False # Until the 'camera' subsystem opens it
+        self.odometry = None
+        self.on_command = None
+        self.on_targets = None
+        self.on_finished = None
+        self.qr_source = None
+        self.finished = threading.Event()
+        self.report = None
+        self.wall_start = None
+        self.last_time = first.timestamp
+        self.telemetry_samples = 0
+        self.imu_samples = 0
+        self.max_pose_error = 0.0
+        self.max_heading_error = 0.0
+        self.recorded_commands = [] # (time, command, speed) issued by the recorded AutomationController
+        self.replayed_commands = []
+        self.recorded_states = []   # (time, new state)
+        self.replayed_states = []
+        self.qr_detections = []     # (recorded frame time, payload)
+        print(f"[Replay] {path} from {first.timestamp:.3f}, " +
+              ("as fast as possible" if self.clock.fast else f"at {speed:g}x"))
+
+    @classmethod
+    def from_env(cls):
+        """A Replay for ROVER_REPLAY / ROVER_REPLAY_SPEED, or None when not replaying."""
+        path = os.environ.get(REPLAY_ENV)
+        if not path:
+            return None
+        return cls(path, speed=float(os.environ.get(REPLAY_SPEED_ENV, '1')))
+
+    def _records(self, types):
+        """Records of the given types in timestamp order (each caller gets its own file handles)."""
+        pending = []
+        tie = itertools.count()
+        for record in iter_records(open_flight_logs(self.path), self.start, self.end, types):
+            heapq.heappush(pending, (record.timestamp, next(tie), record))
+            while pending[0][0] < record.timestamp - REORDER_SECONDS:
+                yield heapq.heappop(pending)[2]
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    def _next_tick(self):
+        """Clock schedule for the automation thread: wake just before the first telemetry or IMU sample newer than the
+           pose the recorded controller made its next command on, while the replayed commands are still the recorded ones."""
+        n = len(self.replayed_commands)
+        if n >= len(self.recorded_decisions) or self.recorded_decisions[n][2] is None:
+            return None
+        if n and self.replayed_commands[-1][1:] != (self.recorded_decisions[n - 1][0], self.recorded_decisions[n - 1][1]):
+            return None
+        i = bisect.bisect_right(self.pose_update_times, self.recorded_decisions[n][2])
+        return self.pose_update_times[i] if i < len(self.pose_update_times) else None
+
+    # --- Stand-ins ---
+    def open_camera(self):
+        self.camera.opened = True
+        return self.camera
+
+    def wrap_motor_func(self, name, func):
+        """Returns func wrapped so the replayed automation commands can be compared with the recorded ones."""
+        def replayed(*args):
+            self.replayed_commands.append((self.clock.time(), name, round(float(args[0]), 1) if args else 0.0))
+            return func(*args)
+        return replayed
+
+    def record_state(self, old_state, new_state):
+        """AutomationController state listener."""
+        self.replayed_states.append((self.clock.time(), new_state))
+
+    # --- Playback ---
+    def _begin(self):
+        """Called by the serial reader on its first read: starts the event thread and returns the telemetry."""
+        if self.odometry is not None:
+            first = next(self._records({TELEMETRY}), None)
+            if first is not None: # Continue from the recorded pose (the log may start mid-run)
+                sample = first.decode()
+                self.odometry.x, self.odometry.y = sample['x'], sample['y']
+                self.odometry.theta = math.radians(sample['theta'])
+        events = threading.Thread(target=self._play_events, name="replay-events", daemon=True)
+        events.start()
+        while events.is_alive() and not self.clock.wait_until_sleeping("replay-events", 0.1): # Unless the log has no events
+            pass
+        if self.camera.opened and not self.clock.wait_until_sleeping("camera-capture", PARTICIPANT_TIMEOUT):
+            print("[Replay] Camera thread did not start; frames are not replayed in lockstep.")
+        self.wall_start = _time.monotonic()
+        # In the order they were written, which is the order app.py applied them to the odometry (not timestamp order
+        # when an IMU sample got in before an encoder line read earlier)
+        return iter_records(open_flight_logs(self.path), self.start, self.end, {TELEMETRY, IMU})
+
+    def _play_events(self):
+        for record in self._records({COMMAND, STATE, TARGETS}):
+            self.clock.sleep_until(record.timestamp)
+            if self.finished.is_set():
+                return
+            value = record.decode()
+            if record.type == STATE:
+                self.recorded_states.append((record.timestamp, value['to']))
+            elif record.type == TARGETS:
+                if self.on_targets:
+                    self.on_targets(value['distance'], value['direction'])
+            elif value['source'] == 'automation':
+                self.recorded_commands.append((record.timestamp, value['command'], value['speed']))
+            elif self.on_command:
+                self.on_command(value['command'], value['speed'])
+                if value['command'] == 'start_automation': # Let the woken automation thread reach its loop
+                    self.clock.wait_until_sleeping("automation", HANDOFF_TIMEOUT)
+
+    def _apply_imu(self, record):
+        """A recorded BNO08x sample, fed to the odometry as app.on_imu_sample() did live."""
+        if self.odometry is not None:
+            self.odometry.update_heading(record.decode()['yaw'], record.timestamp)
+        self.imu_samples += 1
+
+    def _check_pose(self, sample):
+        if self.odometry is None:
+            return
+        x, y, theta = self.odometry.get_pose()
+        self.max_pose_error = max(self.max_pose_error, math.hypot(x - sample['x'], y - sample['y']))
+        heading_error = abs((theta - sample['theta'] + 180.0) % 360.0 - 180.0)
+        self.max_heading_error = max(self.max_heading_error, heading_error)
+        self.last_time = self.clock.time()
+
+    def _frame_done(self, frame_time):
+        data = self.qr_source() if self.qr_source else ''
+        if data:
+            self.qr_detections.append((frame_time, data))
+
+    def _finish(self):
+        if self.finished.is_set():
+            return
+        self.report = self.build_report()
+        self.finished.set()
+        self.clock.finish()
+        if self.on_finished:
+            self.on_finished()
+        print(f"[Replay] Finished: {self.report['recorded_seconds']:.1f} s of log in {self.report['wall_seconds']:.1f} s, "
+              f"max pose error {self.report['max_pose_error_m']:.4f} m, "
+              f"states {'match' if self.report['states']['match'] else 'DIFFER'}, "
+              f"automation commands {'match' if self.report['automation_commands']['first_divergence'] is None else 'DIFFER'}, "
+              f"{len(self.qr_detections)} QR detections.")
+
+    # --- Results ---
+    def build_report(self):
+        recorded = _decisions(self.recorded_commands)
+        replayed = _decisions(self.replayed_commands)
+        divergence = None
+        for i, (a, b) in enumerate(itertools.zip_longest(recorded, replayed)):
+            if a is None or b is None or a[1:3] != b[1:3] or abs(a[0] - b[0]) > DECISION_TOLERANCE_SECONDS:
+                divergence = {'decision': i, 'recorded': _decision_dict(a), 'replayed': _decision_dict(b)}
+                break
+        recorded_states = [state for _, state in self.recorded_states]
+        replayed_states = [state for _, state in self.replayed_states]
+        return {
+            'log': self.path,
+            'speed': 'fast' if self.clock.fast else self.clock.speed,
+            'recorded_seconds': self.last_time - self.first_time,
+            'wall_seconds': _time.monotonic() - self.wall_start if self.wall_start else 0.0,
+            'telemetry_samples': self.telemetry_samples,
+            'imu_samples': self.imu_samples,
+            'max_pose_error_m': self.max_pose_error,
+            'max_heading_error_deg': self.max_heading_error,
+            'states': {'recorded': recorded_states, 'replayed': replayed_states, 'match': recorded_states == replayed_states},
+            'automation_commands': {'recorded': len(self.recorded_commands), 'replayed': len(self.replayed_commands),
+                                    'decisions': len(recorded), 'first_divergence': divergence},
+            'qr_detections': [{'time': t, 'data': data} for t, data in self.qr_detections],
+            'handoff_timeouts': self.clock.handoff_timeouts,
+        }
+
+    def diverged(self):
+        report = self.report or self.build_report()
+        return not report['states']['match'] or report['automation_commands']['first_divergence'] is not None
+
+    def status(self):
+        """For /replay: progress while playing, the report once finished."""
+        if self.report is not None:
+            return dict(self.report, finished=True)
+        return {'finished': False, 'log': self.path, 'time': self.clock.time(), 'elapsed_recorded_seconds': self.clock.time() - self.first_time,
+                'telemetry_samples': self.telemetry_samples, 'qr_detections': len(self.qr_detections)}
+
+
+def _decisions(commands):
+    """Collapses runs of the same command (one per 50 ms loop tick) into [first time, command, speed, repeats]."""
+    decisions = []
+    for t, command, speed in commands:
+        if decisions and decisions[-1][1:3] == [command, round(speed, 1)]:
+            decisions[-1][3] += 1
+        else:
+            decisions.append([t, command, round(speed, 1), 1])
+    return decisions
+
+
+def _decision_dict(decision):
+    if decision is None:
+        return None
+    t, command, speed, repeats = decision
+    return {'time': t, 'command': command, 'speed': speed, 'repeats': repeats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded mission through app.py without hardware.")
+    parser.add_argument('path', help="A .rfr file or a folder of them")
+    parser.add_argument('--speed', type=float, default=0.0, help="0 = as fast as possible (default), 1 = real time")
+    parser.add_argument('--report', default='', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    os.environ[REPLAY_ENV] = args.path
+    os.environ[REPLAY_SPEED_ENV] = str(args.speed)
+    import app # Reads the environment at import: serial, camera and clock come from the log
+    app.start_services()
+    try:
+        while not app.replay.finished.wait(timeout=1.0):
+            pass
+    except KeyboardInterrupt:
+        print("\n[Replay] Interrupted.")
+        app.replay._finish()
+    finally:
+        app.stop_services()
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(app.replay.report, f, indent=2)
+    sys.exit(1 if app.replay.diverged() else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# rover_logging.py
+# Logging setup for the rover: one logger per subsystem ("rover.encoder", "rover.hardware", ...),
+# per-subsystem levels, sampling and rate limits, and a queue handler so that the
+# timing-critical threads never block on terminal or journald I/O.
+
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT_LOGGER_NAME = "rover"
+LOG_QUEUE_SIZE = 10000 # Records waiting for the writer thread; extra records are dropped, never waited on
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(subsystem)s] %(message)s"
+
+# Per-subsystem levels can be overridden with e.g. ROVER_LOG_LEVELS="encoder=DEBUG,hardware=WARNING"
+LOG_LEVELS_ENV = "ROVER_LOG_LEVELS"
+
+_listener = None # QueueListener doing the actual writes (started by setup_logging)
+
+
+def get_logger(subsystem):
+    """Returns the logger for one subsystem, e.g. get_logger('encoder') -> 'rover.encoder'."""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{subsystem}")
+
+
+class SubsystemFilter(logging.Filter):
+    """Adds a short 'subsystem' attribute ('encoder' for 'rover.encoder') used by LOG_FORMAT."""
+    def filter(self, record):
+        name = record.name
+        record.subsystem = name[len(ROOT_LOGGER_NAME) + 1:] if name.startswith(ROOT_LOGGER_NAME + ".") else name
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=5.0, burst=10):
+        """
+        Token-bucket limit per message template, so a repeated error doesn't flood the log.
+        :param rate: Records per second allowed for each distinct message template.
+        :param burst: Records allowed in a burst before the rate applies.
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {} # (logger name, msg template) -> [tokens, last_time, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) > 1000: # f-string messages never repeat; don't grow forever
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, every_n):
+        """Lets through one DEBUG record in every_n (per message template). Higher levels always pass."""
+        super().__init__()
+        self.every_n = max(1, int(every_n))
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if len(self._counts) > 1000:
+            self._counts.clear()
+        count = self._counts.get(record.msg, 0)
+        self._counts[record.msg] = count + 1
+        return count % self.every_n == 0
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking the caller."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread, not in the (timing-critical) caller
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(spec):
+    """Parses 'encoder=DEBUG,hardware=WARNING' into {'encoder': 10, 'hardware': 30}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        level_value = logging.getLevelName(level.strip().upper())
+        if isinstance(level_value, int):
+            levels[name.strip()] = level_value
+    return levels
+
+
+def setup_logging(default_level=logging.INFO, levels=None, sample=None, rate_limit=None, stream=None):
+    """
+    Configures the 'rover' logger tree. Safe to call once at startup.
+    :param default_level: Level for subsystems without an explicit level.
+    :param levels: Dict of subsystem -> level (the ROVER_LOG_LEVELS env var overrides it).
+    :param sample: Dict of subsystem -> N, keeping one DEBUG record in N for that subsystem.
+    :param rate_limit: Dict of subsystem -> records/second allowed per message template.
+    :param stream: Output stream (stdout by default; journald picks it up under systemd).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    levels = dict(levels or {})
+    levels.update(parse_levels(os.environ.get(LOG_LEVELS_ENV)))
+
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(default_level)
+    root.propagate = False # Don't also write through the root logger (and block there)
+
+    for subsystem, level in levels.items():
+        get_logger(subsystem).setLevel(level)
+    for subsystem, every_n in (sample or {}).items():
+        get_logger(subsystem).addFilter(SampleFilter(every_n))
+    for subsystem, rate in (rate_limit or {}).items():
+        get_logger(subsystem).addFilter(RateLimitFilter(rate=rate))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.addFilter(SubsystemFilter())
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flushes the queued records (call on exit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
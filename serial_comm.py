@@ -3,8 +3,17 @@ import serial
 import time
 
 class ArduinoSerialComm:
-    def __init__(self, port, baud_rate):
+    def __init__(self, port, baud_rate, auto_connect=True):
         self.ser = None # Initialize to None
+        self.port = port
+        self.baud_rate = baud_rate
+        # --- NEW: auto_connect=False defers the (slow) open + Arduino reset wait to connect() ---
+        if auto_connect:
+            self.connect()
+
+    def connect(self):
+        """Opens the serial port and waits for the Arduino to reset. Returns True on success."""
+        port, baud_rate = self.port, self.baud_rate
         try:
             # Open the serial port with a timeout
             self.ser = serial.Serial(port, baud_rate, timeout=1) 
@@ -18,6 +27,7 @@ class ArduinoSerialComm:
             print(f"ERROR: Could not open serial port {port}: {e}")
             print(f"Please check: 1. Is Osoyoo Mega connected? 2. Is {port} correct? 3. Are permissions set (sudo usermod -a -G dialout $USER and reboot)?")
             self.ser = None # Ensure ser is None if connection fails
+        return self.ser is not None
 
     def send_command(self, command_str):
         # Check if serial port is open before attempting to write
@@ -1,10 +1,11 @@
 # servo_cam.py
 
-import board
-import busio
-import adafruit_pca9685
 import time
 
+import metrics
+
+SERVO_COMMANDS = metrics.counter('rover_servo_commands_total', 'Camera servo angle commands sent to the PCA9685')
+
 # --- Camera Tilt Servo PCA9685 Configuration ---
 # IMPORTANT: Adjust to your servo's PCA9685 board's I2C address!
 SERVO_CAM_PCA_ADDRESS = 0x40 # Example: Address for the PCA9685 controlling the camera servo
@@ -21,8 +22,10 @@ class CameraServoController:
     def __init__(self, i2c_bus, pca_address, servo_channel):
         self.pca = None
         self.servo_channel = servo_channel
+        self.last_move_time = 0.0 # time.monotonic() of the last set_angle(); the QR gate treats the view as moving after it
 
         try:
+            import adafruit_pca9685 # Imported here so importing this module stays cheap
             # Create PCA9685 object for the camera servo board
             self.pca = adafruit_pca9685.PCA9685(i2c_bus, address=pca_address)
             self.pca.frequency = 50 # Set PWM frequency to 50 Hz
@@ -46,6 +49,8 @@ class CameraServoController:
         
         # Set the servo's PWM duty cycle on its assigned channel
         self.pca.channels[self.servo_channel].duty_cycle = int(value)
+        self.last_move_time = time.monotonic()
+        SERVO_COMMANDS.inc()
         print(f"[CameraServo] Tilt set to {angle_degrees} degrees (Channel {self.servo_channel})")
         time.sleep(0.1) # Give servo time to move (adjust as needed)
 
@@ -59,6 +64,8 @@ class CameraServoController:
 if __name__ == "__main__":
     # This block requires I2C to be enabled and PCA9685 connected at 0x41 (or 0x40 if no motor board)
     print("Running independent Camera Servo Test...")
+    import board
+    import busio
     
     # Initialize I2C bus here for independent test
     try:
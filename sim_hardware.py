@@ -0,0 +1,218 @@
+# sim_hardware.py - Simulated hardware backend
+# Stand-ins for the motors (hardware.py), the Arduino serial link (serial_comm.py),
+# the camera (cv2.VideoCapture), the camera servo (servo_cam.py) and the IMU (imu.py), so app.py can
+# run on a laptop or CI box. Enable with ROVER_SIM=1.
+
+import glob
+import math
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+SIM_ENV = "ROVER_SIM"
+SIM_CLOCK_PATTERN_ENV = "ROVER_SIM_CLOCK_PATTERN" # 1: frames show latency_test.py's timestamp pattern
+SIM_MAX_RPM = 120.0       # Wheel RPM at 100% PWM
+SIM_SERIAL_RATE_HZ = 100  # Encoder lines per second, like the Arduino
+SIM_CAMERA_FPS = 30
+SIM_FRAME_SIZE = (640, 480)
+
+
+def sim_enabled():
+    return os.environ.get(SIM_ENV) == '1'
+
+
+class SimMotors:
+    """Drop-in replacement for the motor functions in hardware.py. Tracks the commanded wheel speeds."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.left = 0.0  # Signed speed in % (-100..100)
+        self.right = 0.0
+        self.commands = 0
+        self.last_command_time = None
+
+    def _set(self, left, right):
+        with self.lock:
+            self.left, self.right = left, right
+            self.commands += 1
+            self.last_command_time = time.time()
+
+    def init(self):
+        return True
+
+    def forward(self, speed):
+        self._set(speed, speed)
+
+    def backward(self, speed):
+        self._set(-speed, -speed)
+
+    def turn_left(self, speed):
+        self._set(-speed, speed)
+
+    def turn_right(self, speed):
+        self._set(speed, -speed)
+
+    def stop(self):
+        self._set(0.0, 0.0)
+
+    def motors_active(self):
+        return self.left != 0 or self.right != 0
+
+    def wheel_rpm(self):
+        with self.lock:
+            return self.left / 100.0 * SIM_MAX_RPM, self.right / 100.0 * SIM_MAX_RPM
+
+
+class _SimPort:
+    is_open = True # Mimics serial.Serial enough for the encoder thread's checks
+
+
+class SimSerial:
+    """ArduinoSerialComm replacement that produces 'yaw,pitch,roll,rpm1,speed1,rpm2,speed2' lines."""
+    def __init__(self, motors, rate_hz=SIM_SERIAL_RATE_HZ, track_width_m=0.23, wheel_diameter_m=0.134):
+        self.motors = motors
+        self.period = 1.0 / rate_hz
+        self.track_width = track_width_m
+        self.wheel_circumference = math.pi * wheel_diameter_m
+        self.ser = None
+        self.yaw_deg = 0.0
+        self._next_time = None
+
+    def connect(self):
+        self.ser = _SimPort()
+        self._next_time = time.time()
+        return True
+
+    def read_data(self):
+        if self.ser is None:
+            return None
+        now = time.time()
+        if now < self._next_time:
+            time.sleep(self._next_time - now) # Paced like the Arduino's Serial.println loop
+        self._next_time += self.period
+        rpm_l, rpm_r = self.motors.wheel_rpm()
+        speed_l = rpm_l * self.wheel_circumference / 60.0 # m/s
+        speed_r = rpm_r * self.wheel_circumference / 60.0
+        self.yaw_deg += math.degrees((speed_r - speed_l) / self.track_width * self.period)
+        self.yaw_deg = (self.yaw_deg + 180.0) % 360.0 - 180.0
+        return (f"{self.yaw_deg:.2f},0.00,0.00,{rpm_l:.2f},{speed_l * 100:.2f},"
+                f"{rpm_r:.2f},{speed_r * 100:.2f}")
+
+    def send_command(self, command_str):
+        pass
+
+    def close(self):
+        self.ser = None
+
+
+class SimImu:
+    """BNO08x stand-in for imu.ImuReader: heading integrated from the commanded wheel speeds."""
+    def __init__(self, motors, track_width_m=0.23, wheel_diameter_m=0.134):
+        self.motors = motors
+        self.track_width = track_width_m
+        self.wheel_circumference = math.pi * wheel_diameter_m
+        self.yaw = 0.0 # radians
+        self.yaw_rate = 0.0
+        self._last_time = time.time()
+
+    def _step(self):
+        now = time.time()
+        rpm_l, rpm_r = self.motors.wheel_rpm()
+        self.yaw_rate = (rpm_r - rpm_l) * self.wheel_circumference / 60.0 / self.track_width
+        self.yaw = (self.yaw + self.yaw_rate * (now - self._last_time) + math.pi) % (2 * math.pi) - math.pi
+        self._last_time = now
+
+    @property
+    def quaternion(self):
+        self._step()
+        return (0.0, 0.0, math.sin(self.yaw / 2), math.cos(self.yaw / 2))
+
+    @property
+    def gyro(self):
+        return (0.0, 0.0, self.yaw_rate)
+
+
+class SimCamera:
+    """cv2.VideoCapture replacement producing synthetic frames at a fixed rate.
+       Frames cycle through the repo's QR captures so the QR pipeline has real work to do.
+    """
+    def __init__(self, fps=SIM_CAMERA_FPS, size=SIM_FRAME_SIZE, image_glob='static/qr_*.jpg'):
+        self.period = 1.0 / fps
+        self.width, self.height = size
+        self.lock = threading.Lock()
+        self.opened = True
+        self.frame_index = 0
+        self.convert_rgb = True # False (CAP_PROP_CONVERT_RGB=0) returns JPEG bytes, like a UVC camera in MJPG mode
+        self.clock_pattern = os.environ.get(SIM_CLOCK_PATTERN_ENV) == '1'
+        self._next_time = time.time()
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.backgrounds = []
+        for path in sorted(glob.glob(os.path.join(base_dir, image_glob))):
+            img = cv2.imread(path)
+            if img is not None:
+                self.backgrounds.append(cv2.resize(img, (self.width, self.height)))
+        if not self.backgrounds:
+            self.backgrounds.append(np.full((self.height, self.width, 3), 64, dtype=np.uint8))
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = bool(value)
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return 1.0 / self.period
+        return 0.0
+
+    def read(self):
+        with self.lock: # Concurrent readers share the frame rate, like a real camera
+            now = time.time()
+            if now < self._next_time:
+                time.sleep(self._next_time - now)
+            self._next_time = max(self._next_time + self.period, time.time())
+            index = self.frame_index
+            self.frame_index += 1
+        background = self.backgrounds[(index // SIM_CAMERA_FPS) % len(self.backgrounds)] # New image every second
+        frame = background.copy()
+        x = (index * 8) % self.width # Moving bar so consecutive frames differ
+        frame[:, x:x + 4] = (0, 0, 255)
+        cv2.putText(frame, f"SIM {index}", (10, self.height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        if self.clock_pattern: # As if the camera were filming latency_test.py's window
+            from latency_test import draw_pattern
+            draw_pattern(frame, time.time())
+        if not self.convert_rgb:
+            _, buffer = cv2.imencode('.jpg', frame) # Stands in for the camera's hardware encoder
+            return True, buffer.reshape(1, -1)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+class SimServo:
+    """CameraServoController replacement."""
+    def __init__(self):
+        self.pca = True # Checked by app.py to decide whether the servo is usable
+        self.angle = 90
+        self.last_move_time = 0.0
+
+    def set_angle(self, angle_degrees):
+        self.angle = max(0, min(180, angle_degrees))
+        self.last_move_time = time.monotonic()
+        time.sleep(0.02)
+
+    def cleanup(self):
+        pass
+
+
+# --- Shared simulated motors (the serial simulator reads their state) ---
+sim_motors = SimMotors()
@@ -0,0 +1,171 @@
+# spatial_index.py - Where QR codes were seen
+# qr.py de-duplicates detections by payload only, so nothing can answer "which codes are within 2 m of
+# here?" or "have we already been here?". QrSpatialIndex keeps one entry per sighting position (taken
+# from odometry when the code was decoded) in a uniform grid of square buckets. Adding is O(1); a radius
+# or nearest query only looks at the buckets around the point and measures the candidates with numpy,
+# so queries stay well under a millisecond with tens of thousands of entries.
+
+import math
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+BUCKET_M = 1.0    # Grid bucket size; about the radius of typical queries
+MIN_SPACING_M = 0.25 # The same code seen again closer than this to its last entry is not a new entry
+MAX_RING_BUCKETS = 400 # Queries walk rings of buckets up to this many, then measure every entry instead
+
+QR_INDEX_ENTRIES = metrics.gauge('rover_qr_index_entries', 'QR sightings in the spatial index')
+QR_INDEX_QUERY_SECONDS = metrics.histogram('rover_qr_index_query_seconds', 'Spatial index radius / nearest query time',
+                                           buckets=(1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2))
+
+
+class QrSpatialIndex:
+    """
+    Uniform-grid index of QR sightings.
+
+    :param bucket_m: Grid bucket size in meters.
+    :param min_spacing_m: Minimum distance between two entries for the same payload.
+    """
+    def __init__(self, bucket_m=BUCKET_M, min_spacing_m=MIN_SPACING_M):
+        self.bucket_m = bucket_m
+        self.min_spacing_m = min_spacing_m
+        self.lock = threading.Lock()
+        self.xs = np.empty(1024) # Entry coordinates by entry id; doubled when full
+        self.ys = np.empty(1024)
+        self.data = []           # Payload by entry id
+        self.times = []
+        self.buckets = {}        # (i, j) -> list of entry ids
+        self.last_entry = {}     # payload -> entry id of its newest entry
+
+    def __len__(self):
+        return len(self.data)
+
+    def _bucket(self, x, y):
+        return math.floor(x / self.bucket_m), math.floor(y / self.bucket_m)
+
+    def add(self, data, x, y, timestamp=None):
+        """Records a sighting of data at (x, y). Returns the new entry id, or None if it repeats the last entry for data."""
+        with self.lock:
+            last = self.last_entry.get(data)
+            if last is not None and math.hypot(x - self.xs[last], y - self.ys[last]) < self.min_spacing_m:
+                return None
+            entry = len(self.data)
+            if entry == len(self.xs):
+                self.xs = np.concatenate([self.xs, np.empty(len(self.xs))])
+                self.ys = np.concatenate([self.ys, np.empty(len(self.ys))])
+            self.xs[entry], self.ys[entry] = x, y
+            self.data.append(data)
+            self.times.append(time.time() if timestamp is None else timestamp)
+            self.buckets.setdefault(self._bucket(x, y), []).append(entry)
+            self.last_entry[data] = entry
+        QR_INDEX_ENTRIES.set(entry + 1)
+        return entry
+
+    def _candidates(self, i0, j0, ring):
+        """Entry ids in the buckets exactly ring steps (Chebyshev) from (i0, j0). Lock held."""
+        if ring == 0:
+            return list(self.buckets.get((i0, j0), ()))
+        ids = []
+        for i in range(i0 - ring, i0 + ring + 1):
+            for j in (j0 - ring, j0 + ring):
+                ids.extend(self.buckets.get((i, j), ()))
+        for j in range(j0 - ring + 1, j0 + ring):
+            for i in (i0 - ring, i0 + ring):
+                ids.extend(self.buckets.get((i, j), ()))
+        return ids
+
+    def _entries(self, ids, distances):
+        return [{'data': self.data[i], 'x': float(self.xs[i]), 'y': float(self.ys[i]), 't': self.times[i],
+                 'distance': round(float(d), 3)} for i, d in zip(ids, distances)]
+
+    def within(self, x, y, radius, data=None, limit=None):
+        """Entries within radius of (x, y), nearest first (at most limit). data: only entries for this payload."""
+        query_start = time.perf_counter()
+        with self.lock:
+            i0, j0 = self._bucket(x, y)
+            rings = int(math.ceil(radius / self.bucket_m))
+            if (2 * rings + 1) ** 2 >= min(len(self.buckets), MAX_RING_BUCKETS):
+                ids = np.arange(len(self.data)) # A radius this large: measure every entry instead
+            else:
+                ids = []
+                for ring in range(rings + 1):
+                    ids.extend(self._candidates(i0, j0, ring))
+                ids = np.array(ids, dtype=np.int64)
+            if data is not None:
+                ids = np.array([i for i in ids.tolist() if self.data[i] == data], dtype=np.int64)
+            distances = np.hypot(self.xs[ids] - x, self.ys[ids] - y)
+            keep = distances <= radius
+            ids, distances = ids[keep], distances[keep]
+            if limit is not None and len(ids) > limit: # Partial sort: only the nearest limit get ordered
+                nearest = np.argpartition(distances, limit - 1)[:limit] if limit > 0 else np.arange(0)
+                ids, distances = ids[nearest], distances[nearest]
+            order = np.argsort(distances, kind='stable')
+            result = self._entries(ids[order], distances[order])
+        QR_INDEX_QUERY_SECONDS.observe_since(query_start)
+        return result
+
+    def _pick(self, ids, x, y, k, max_radius, exclude):
+        """The k nearest of ids with distinct payloads (not in exclude): (ids, distances). Lock held."""
+        distances = np.hypot(self.xs[ids] - x, self.ys[ids] - y)
+        found, seen = [], set(exclude)
+        for n in np.argsort(distances, kind='stable').tolist():
+            if (max_radius is not None and distances[n] > max_radius) or len(found) == k:
+                break
+            if self.data[ids[n]] not in seen:
+                seen.add(self.data[ids[n]])
+                found.append(n)
+        return ids[found], distances[found]
+
+    def nearest(self, x, y, k=1, max_radius=None, exclude=()):
+        """The k nearest entries to (x, y), at most one per payload, skipping payloads in exclude."""
+        query_start = time.perf_counter()
+        with self.lock:
+            i0, j0 = self._bucket(x, y)
+            ids = []
+            ring = 0
+            while True:
+                if (2 * ring + 1) ** 2 >= min(len(self.buckets), MAX_RING_BUCKETS):
+                    # Far from everything (or few buckets): cheaper to measure all entries than to walk more rings
+                    found = self._nearest_all(x, y, k, max_radius, exclude)
+                    break
+                new_ids = self._candidates(i0, j0, ring)
+                if new_ids or ring == 0:
+                    ids.extend(new_ids)
+                    found = self._pick(np.array(ids, dtype=np.int64), x, y, k, max_radius, exclude)
+                # Anything beyond this ring is at least ring * bucket_m away
+                if len(found[0]) == k and found[1][-1] <= ring * self.bucket_m:
+                    break
+                if max_radius is not None and ring * self.bucket_m >= max_radius:
+                    break
+                ring += 1
+            result = self._entries(*found)
+        QR_INDEX_QUERY_SECONDS.observe_since(query_start)
+        return result
+
+    def _nearest_all(self, x, y, k, max_radius, exclude):
+        """nearest() over every entry: partial sort of the closest m, growing m until k payloads are distinct. Lock held."""
+        count = len(self.data)
+        dx, dy = self.xs[:count] - x, self.ys[:count] - y
+        distances = dx * dx + dy * dy # Squared: same order, no sqrt over every entry
+        m = min(count, 4 * k)
+        while True:
+            closest = np.argpartition(distances, m - 1)[:m] if m < count else np.arange(count)
+            found = self._pick(closest, x, y, k, max_radius, exclude)
+            if len(found[0]) == k or m == count:
+                return found
+            m = min(count, m * 4)
+
+    def visited(self, x, y, radius):
+        """True if any code was seen within radius of (x, y): the area has been covered already."""
+        return bool(self.within(x, y, radius, limit=1))
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.times.clear()
+            self.buckets.clear()
+            self.last_entry.clear()
+        QR_INDEX_ENTRIES.set(0)
@@ -11,8 +11,68 @@ let currentDirectionInput = 0; // NEW: Default 0 degrees
 
 let scanModeActive = false;
 
+// --- NEW: Teleop WebSocket (see teleop.py) ---
+// One persistent connection for drive, speed and servo commands. Every message carries an increasing seq so the
+// server never applies an older command after a newer one; acks report the server-side latency. Telemetry comes
+// back on the same socket. Without it (server lacks WebSocket support, or the link dropped) the HTTP routes are used.
+let teleopSocket = null;
+let teleopSeq = 0;
+const TELEOP_PING_MS = 250; // Keeps the server's dead-man timer happy while a drive button is held
+
+function teleopOpen() {
+    return teleopSocket !== null && teleopSocket.readyState === WebSocket.OPEN;
+}
+
+function connectTeleop() {
+    const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + window.location.host + '/ws/teleop');
+    socket.onopen = () => {
+        teleopSocket = socket;
+        teleopSeq = 0; // seq is per connection
+        console.log('Teleop WebSocket connected.');
+    };
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'telemetry') {
+            showEncoderData(message);
+            showPoseData(Object.assign({ distance: Math.hypot(message.x, message.y) }, message));
+        } else if (message.type === 'ack') {
+            const roundTrip = message.t !== undefined ? (performance.now() - message.t).toFixed(1) : '?';
+            console.log(`Teleop ack #${message.seq}: ${message.status} (server ${message.latency_ms} ms, round trip ${roundTrip} ms)`);
+        }
+    };
+    socket.onclose = () => {
+        if (teleopSocket === socket) {
+            console.log('Teleop WebSocket closed; using HTTP until it reconnects.');
+        }
+        teleopSocket = null;
+        setTimeout(connectTeleop, 2000);
+    };
+}
+
+function teleopSend(type, fields) {
+    if (!teleopOpen()) {
+        return false;
+    }
+    teleopSeq += 1;
+    teleopSocket.send(JSON.stringify(Object.assign({ seq: teleopSeq, type: type, t: performance.now() }, fields)));
+    return true;
+}
+
+if ('WebSocket' in window) {
+    connectTeleop();
+    setInterval(() => {
+        if (teleopOpen()) {
+            teleopSocket.send(JSON.stringify({ type: 'ping', t: performance.now() }));
+        }
+    }, TELEOP_PING_MS);
+}
+
 // --- Core Communication Functions ---
 function sendCommand(command) {
+    if (teleopSend('command', { command: command })) {
+        return;
+    }
     fetch('/send_command', {
         method: 'POST',
         headers: {
@@ -30,6 +90,9 @@ function sendCommand(command) {
 }
 
 function sendAngle(angle) {
+    if (teleopSend('servo', { angle: angle })) {
+        return;
+    }
     fetch('/send_angle', { 
         method: 'POST',
         headers: {
@@ -50,6 +113,9 @@ function sendAngle(angle) {
 }
 
 function sendGlobalSpeed(speed) {
+    if (teleopSend('speed', { speed: speed })) {
+        return;
+    }
     fetch('/set_global_speed', { 
         method: 'POST',
         headers: {
@@ -135,17 +201,22 @@ function takePhoto() {
 
 
 // --- Function to fetch and display encoder data ---
+function showEncoderData(data) {
+    document.getElementById('rpm1').textContent = data.rpm1.toFixed(2);
+    document.getElementById('speed1').textContent = data.speed1.toFixed(2);
+    document.getElementById('rpm2').textContent = data.rpm2.toFixed(2);
+    document.getElementById('speed2').textContent = data.speed2.toFixed(2);
+    document.getElementById('imuPitch').textContent = data.pitch.toFixed(2); 
+    document.getElementById('imuRoll').textContent = data.roll.toFixed(2); 
+}
+
 function fetchEncoderData() {
+    if (teleopOpen()) { // NEW: Pushed over the teleop socket instead
+        return;
+    }
     fetch('/get_encoder_data') 
         .then(response => response.json())
-        .then(data => {
-            document.getElementById('rpm1').textContent = data.rpm1.toFixed(2);
-            document.getElementById('speed1').textContent = data.speed1.toFixed(2);
-            document.getElementById('rpm2').textContent = data.rpm2.toFixed(2);
-            document.getElementById('speed2').textContent = data.speed2.toFixed(2);
-            document.getElementById('imuPitch').textContent = data.pitch.toFixed(2); 
-            document.getElementById('imuRoll').textContent = data.roll.toFixed(2); 
-        })
+        .then(showEncoderData)
         .catch(error => { 
             console.error('Error fetching encoder data:', error);
             document.getElementById('rpm1').textContent = 'N/A';
@@ -158,15 +229,20 @@ function fetchEncoderData() {
 }
 
 // --- Function to fetch and display odometry pose data ---
+function showPoseData(data) {
+    document.getElementById('poseX').textContent = data.x.toFixed(3);
+    document.getElementById('poseY').textContent = data.y.toFixed(3);
+    document.getElementById('poseTheta').textContent = data.theta.toFixed(1);
+    document.getElementById('absDistance').textContent = data.distance.toFixed(3); 
+}
+
 function fetchPoseData() {
+    if (teleopOpen()) {
+        return;
+    }
     fetch('/get_pose') 
         .then(response => response.json())
-        .then(data => {
-            document.getElementById('poseX').textContent = data.x.toFixed(3);
-            document.getElementById('poseY').textContent = data.y.toFixed(3);
-            document.getElementById('poseTheta').textContent = data.theta.toFixed(1);
-            document.getElementById('absDistance').textContent = data.distance.toFixed(3); 
-        })
+        .then(showPoseData)
         .catch(error => {
             console.error('Error fetching pose data:', error);
             document.getElementById('poseX').textContent = 'N/A';
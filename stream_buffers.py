@@ -0,0 +1,126 @@
+# stream_buffers.py
+# Shared "latest value" buffers between the producers (camera capture thread, encoder thread)
+# and any number of streaming clients. Producers publish once; threaded clients (Flask) block on
+# a Condition and asyncio clients (ASGI) await an Event, so a client costs no extra camera reads
+# and, in async mode, no thread.
+
+import asyncio
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+JPEG_DECODE_SECONDS = metrics.histogram('rover_jpeg_decode_seconds', 'Lazy JPEG -> BGR decodes of passthrough frames')
+
+
+class _Broadcast:
+    """Sequence-numbered latest-value slot with threaded and asyncio waiters."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.seq = 0 # Incremented on every publish
+        self.timestamp = None
+        self._async_waiters = set() # (loop, asyncio.Event) pairs
+
+    def _notify(self):
+        # Called with self.condition held
+        self.seq += 1
+        self.timestamp = time.time()
+        self.condition.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def wait_for_new(self, last_seq, timeout=None):
+        """Blocks until something newer than last_seq is published. Returns the new seq (or last_seq on timeout)."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq
+
+    async def wait_for_new_async(self, last_seq, timeout=None):
+        """asyncio version of wait_for_new(); does not use a thread."""
+        if self.seq != last_seq:
+            return self.seq
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        with self.condition:
+            self._async_waiters.add(waiter)
+        try:
+            if self.seq == last_seq: # Re-check after registering to avoid missing a publish
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self._async_waiters.discard(waiter)
+        return self.seq
+
+    def client_count(self):
+        return len(self._async_waiters)
+
+
+class FrameBuffer(_Broadcast):
+    """Latest camera frame: the BGR image (for QR, photos, panorama) and its JPEG bytes (for streaming).
+       In JPEG passthrough mode only the bytes are published; the BGR image is decoded on first use.
+    """
+    def __init__(self):
+        super().__init__()
+        self.frame = None
+        self.jpeg = None
+        self._decode_lock = threading.Lock()
+        self._decoded_seq = None
+        self._decoded = None
+
+    def publish(self, frame, jpeg):
+        """frame may be None (passthrough): get_frame()/decode() will decode jpeg if someone needs it."""
+        with self.condition:
+            self.frame = frame
+            self.jpeg = jpeg
+            self._notify()
+
+    def get(self):
+        """Returns (seq, frame, jpeg, timestamp) without waiting. frame is None for passthrough frames."""
+        with self.condition:
+            return self.seq, self.frame, self.jpeg, self.timestamp
+
+    def get_frame(self):
+        """Returns (seq, BGR frame) for the latest frame, decoding it at most once per frame."""
+        seq, frame, jpeg, _ = self.get()
+        if frame is None and jpeg is not None:
+            frame = self.decode(seq, jpeg)
+        return seq, frame
+
+    def decode(self, seq, jpeg):
+        """Decodes frame seq's JPEG, sharing the result with every other caller asking for the same frame."""
+        with self._decode_lock:
+            if self._decoded_seq == seq:
+                return self._decoded
+            start = time.perf_counter()
+            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            JPEG_DECODE_SECONDS.observe_since(start)
+            if self._decoded_seq is None or seq > self._decoded_seq:
+                self._decoded_seq, self._decoded = seq, frame
+            return frame
+
+
+class TelemetryBuffer(_Broadcast):
+    """Latest telemetry sample (encoder data + pose) as a dict."""
+    def __init__(self):
+        super().__init__()
+        self.sample = {}
+
+    def publish(self, sample):
+        with self.condition:
+            self.sample = sample
+            self._notify()
+
+    def get(self):
+        """Returns (seq, sample, timestamp) without waiting."""
+        with self.condition:
+            return self.seq, self.sample, self.timestamp
+
+
+def mjpeg_part(jpeg_bytes):
+    """Wraps one JPEG in the multipart/x-mixed-replace framing used by /mjpeg."""
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\r\n'
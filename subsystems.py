@@ -0,0 +1,118 @@
+# subsystems.py
+# Starts slow hardware (camera, serial, GPIO, I2C) in parallel background threads
+# and keeps track of each subsystem's readiness for the /health endpoint.
+
+import threading
+import time
+
+# --- Subsystem States ---
+PENDING = "PENDING"   # Registered, not started yet
+STARTING = "STARTING" # Init function is running
+READY = "READY"       # Init function returned successfully
+FAILED = "FAILED"     # Init function raised or returned None
+
+
+class Subsystem:
+    def __init__(self, name, init_func, on_ready=None):
+        """
+        Holds one subsystem and its readiness state.
+        :param name: Name shown in /health (e.g. 'camera', 'serial').
+        :param init_func: Callable that opens the device and returns the object to share (None means failure).
+        :param on_ready: Optional callable run with the returned object once it is ready.
+        """
+        self.name = name
+        self.init_func = init_func
+        self.on_ready = on_ready
+        self.state = PENDING
+        self.value = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.ready_event = threading.Event() # Set when the subsystem leaves STARTING (ready or failed)
+
+    def run(self):
+        self.state = STARTING
+        self.started_at = time.time()
+        try:
+            value = self.init_func()
+            if value is None:
+                raise RuntimeError("initialization returned nothing")
+            self.value = value
+            self.state = READY
+            if self.on_ready:
+                self.on_ready(value)
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            print(f"[Subsystems] '{self.name}' failed to start: {e}")
+        finally:
+            self.finished_at = time.time()
+            self.ready_event.set()
+        if self.state == READY:
+            print(f"[Subsystems] '{self.name}' ready in {self.finished_at - self.started_at:.2f}s.")
+
+    def to_dict(self):
+        info = {'state': self.state}
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.time()
+            info['init_seconds'] = round(end - self.started_at, 3)
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class SubsystemRegistry:
+    def __init__(self):
+        self.subsystems = {} # name -> Subsystem, in registration order
+        self.created_at = time.time()
+
+    def register(self, name, init_func, on_ready=None):
+        """Registers a subsystem. Nothing is opened until start() or start_all() is called."""
+        self.subsystems[name] = Subsystem(name, init_func, on_ready)
+        return self.subsystems[name]
+
+    def start(self, name):
+        """Starts one subsystem in its own daemon thread (no-op if already started)."""
+        subsystem = self.subsystems[name]
+        if subsystem.state != PENDING:
+            return
+        subsystem.state = STARTING
+        threading.Thread(target=subsystem.run, name=f"init-{name}", daemon=True).start()
+
+    def start_all(self):
+        """Starts every registered subsystem in parallel so slow devices don't hold each other up."""
+        for name in self.subsystems:
+            self.start(name)
+
+    def get(self, name):
+        """Returns the subsystem's object if it is ready, otherwise None (never blocks)."""
+        subsystem = self.subsystems.get(name)
+        if subsystem is None or subsystem.state != READY:
+            return None
+        return subsystem.value
+
+    def wait(self, name, timeout=None):
+        """Blocks until the subsystem is ready or failed. Returns its object, or None."""
+        subsystem = self.subsystems.get(name)
+        if subsystem is None:
+            return None
+        subsystem.ready_event.wait(timeout)
+        return self.get(name)
+
+    def is_ready(self, name):
+        return self.get(name) is not None
+
+    def status(self):
+        """Returns a dict suitable for the /health endpoint."""
+        states = {name: s.to_dict() for name, s in self.subsystems.items()}
+        if all(s.state == READY for s in self.subsystems.values()):
+            overall = "ok"
+        elif any(s.state in (PENDING, STARTING) for s in self.subsystems.values()):
+            overall = "starting"
+        else:
+            overall = "degraded"
+        return {
+            'status': overall,
+            'uptime': round(time.time() - self.created_at, 3),
+            'subsystems': states,
+        }
@@ -0,0 +1,165 @@
+# telemetry_history.py - Multi-resolution telemetry history for long charts
+# The API only ever exposed the newest sample, so charting a whole mission meant collecting every
+# sample client-side. TelemetryHistory keeps the recent raw samples plus min / max / mean pyramids
+# over 1 s, 10 s and 60 s buckets, in fixed-size numpy rings. The encoder thread adds each sample to
+# the open 1 s bucket only (element-wise numpy min/max/add over all fields); a bucket that closes is
+# folded into the open 10 s bucket, and so on up. query() picks the level that covers the
+# requested time span with at most a few buckets per chart pixel, then merges those down to one point
+# per pixel: an hour at 100 Hz on a 600 px chart comes from 3,600 1 s buckets, not 360,000 samples.
+
+import math
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+FIELDS = ('rpm1', 'rpm2', 'speed1', 'speed2', 'yaw', 'pitch', 'roll', 'x', 'y', 'theta')
+LEVELS = ((1.0, 7200), (10.0, 8640), (60.0, 10080)) # (bucket seconds, buckets kept): 2 h, 24 h, 7 days
+RAW_CAPACITY = 12000 # Raw samples kept (2 minutes at 100 Hz)
+
+HISTORY_QUERY_SECONDS = metrics.histogram('rover_telemetry_history_query_seconds', 'Telemetry history query time')
+
+
+class _Level:
+    """One pyramid level: a ring of closed buckets plus the open one. Lock held by the caller."""
+    def __init__(self, seconds, capacity, width):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.starts = np.zeros(capacity)
+        self.mins = np.zeros((capacity, width))
+        self.maxs = np.zeros((capacity, width))
+        self.sums = np.zeros((capacity, width))
+        self.counts = np.zeros(capacity)
+        self.written = 0     # Buckets closed so far; the next goes into slot written % capacity
+        self.open = None     # [bucket index, min, max, sum, count] of the bucket being filled
+
+    def add(self, t, lo, hi, total, count):
+        """Folds (min, max, sum, count) at time t into the open bucket. Returns the bucket it closed, if any."""
+        index = math.floor(t / self.seconds)
+        closed = None
+        if self.open is not None and index != self.open[0]:
+            closed = self._close()
+        if self.open is None:
+            self.open = [index, lo.copy(), hi.copy(), total.copy(), count]
+        else:
+            _, open_lo, open_hi, open_sum, _ = self.open
+            np.minimum(open_lo, lo, out=open_lo)
+            np.maximum(open_hi, hi, out=open_hi)
+            np.add(open_sum, total, out=open_sum)
+            self.open[4] += count
+        return closed
+
+    def _close(self):
+        index, lo, hi, total, count = self.open
+        slot = self.written % self.capacity
+        self.starts[slot] = index * self.seconds
+        self.mins[slot], self.maxs[slot], self.sums[slot], self.counts[slot] = lo, hi, total, count
+        self.written += 1
+        self.open = None
+        return index * self.seconds, lo, hi, total, count
+
+    def covers(self, start):
+        """True unless buckets after start were already overwritten (everything since startup is still kept)."""
+        return self.written <= self.capacity or self.starts[self.written % self.capacity] <= start
+
+    def select(self, start, end):
+        """(starts, mins, maxs, sums, counts) of the buckets starting in [start, end), oldest first, open bucket included."""
+        n = min(self.written, self.capacity)
+        order = np.arange(self.written - n, self.written) % self.capacity # Ring slots, oldest first
+        starts = self.starts[order]
+        a, b = np.searchsorted(starts, start), np.searchsorted(starts, end)
+        order = order[a:b]
+        arrays = [self.starts[order], self.mins[order], self.maxs[order], self.sums[order], self.counts[order]]
+        if self.open is not None and start <= self.open[0] * self.seconds < end:
+            index, lo, hi, total, count = self.open
+            extra = (np.array([index * self.seconds]), lo[np.newaxis], hi[np.newaxis], total[np.newaxis], np.array([count]))
+            arrays = [np.concatenate([array, more]) for array, more in zip(arrays, extra)]
+        return arrays
+
+
+class TelemetryHistory:
+    """
+    Raw samples plus min/max/mean pyramids of the telemetry fields.
+
+    :param fields: Sample keys to keep; missing keys are recorded as NaN.
+    :param levels: (bucket seconds, buckets kept) per level, finest first; each must divide the next.
+    :param raw_capacity: Raw samples kept for short spans.
+    """
+    def __init__(self, fields=FIELDS, levels=LEVELS, raw_capacity=RAW_CAPACITY):
+        self.fields = tuple(fields)
+        self.lock = threading.Lock()
+        self.levels = [_Level(seconds, capacity, len(self.fields)) for seconds, capacity in levels]
+        self.raw_times = np.zeros(raw_capacity)
+        self.raw_values = np.zeros((raw_capacity, len(self.fields)))
+        self.raw_written = 0
+
+    def add(self, sample, timestamp):
+        """Records one telemetry sample (dict) taken at timestamp (seconds)."""
+        values = np.array([sample.get(field, np.nan) for field in self.fields], dtype=float)
+        with self.lock:
+            slot = self.raw_written % len(self.raw_times)
+            self.raw_times[slot] = timestamp
+            self.raw_values[slot] = values
+            self.raw_written += 1
+            closed = (timestamp, values, values, values, 1)
+            for level in self.levels: # A closed bucket of one level is a sample of the next
+                closed = level.add(*closed)
+                if closed is None:
+                    break
+
+    def _raw(self, start, end):
+        n = min(self.raw_written, len(self.raw_times))
+        order = np.arange(self.raw_written - n, self.raw_written) % len(self.raw_times)
+        times = self.raw_times[order]
+        order = order[np.searchsorted(times, start):np.searchsorted(times, end)]
+        return self.raw_times[order], self.raw_values[order]
+
+    def query(self, start, end, width=500, fields=None):
+        """
+        Chart data for [start, end): at most width points per field, each the min, max and mean of its slice.
+
+        :param width: Points wanted, normally the chart's width in pixels.
+        :param fields: Field names to return (default: all).
+        :return: Dict with 'resolution' (seconds per point; 0 for raw samples), 't' (start of each point) and
+                 per field {'min': [...], 'max': [...], 'mean': [...]}.
+        """
+        query_start = time.perf_counter()
+        fields = [field for field in (fields or self.fields) if field in self.fields]
+        columns = [self.fields.index(field) for field in fields]
+        width = max(1, int(width))
+        wanted = (end - start) / width # Seconds per point
+        with self.lock:
+            level = None
+            raw_capacity = len(self.raw_times)
+            if wanted < self.levels[0].seconds and (self.raw_written <= raw_capacity or
+                                                    self.raw_times[self.raw_written % raw_capacity] <= start):
+                times, values = self._raw(start, end)
+                starts, lo, hi, total, counts = times, values, values, values, np.ones(len(times))
+            else:
+                # The coarsest level still finer than a point (merged below), among those reaching back to start
+                covering = [level for level in self.levels if level.covers(start)] or self.levels[-1:]
+                finer = [level for level in covering if level.seconds <= wanted]
+                level = finer[-1] if finer else covering[0]
+                starts, lo, hi, total, counts = level.select(start, end)
+        resolution = level.seconds if level is not None else 0.0
+        group = math.ceil(len(starts) / width) if len(starts) > width else 1
+        if group > 1: # More buckets than points: merge runs of buckets
+            edges = np.arange(0, len(starts), group)
+            starts = starts[edges]
+            lo, hi = np.minimum.reduceat(lo, edges), np.maximum.reduceat(hi, edges)
+            total, counts = np.add.reduceat(total, edges), np.add.reduceat(counts, edges)
+            resolution = resolution * group if resolution else (end - start) / width
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = total / counts[:, np.newaxis]
+        result = {'start': start, 'end': end, 'resolution': resolution, 't': np.round(starts, 3).tolist()}
+        for field, column in zip(fields, columns):
+            result[field] = {'min': _to_list(lo[:, column]), 'max': _to_list(hi[:, column]), 'mean': _to_list(means[:, column])}
+        HISTORY_QUERY_SECONDS.observe_since(query_start)
+        return result
+
+
+def _to_list(values):
+    """JSON-ready list: 4 decimals, NaN (field missing from the samples) as None."""
+    return [None if math.isnan(v) else v for v in np.round(values, 4).tolist()]
@@ -0,0 +1,188 @@
+# telemetry_pipeline.py - Staged telemetry processing
+# The encoder thread used to read a line, parse it, rebuild the shared dict, update odometry, the map
+# and the recorder and log, all in one loop: every new consumer made the serial reader slower. Here the
+# work is a chain of stages, source -> stage -> stage -> ... -> subscribers, each stage on its own
+# thread behind a bounded queue. Subscribers (history, recorder, map, ...) get every sample on their
+# own thread and queue, so a slow one only falls behind itself; it never delays the reader or odometry.
+#
+# A full queue drops its oldest item (counted): for telemetry the newest sample is the one that matters,
+# and blocking would back up into the serial port. threaded=False runs the stages inline on the source
+# thread instead (replay needs each line applied before the next one is read).
+#
+# Per stage: rover_telemetry_stage_seconds{stage} and rover_telemetry_stage_items_total{stage,result};
+# rover_telemetry_pipeline_seconds is source read to the end of the last stage.
+
+import queue
+import threading
+import time
+
+import metrics
+from rover_logging import get_logger
+
+log = get_logger('telemetry')
+
+STAGE_QUEUE_SIZE = 64       # Items waiting for a stage
+SUBSCRIBER_QUEUE_SIZE = 256 # Samples waiting for a subscriber
+IDLE_SLEEP = 0.05           # The source returned nothing: wait this long before reading again
+
+PIPELINE_SECONDS = metrics.histogram('rover_telemetry_pipeline_seconds', 'Telemetry from source read to the end of the last stage',
+                                     buckets=(1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1))
+_STOP = object()
+
+
+def _quantile(histogram, q):
+    """Histogram quantile for JSON: None when empty or above the last bucket."""
+    value = histogram.quantile(q)
+    return value if value is not None and value != float('inf') else None
+
+
+class _Worker:
+    """A stage or subscriber: callable, input queue, thread and counters."""
+    def __init__(self, kind, name, func, queue_size):
+        self.kind = kind
+        self.name = name
+        self.func = func
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        labels = {kind: name}
+        self.seconds = metrics.histogram(f'rover_telemetry_{kind}_seconds', f'Time spent in one telemetry {kind} call', labels,
+                                         buckets=(1e-6, 3e-6, 1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1))
+        self.counters = {result: metrics.counter(f'rover_telemetry_{kind}_items_total', f'Items handled by a telemetry {kind}',
+                                                 dict(labels, result=result))
+                         for result in ('out', 'filtered', 'error', 'dropped')}
+
+    def offer(self, item):
+        """Queues item; when full, drops the oldest queued one to make room."""
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.counters['dropped'].inc()
+                except queue.Empty:
+                    pass
+
+    def call(self, *args):
+        """Runs func; returns its result, or None if it filtered the item or raised."""
+        started = time.perf_counter()
+        try:
+            result = self.func(*args)
+        except Exception as e:
+            self.counters['error'].inc()
+            log.warning("Telemetry %s '%s' failed: %s", self.kind, self.name, e)
+            return None
+        finally:
+            self.seconds.observe_since(started)
+        self.counters['out' if result is not None or self.kind == 'subscriber' else 'filtered'].inc()
+        return result
+
+    def stats(self):
+        return {'name': self.name, 'queued': self.queue.qsize(),
+                **{result: counter.value for result, counter in self.counters.items()},
+                'p50_s': _quantile(self.seconds, 0.5), 'p99_s': _quantile(self.seconds, 0.99)}
+
+
+class TelemetryPipeline:
+    """
+    source -> stages -> subscribers.
+
+    :param source: Callable returning the next raw item (e.g. a serial line), or None if there is none yet.
+    :param stages: (name, func) pairs in order. func(item, timestamp) returns the item for the next stage, or None
+                   to drop it; timestamp is the source read time, so stages don't depend on their queueing delay.
+    :param clock: Anything with time(); each item is timestamped with it when the source returns it.
+    :param threaded: False runs the stages on the source thread (subscribers keep their own threads).
+    """
+    def __init__(self, source, stages, clock=time, threaded=True, queue_size=STAGE_QUEUE_SIZE):
+        self.source = source
+        self.clock = clock
+        self.threaded = threaded
+        self.stages = [_Worker('stage', name, func, queue_size) for name, func in stages]
+        self.subscribers = []
+        self.running = False
+        self.source_thread = None
+
+    def subscribe(self, name, callback, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        """callback(sample, timestamp) gets every sample leaving the last stage, on its own thread. Call before start()."""
+        self.subscribers.append(_Worker('subscriber', name, callback, queue_size))
+
+    def start(self, source_name="telemetry-source"):
+        self.running = True
+        self.source_thread = threading.Thread(target=self._source_loop, name=source_name, daemon=True)
+        workers = self.subscribers + (self.stages if self.threaded else [])
+        for worker in workers:
+            target = self._stage_loop if worker.kind == 'stage' else self._subscriber_loop
+            worker.thread = threading.Thread(target=target, args=(worker,), name=f"telemetry-{worker.name}", daemon=True)
+            worker.thread.start()
+        self.source_thread.start()
+        print(f"[Telemetry] Pipeline started: source -> {' -> '.join(s.name for s in self.stages)} -> "
+              f"[{', '.join(s.name for s in self.subscribers)}]{'' if self.threaded else ' (stages inline)'}")
+
+    def stop(self):
+        self.running = False
+        for worker in self.stages + self.subscribers:
+            worker.offer(_STOP)
+
+    def control_threads(self):
+        """The source and stage threads: the path from the serial port to odometry."""
+        return [self.source_thread] + [stage.thread for stage in self.stages if stage.thread is not None]
+
+    # --- Threads ---
+    def _source_loop(self):
+        while self.running:
+            try:
+                raw = self.source()
+            except Exception as e:
+                log.error("Telemetry source failed: %s", e)
+                time.sleep(1) # Don't spin on a persistent error
+                continue
+            if raw is None:
+                time.sleep(IDLE_SLEEP)
+                continue
+            item = (raw, self.clock.time(), time.perf_counter())
+            if self.threaded and self.stages:
+                self.stages[0].offer(item)
+            else:
+                self._run_inline(item)
+
+    def _run_inline(self, item):
+        value, timestamp, started = item
+        for stage in self.stages:
+            value = stage.call(value, timestamp)
+            if value is None:
+                return
+        self._publish((value, timestamp, started))
+
+    def _stage_loop(self, stage):
+        following = self.stages.index(stage) + 1
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                return
+            value, timestamp, started = item
+            value = stage.call(value, timestamp)
+            if value is None:
+                continue
+            if following < len(self.stages):
+                self.stages[following].offer((value, timestamp, started))
+            else:
+                self._publish((value, timestamp, started))
+
+    def _publish(self, item):
+        sample, timestamp, started = item
+        PIPELINE_SECONDS.observe_since(started)
+        for subscriber in self.subscribers:
+            subscriber.offer((sample, timestamp))
+
+    def _subscriber_loop(self, subscriber):
+        while True:
+            item = subscriber.queue.get()
+            if item is _STOP:
+                return
+            subscriber.call(*item)
+
+    def stats(self):
+        return {'threaded': self.threaded, 'stages': [stage.stats() for stage in self.stages],
+                'subscribers': [subscriber.stats() for subscriber in self.subscribers],
+                'pipeline_p50_s': _quantile(PIPELINE_SECONDS, 0.5), 'pipeline_p99_s': _quantile(PIPELINE_SECONDS, 0.99)}
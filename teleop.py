@@ -0,0 +1,190 @@
+# teleop.py - Low-latency teleop control channel
+# One persistent WebSocket per dashboard instead of a fetch('/send_command') per key press. Each new
+# HTTP request cost a Flask thread hand-off and a handler print (tens of ms), and on a lossy link two
+# requests could arrive out of order and leave the rover driving on the older one.
+#
+# Client -> server (JSON text messages, seq increasing per connection):
+#   {"seq": 12, "type": "command", "command": "forward", "t": <client ms>}
+#   {"seq": 13, "type": "speed", "speed": 60}
+#   {"seq": 14, "type": "servo", "angle": 95}
+#   {"type": "ping", "t": <client ms>}
+# Server -> client:
+#   {"type": "ack", "seq": 12, "status": "applied" | "ignored" | "superseded" | "stale" | "error",
+#    "latency_ms": <receive to actuation>, "t": <echoed client t>}
+#   {"type": "pong", "t": ...} and {"type": "telemetry", ...sample} at TELEMETRY_HZ
+#
+# Only the newest command of each type is applied: a message older than one already received on the same
+# connection is "stale", and one replaced while waiting for the actuator is "superseded". A connection
+# that drops (or goes quiet) while it has the rover moving stops the motors.
+#
+# Transports: Flask through flask-sock (pip install flask-sock) and the ASGI server's WebSocket route
+# (asgi_server.py; uvicorn needs pip install websockets). Both only call open_session / receive / close_session.
+
+import itertools
+import json
+import threading
+import time
+
+import metrics
+from rover_logging import get_logger
+
+log = get_logger('teleop')
+
+TELEMETRY_HZ = 10
+DEADMAN_SECONDS = 1.0 # A moving session that sends nothing (the dashboard pings every 250 ms) for this long stops the rover
+MOTION_COMMANDS = ('forward', 'backward', 'left', 'right')
+
+TELEOP_SESSIONS = metrics.gauge('rover_teleop_sessions', 'Open teleop WebSocket connections')
+TELEOP_MESSAGES = metrics.counter('rover_teleop_messages_total', 'Teleop messages received')
+TELEOP_DROPPED = metrics.counter('rover_teleop_dropped_total', 'Teleop commands not applied because a newer one replaced them')
+TELEOP_DEADMAN_STOPS = metrics.counter('rover_teleop_deadman_stops_total', 'Stops issued because a driving teleop session went away')
+
+
+class TeleopSession:
+    """One connection. send(dict) must be safe to call from any thread; the transport serializes it."""
+    _ids = itertools.count(1)
+
+    def __init__(self, send):
+        self.id = next(self._ids)
+        self._send = send
+        self.send_lock = threading.Lock()
+        self.last_seq = 0
+        self.last_message = time.monotonic()
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            with self.send_lock:
+                self._send(message)
+        except Exception as e: # Connection gone; the transport's receive loop will close the session
+            log.debug("Send to teleop session %d failed: %s", self.id, e)
+            self.closed = True
+
+
+class TeleopChannel:
+    """
+    Applies commands from all teleop sessions on one actuator thread, newest first.
+
+    :param actions: Dict of message type -> callable(message) run on the actuator thread; returns False if
+                    the command was ignored (e.g. automation active). 'command' must exist: the dead-man stop uses it.
+    :param telemetry_buffer: Optional stream_buffers.TelemetryBuffer whose samples are pushed to every session.
+    """
+    def __init__(self, actions, telemetry_buffer=None):
+        self.actions = actions
+        self.telemetry_buffer = telemetry_buffer
+        self.cond = threading.Condition()
+        self.pending = {} # type -> (session, message, perf_counter at receipt); the newest only
+        self.sessions = set()
+        self.driver = None # Session whose last applied command set the rover moving
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._actuator_loop, name="teleop-actuator", daemon=True).start()
+        if self.telemetry_buffer is not None:
+            threading.Thread(target=self._telemetry_loop, name="teleop-telemetry", daemon=True).start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    # --- Transport side ---
+    def open_session(self, send):
+        session = TeleopSession(send)
+        with self.cond:
+            self.sessions.add(session)
+            TELEOP_SESSIONS.set(len(self.sessions))
+        print(f"[Teleop] Session {session.id} connected.")
+        return session
+
+    def close_session(self, session):
+        print(f"[Teleop] Session {session.id} disconnected.")
+        with self.cond:
+            session.closed = True
+            self.sessions.discard(session)
+            TELEOP_SESSIONS.set(len(self.sessions))
+            self.cond.notify_all() # Wakes the actuator loop for the dead-man stop if this session was driving
+
+    def receive(self, session, text):
+        """Handles one text message. Cheap and non-blocking: safe on an asyncio loop."""
+        received = time.perf_counter()
+        session.last_message = time.monotonic()
+        TELEOP_MESSAGES.inc()
+        try:
+            message = json.loads(text)
+            kind = message.get('type')
+        except (ValueError, AttributeError):
+            session.send({'type': 'error', 'message': 'Invalid JSON message'})
+            return
+        if kind == 'ping':
+            session.send({'type': 'pong', 't': message.get('t')})
+            return
+        if kind not in self.actions:
+            session.send({'type': 'ack', 'seq': message.get('seq'), 'status': 'error', 'message': f"Unknown type: {kind}"})
+            return
+        seq = message.get('seq')
+        if not isinstance(seq, int) or seq <= session.last_seq:
+            # Overtaken on the wire by a newer message: applying it now would undo the newer one
+            session.send({'type': 'ack', 'seq': seq, 'status': 'stale', 't': message.get('t')})
+            return
+        session.last_seq = seq
+        with self.cond:
+            replaced = self.pending.get(kind)
+            self.pending[kind] = (session, message, received)
+            self.cond.notify_all()
+        if replaced is not None:
+            TELEOP_DROPPED.inc()
+            replaced[0].send({'type': 'ack', 'seq': replaced[1]['seq'], 'status': 'superseded', 't': replaced[1].get('t')})
+
+    # --- Actuator side ---
+    def _actuator_loop(self):
+        print("[Teleop] Actuator thread started.")
+        while True:
+            with self.cond:
+                while self.running and not self.pending and not self._deadman_due():
+                    self.cond.wait(timeout=0.25)
+                if not self.running:
+                    return
+                jobs = list(self.pending.items())
+                self.pending.clear()
+            for kind, (session, message, received) in jobs:
+                self._apply(kind, session, message, received)
+            if self._deadman_due():
+                driver, self.driver = self.driver, None
+                TELEOP_DEADMAN_STOPS.inc()
+                print(f"[Teleop] Session {driver.id} {'disconnected' if driver.closed else 'went quiet'} while driving: stopping.")
+                self.actions['command']({'command': 'stop'})
+
+    def _apply(self, kind, session, message, received):
+        try:
+            applied = self.actions[kind](message)
+        except Exception as e:
+            log.warning("Teleop %s failed: %s", kind, e)
+            session.send({'type': 'ack', 'seq': message['seq'], 'status': 'error', 'message': str(e), 't': message.get('t')})
+            return
+        latency = time.perf_counter() - received
+        metrics.histogram('rover_teleop_command_to_actuation_seconds', 'From teleop message receipt to the actuator call returning',
+                          {'type': kind}).observe(latency)
+        if kind == 'command' and applied is not False:
+            self.driver = session if message.get('command') in MOTION_COMMANDS else None # Whoever drove last owns the dead-man
+        session.send({'type': 'ack', 'seq': message['seq'], 'status': 'ignored' if applied is False else 'applied',
+                      'latency_ms': round(latency * 1000, 2), 't': message.get('t')})
+
+    def _deadman_due(self):
+        driver = self.driver
+        return driver is not None and (driver.closed or time.monotonic() - driver.last_message > DEADMAN_SECONDS)
+
+    def _telemetry_loop(self):
+        last_seq = 0
+        while self.running:
+            seq = self.telemetry_buffer.wait_for_new(last_seq, timeout=1.0)
+            if seq == last_seq or not self.sessions:
+                continue
+            last_seq, sample, _ = self.telemetry_buffer.get()
+            message = dict(sample, type='telemetry')
+            for session in list(self.sessions):
+                session.send(message)
+            time.sleep(1.0 / TELEMETRY_HZ) # Newest sample at most TELEMETRY_HZ times a second
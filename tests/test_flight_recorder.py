@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import flight_recorder
+from flight_recorder import FlightRecorder, FlightLog, open_flight_logs, iter_records
+from imu import ImuSample
+
+
+def record_and_close(folder, write):
+    recorder = FlightRecorder(folder=str(folder), frame_interval=0)
+    recorder.start()
+    write(recorder)
+    recorder.stop()
+    paths = sorted(os.listdir(folder))
+    assert len(paths) == 1
+    return os.path.join(folder, paths[0])
+
+
+def decoded(path):
+    log = FlightLog(path)
+    try:
+        return [(record.type_name, record.timestamp, record.decode()) for record in log.records()]
+    finally:
+        log.close()
+
+
+@pytest.mark.parametrize('length', range(0, 300, 7))
+def test_variable_length_round_trip(tmp_path, length):
+    sample = {field: float(i) for i, field in enumerate(flight_recorder.TELEMETRY_FIELDS)}
+    frame = bytes(range(256)) * (length // 64 + 1)
+
+    def write(recorder):
+        recorder.record_telemetry(sample, timestamp=100.0)
+        recorder.record_command('x' * length, 0.5, 'api', timestamp=100.1)
+        recorder.record_state('idle', 's' * length, timestamp=100.2)
+        recorder.record_targets(2.0, 90.0, timestamp=100.3)
+        recorder._enqueue(flight_recorder.FRAME, frame[:length], 100.4)
+        recorder.record_imu(ImuSample(100.5, 45.0, -2.5, 1.25, 30.0))
+
+    path = record_and_close(tmp_path, write)
+    records = decoded(path)
+    assert [name for name, _, _ in records] == ['telemetry', 'command', 'state', 'targets', 'frame', 'imu']
+    assert [ts for _, ts, _ in records] == [100.0, 100.1, 100.2, 100.3, 100.4, 100.5]
+    assert records[0][2] == sample
+    assert records[1][2] == {'command': 'x' * length, 'speed': 0.5, 'source': 'api'}
+    assert records[2][2] == {'from': 'idle', 'to': 's' * length}
+    assert records[3][2] == {'distance': 2.0, 'direction': 90.0}
+    assert records[4][2] == frame[:length]
+    assert records[5][2] == {'yaw': 45.0, 'pitch': -2.5, 'roll': 1.25, 'yaw_rate': 30.0}
+
+
+@pytest.mark.parametrize('length', range(161, 166))
+def test_footer_is_not_read_as_a_record(tmp_path, length):
+    # These lengths put the last index block at an offset whose low byte (the footer's first byte) is 1-5
+    def write(recorder):
+        recorder.record_telemetry({}, timestamp=100.0)
+        recorder.record_command('x' * length, 0.0, 'api', timestamp=100.1)
+
+    path = record_and_close(tmp_path, write)
+    assert FlightLog(path).complete
+    assert [name for name, _, _ in decoded(path)] == ['telemetry', 'command']
+
+
+def test_log_without_trailer_is_recovered(tmp_path):
+    def write(recorder):
+        for i in range(50):
+            recorder.record_command('c' * i, float(i), 'api', timestamp=100.0 + i * 0.05)
+
+    path = record_and_close(tmp_path, write)
+    with open(path, 'rb') as f:
+        data = f.read()
+    trailer_at = len(data) - flight_recorder.FOOTER.size - flight_recorder.TRAILER.size - flight_recorder.RECORD_HEADER.size
+    with open(path, 'wb') as f:
+        f.write(data[:trailer_at - 5]) # Power cut: no trailer or footer, and the record before them cut short
+    logs = open_flight_logs(path)
+    assert not logs[0].complete
+    commands = [record.decode()['command'] for record in iter_records(logs)]
+    assert commands == ['c' * i for i in range(len(commands))]
+    assert len(commands) >= 48
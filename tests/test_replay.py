@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A short sim mission: drive by hand, then turn to 45° and drive 0.5 m under automation
+RECORD_MISSION = """
+import sys, time
+import app
+app.flight_recorder.folder = sys.argv[1]
+app.start_services()
+client = app.app.test_client()
+time.sleep(1.0)
+client.post('/send_command', json={'command': 'forward'})
+time.sleep(1.0)
+client.post('/send_command', json={'command': 'stop'})
+time.sleep(0.5)
+client.post('/send_distance', json={'distance': 0.5})
+client.post('/send_direction', json={'direction': 45})
+client.post('/send_command', json={'command': 'start_automation'})
+deadline = time.time() + 30
+while app.automation_controller.is_active() and time.time() < deadline:
+    time.sleep(0.1)
+time.sleep(0.5)
+app.stop_services()
+"""
+
+# replay.py with the controller turning and driving faster than the one that made the recording
+REPLAY_CHANGED_CONTROLLER = """
+import sys
+import automation_controller
+original_init = automation_controller.AutomationController.__init__
+def faster_init(self, *args, **kwargs):
+    original_init(self, *args, **kwargs)
+    self.automation_speed = 40
+automation_controller.AutomationController.__init__ = faster_init
+import replay
+sys.argv = ['replay.py'] + sys.argv[1:]
+replay.main()
+"""
+
+
+def run(args, env=None):
+    environ = {key: value for key, value in os.environ.items() if not key.startswith('ROVER_')}
+    environ.update(env or {})
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=environ, capture_output=True, text=True, timeout=120)
+
+
+def record_mission(folder, **env):
+    result = run(['-c', RECORD_MISSION, str(folder)], dict(env, ROVER_SIM='1', ROVER_FLIGHT_RECORDER='1'))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert os.listdir(folder)
+    return folder
+
+
+@pytest.fixture(scope='module')
+def mission(tmp_path_factory):
+    return record_mission(tmp_path_factory.mktemp('flight'))
+
+
+def replay_report(result, path):
+    assert result.returncode in (0, 1), result.stdout + result.stderr
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_recorded_mission_replays_as_a_match(mission, tmp_path):
+    report_path = tmp_path / 'report.json'
+    result = run(['replay.py', str(mission), '--speed', '0', '--report', str(report_path)])
+    report = replay_report(result, report_path)
+    assert report['states']['replayed'] == ['STARTED', 'TURNING', 'DRIVING', 'FINISHED', 'IDLE']
+    assert report['states']['match']
+    assert report['automation_commands']['first_divergence'] is None
+    assert report['automation_commands']['replayed'] == report['automation_commands']['recorded']
+    assert report['max_pose_error_m'] < 0.01
+    assert result.returncode == 0
+
+
+def test_changed_controller_is_flagged(mission, tmp_path):
+    report_path = tmp_path / 'report.json'
+    result = run(['-c', REPLAY_CHANGED_CONTROLLER, str(mission), '--speed', '0', '--report', str(report_path)])
+    report = replay_report(result, report_path)
+    divergence = report['automation_commands']['first_divergence']
+    assert divergence['recorded']['speed'] == 30
+    assert divergence['replayed']['speed'] == 40
+    assert result.returncode == 1
+
+
+def test_imu_mission_replays_as_a_match(tmp_path):
+    mission = record_mission(tmp_path / 'flight', ROVER_IMU='1')
+    report_path = tmp_path / 'report.json'
+    result = run(['replay.py', str(mission), '--speed', '0', '--report', str(report_path)])
+    report = replay_report(result, report_path)
+    assert report['imu_samples'] > 0
+    assert report['automation_commands']['first_divergence'] is None
+    assert report['max_pose_error_m'] < 1e-4
+    assert result.returncode == 0
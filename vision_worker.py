@@ -0,0 +1,122 @@
+# vision_worker.py - QR detection in separate processes, fed by the shared-memory frame bus
+# Each worker attaches to the bus by name and runs detect_qr() on the frames in place (no copy, no
+# pickling of images). With N workers the frames are sharded by seq, so detection scales across the
+# Pi's cores while the Flask process keeps its GIL for control. Only the small results (payload +
+# corner points, plus one JPEG the first time a code is seen) travel back, over a multiprocessing queue.
+
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_bus import FrameBus, BUS_NAME
+
+VISION_WORKERS_ENV = "ROVER_VISION_WORKERS"
+
+
+def run_vision_worker(bus_name, shard_index, shard_count, results, stop_event, record):
+    """Worker process main loop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C hits the whole process group; the parent stops us via stop_event
+    # Not isolation: a spawned child re-runs the parent's __main__ (app.py, as __mp_main__) before this,
+    # so app.py's module-level setup runs here too. It opens no hardware and starts no threads (that is
+    # start_services(), not reached in the child); keep it that way.
+    from qr import detect_qr
+    from realtime import enter_vision_process
+    enter_vision_process() # ROVER_REALTIME=1: onto the vision CPUs, away from the control threads' core
+    bus = FrameBus.attach(bus_name, untrack=False) # We share the parent's resource tracker
+    reader = bus.reader(f"vision-{shard_index}", mode='latest', shard=(shard_index, shard_count))
+    print(f"[Vision {shard_index}] Attached to '{bus_name}' (shard {shard_index + 1}/{shard_count}).")
+    frames = 0
+    recorded = set() # Payloads whose image we already sent back for the store
+    try:
+        while not stop_event.is_set():
+            bus_frame = reader.read(timeout=1.0)
+            if bus_frame is None:
+                continue
+            if bus_frame.frame is not None:
+                img = bus_frame.frame # A view into shared memory: no copy
+            elif bus_frame.jpeg is not None:
+                img = cv2.imdecode(bus_frame.jpeg, cv2.IMREAD_COLOR) # JPEG passthrough frames: decode here, not in Flask
+            else:
+                continue
+            started = time.perf_counter()
+            data, bbox = detect_qr(img)
+            seconds = time.perf_counter() - started
+            if not bus_frame.valid(): # The writer lapped us while we were looking; the pixels may be torn
+                continue
+            frames += 1
+            if data:
+                jpeg = None
+                if record and data not in recorded: # New code: send the image along, the parent stores it
+                    recorded.add(data)
+                    jpeg = cv2.imencode('.jpg', img)[1].tobytes()
+                corners = np.asarray(bbox, dtype=np.float32).tolist() if bbox is not None else None
+                results.put((bus_frame.seq, bus_frame.timestamp, data, corners, seconds, jpeg))
+    finally:
+        print(f"[Vision {shard_index}] Stopping after {frames} frames ({reader.torn} torn reads skipped).")
+        reader.close()
+        bus.close()
+
+
+class VisionWorkers:
+    """
+    Starts and supervises the QR worker processes and delivers their detections to a callback.
+
+    :param on_detection: Called in the parent as on_detection(data, bbox, seq, timestamp, seconds).
+    :param workers: Number of processes (frames are split between them by seq).
+    :param bus_name: Shared-memory name of the frame bus.
+    :param record: Save/log new QR codes (the workers send the image back; qr.record_detection runs here, in the parent).
+    """
+    def __init__(self, on_detection, workers=1, bus_name=BUS_NAME, record=True):
+        self.on_detection = on_detection
+        self.workers = workers
+        self.bus_name = bus_name
+        self.record = record
+        self.context = multiprocessing.get_context('spawn') # Never fork a process that is running threads
+        self.results = self.context.Queue(maxsize=256)
+        self.stop_event = self.context.Event()
+        self.processes = []
+        self.result_thread = None
+
+    def start(self):
+        for index in range(self.workers):
+            process = self.context.Process(target=run_vision_worker, name=f"vision-{index}", daemon=True,
+                                           args=(self.bus_name, index, self.workers, self.results, self.stop_event, self.record))
+            process.start()
+            self.processes.append(process)
+        self.result_thread = threading.Thread(target=self._deliver_results, name="vision-results", daemon=True)
+        self.result_thread.start()
+        print(f"[Vision] Started {self.workers} QR worker process(es).")
+
+    def _deliver_results(self):
+        from qr import record_detection # Runs here in the parent, so only one process writes the image store
+        while not self.stop_event.is_set():
+            try:
+                seq, timestamp, data, corners, seconds, jpeg = self.results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            bbox = np.asarray(corners, dtype=np.float32) if corners is not None else None
+            try:
+                if jpeg is not None:
+                    record_detection(None, data, jpeg=jpeg)
+                self.on_detection(data, bbox, seq, timestamp, seconds)
+            except Exception as e:
+                print(f"[Vision] Detection callback failed: {e}")
+
+    def alive(self):
+        return sum(process.is_alive() for process in self.processes)
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            try:
+                process.join(timeout=3)
+            except KeyboardInterrupt: # Second Ctrl-C: don't wait any longer
+                pass
+            if process.is_alive():
+                process.terminate()
+        print("[Vision] Worker processes stopped.")